@@ -19,14 +19,45 @@ export namespace Endpoints
         return `http://localhost:8000/music/download-result/${jobId}`;
     }
 
+    //What has been transcribed so far, the full result once the job is done
+    export function PartialResult(jobId: number): string
+    {
+        return `http://localhost:8000/music/partial-result/${jobId}`;
+    }
+
+    //Note array of the result for piano roll rendering, "binary" is the compact format documented by the backend
+    export function ResultNotes(jobId: number, format: "json" | "binary" = "json"): string
+    {
+        const baseURL = new URL(`http://localhost:8000/music/result-notes/${jobId}`);
+        baseURL.searchParams.set("format", format);
+        return baseURL.toString();
+    }
+
+    //mp3 rendering of the result, built by the backend on first request
+    export function ResultPreview(jobId: number): string
+    {
+        return `http://localhost:8000/music/result-preview/${jobId}`;
+    }
+
     export function CancelJob(jobId: number): string
     {
         return `http://localhost:8000/music/terminate/${jobId}`;
     }
 
-    export function ListJobs(): string
+    export function JobEvents(jobId?: number): string
     {
-        return `http://localhost:8000/music/status/all`;
+        const baseURL = new URL("http://localhost:8000/music/events");
+        if(jobId !== undefined) baseURL.searchParams.set("job_id", jobId.toString());
+        return baseURL.toString();
+    }
+
+    //Newest jobs first, older pages can be fetched by passing the "X-Next-Cursor" header as the cursor
+    export function ListJobs(limit: number = 200, cursor?: number): string
+    {
+        const baseURL = new URL("http://localhost:8000/music/status/all");
+        baseURL.searchParams.set("limit", limit.toString());
+        if(cursor !== undefined) baseURL.searchParams.set("cursor", cursor.toString());
+        return baseURL.toString();
     }
 }
 
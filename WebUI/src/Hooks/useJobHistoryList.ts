@@ -1,7 +1,7 @@
 import { useQuery, useQueryClient } from "@tanstack/react-query";
-import { IJobStatus } from "../types";
+import { IJobEvent, IJobStatus } from "../types";
 import { Endpoints } from "../Endpoints/Endpoints";
-import { useCallback } from "react";
+import React, { useCallback } from "react";
 
 const jobHistoryKey = "transcription-job-history" as const;
 
@@ -21,10 +21,25 @@ export function useJobHistory() : IJobHistory
             );
 
             return (await response.json()) as IJobStatus[];
-        },
-        refetchInterval: 60000
+        }
     });
 
+    //Refetch only when a job is created or finishes, instead of polling
+    const client = useQueryClient();
+    React.useEffect(() => {
+        const source = new EventSource(Endpoints.JobEvents());
+        const invalidate = () => client.invalidateQueries({ queryKey: [jobHistoryKey] });
+
+        source.addEventListener("open", invalidate);
+        source.addEventListener("resync", invalidate);
+        source.addEventListener("status", (message: MessageEvent) => {
+            const event = JSON.parse(message.data) as IJobEvent;
+            if(event.done || event.status === "NONE") invalidate();
+        });
+
+        return () => source.close();
+    }, [client]);
+
     return {
         jobHistories: jobHistoryQuery.data || [],
         polling: jobHistoryQuery.isFetching
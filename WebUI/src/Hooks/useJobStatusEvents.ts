@@ -0,0 +1,70 @@
+import React from "react"
+import { IJobEvent, IJobStatus } from "../types";
+import { Endpoints } from "../Endpoints/Endpoints";
+
+export interface IJobStatusEvents
+{
+    data: IJobStatus | undefined,
+    isError: boolean,
+    //Incremented whenever a longer partial result is available
+    partialResultVersion: number
+}
+
+//Follows a job's status through the server's event stream instead of polling it.
+//The full status is only fetched on (re)connect & resync, transitions are applied from the events
+export function useJobStatusEvents(jobId: number | undefined) : IJobStatusEvents
+{
+    const [data, setData] = React.useState<IJobStatus | undefined>(undefined);
+    const [isError, setIsError] = React.useState<boolean>(false);
+    const [partialResultVersion, setPartialResultVersion] = React.useState<number>(0);
+
+    React.useEffect(() => {
+        setData(undefined);
+        setIsError(false);
+        setPartialResultVersion(0);
+
+        if(jobId === undefined) return;
+
+        const source = new EventSource(Endpoints.JobEvents(jobId));
+
+        const refreshAsync = async () => {
+            try
+            {
+                const response = await fetch(Endpoints.PollJob(jobId));
+                const status = (await response.json()) as IJobStatus;
+                setData(status);
+                if(status.done) source.close();
+            }
+            catch(e)
+            {
+                console.error(`[job-events] Failed to fetch status of job ${jobId}`, e);
+                setIsError(true);
+                source.close();
+            }
+        };
+
+        const onStatus = (message: MessageEvent) => {
+            const event = JSON.parse(message.data) as IJobEvent;
+            setData((prev) => prev === undefined ? prev : {
+                ...prev,
+                status: event.status ?? prev.status,
+                done: event.done
+            });
+            if(event.done) source.close();
+        };
+
+        source.addEventListener("open", refreshAsync);
+        source.addEventListener("resync", refreshAsync);
+        source.addEventListener("terminate-requested", refreshAsync);
+        source.addEventListener("status", onStatus);
+        source.addEventListener("partial-result", () => setPartialResultVersion((prev) => prev + 1));
+
+        return () => source.close();
+    }, [jobId]);
+
+    return {
+        data,
+        isError,
+        partialResultVersion
+    };
+}
@@ -1,14 +1,17 @@
 import React from "react"
 import { useQuery } from '@tanstack/react-query';
-import { IJobStatus, TTranscriptionMode } from '../types';
+import { TTranscriptionMode } from '../types';
 import { GetFilenameWithoutExtension, IsSuccessfulResponse } from "../util";
 import { useToast } from "./useToast";
 import { Endpoints } from "../Endpoints/Endpoints";
 import { useInvalidateJobHistory } from "./useJobHistoryList";
+import { useJobStatusEvents } from "./useJobStatusEvents";
 
 export interface ITranscriptionJobStatus
 {
+    //The partial result while a long recording is being transcribed, see "partial"
     data: Blob | undefined
+    partial: boolean,
     filename: string | undefined,
 
     isFetching: boolean,
@@ -93,43 +96,24 @@ export function useTranscriptionJob() : ITranscriptionJobStatus
     }
     , [postJobQuery.isError])
 
-    const pollJobQuery = useQuery({
-        queryKey: ["transcription-poll-job", jobId],
-        queryFn: async ({queryKey}) => {
-            const [_, jobId] =  queryKey as [string, number];
-            const response = await fetch(
-                Endpoints.PollJob(jobId)
-            );
+    const jobStatusEvents = useJobStatusEvents(jobId);
 
-            return await response.json().then(
-                json => {
-                    const response = json as IJobStatus;
-                    setStatus(response.status);
-                    return response;
-                }
-            )
-        },
-        refetchInterval: (query) => {
-            const data = query.state.data;
-            if(data !== undefined && data.done) return false;
-            else return 3000;
-        },
-        retry: false,
-        enabled: (jobId !== undefined),
-        refetchOnWindowFocus: false
-    });
+    React.useEffect(() => {
+        if(jobStatusEvents.data !== undefined) setStatus(jobStatusEvents.data.status);
+    }
+    , [jobStatusEvents.data])
 
     React.useEffect(() => {
-        if(pollJobQuery.isError) 
+        if(jobStatusEvents.isError) 
         {
             _toast.error(`Failed to process job ID<${jobId}>`);
             setIsFetching(false); 
             _refreshJobHistoryAsync();
         }
     }
-    , [pollJobQuery.isError, jobId])
+    , [jobStatusEvents.isError, jobId])
     
-    const jobComplete: boolean = pollJobQuery.data?.done || false;
+    const jobComplete: boolean = jobStatusEvents.data?.done || false;
 
     const downloadDataQuery = useQuery({
         queryKey: ["transcription-download", jobId],
@@ -137,7 +121,7 @@ export function useTranscriptionJob() : ITranscriptionJobStatus
             try
             {
                 const [_, jobId] =  queryKey as [string, number];
-                if(pollJobQuery.data?.request_terminate === true)
+                if(jobStatusEvents.data?.request_terminate === true)
                 {
                     _toast.info(`Job ${jobId} cancelled successfully`);
                     return;
@@ -171,6 +155,27 @@ export function useTranscriptionJob() : ITranscriptionJobStatus
         refetchOnWindowFocus: false
     });
 
+    //Previewed until the full result is downloaded
+    const partialDataQuery = useQuery({
+        queryKey: ["transcription-partial", jobId, jobStatusEvents.partialResultVersion],
+        queryFn: async ({queryKey}) => {
+            const [_, jobId] =  queryKey as [string, number, number];
+            const response = await fetch(
+                Endpoints.PartialResult(jobId)
+            );
+            if(!IsSuccessfulResponse(response.status)) throw new Error(await response.text());
+
+            return await response.blob();
+        },
+        //Keeps showing the previous partial result of the same job while the next one loads
+        placeholderData: (previousData, previousQuery) => previousQuery?.queryKey[1] === jobId ? previousData : undefined,
+        enabled: jobId !== undefined && jobStatusEvents.partialResultVersion > 0 && !jobComplete,
+        retry: false,
+        refetchOnWindowFocus: false
+    });
+
+    const partial: boolean = downloadDataQuery.data === undefined && partialDataQuery.data !== undefined;
+
     const cancelJobQuery = useQuery({
         queryKey: ["transcription-cancel", jobId],
 
@@ -211,10 +216,11 @@ export function useTranscriptionJob() : ITranscriptionJobStatus
     }
 
     return {
-        data: downloadDataQuery.data,
+        data: partial ? partialDataQuery.data : downloadDataQuery.data,
+        partial,
         filename,
         isFetching,
-        ready,
+        ready: ready || partial,
         status,
         jobId,
         cancellable: isFetching && jobId !== undefined,
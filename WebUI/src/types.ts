@@ -14,7 +14,7 @@ export const supportedModes = new Set<TTranscriptionMode>([
   "vocal"
 ])
 
-export const StatusCodeList = ["NONE" , "RUNNING" , "DONE" , "STOPPING" , "TERMINATED" , "ERROR"] as const;
+export const StatusCodeList = ["NONE" , "QUEUED" , "RUNNING" , "DONE" , "STOPPING" , "TERMINATED" , "ERROR" , "OOM_KILLED"] as const;
 //type TStatusCode = typeof StatusCodeList[number];
 
 export function IsJobReady(status: string) : boolean 
@@ -31,5 +31,18 @@ export interface IJobStatus
     end_time?: string,
     request_terminate: boolean,
     status: string,
-    done: boolean
+    done: boolean,
+    audio_duration?: number,
+    progress?: number,
+    eta_seconds?: number
+}
+
+export interface IJobEvent
+{
+    event_id: number,
+    type: "status" | "result" | "partial-result" | "terminate-requested" | "resync",
+    job_id?: number,
+    status?: string,
+    done: boolean,
+    time: string
 }
\ No newline at end of file
@@ -0,0 +1,76 @@
+import math
+import os
+import shutil
+import struct
+import subprocess
+import wave
+from dataclasses import dataclass
+from typing import List, Optional
+
+#Formats other than .wav are encoded with ffmpeg, they are skipped when it's not installed
+#"wav-mono" matches what most modes read (44.1kHz mono), so it isn't converted at all
+SYNTHETIC_FORMATS: List[str] = ["wav", "wav-mono", "wav-mono-16k", "flac", "mp3", "ogg"];
+
+@dataclass
+class TSyntheticAudio:
+    path: str
+    format: str
+    durationSeconds: float
+    size: int
+
+#A chord of sine tones with a little amplitude modulation, so the encoders have something to compress
+def WriteSyntheticWav(path: str, durationSeconds: float, sampleRate: int = 44100, channels: int = 2) -> None:
+    frequencies: List[float] = [261.63, 329.63, 392.00];
+    frameCount: int = int(durationSeconds * sampleRate);
+    #One second of samples, repeated, generating every frame in python takes too long for long recordings
+    periodFrames: int = sampleRate;
+
+    period: bytearray = bytearray();
+    for frameNo in range(periodFrames):
+        t: float = frameNo / sampleRate;
+        envelope: float = 0.6 + 0.4 * math.sin(2 * math.pi * 2 * t);
+        sample: float = envelope * sum(math.sin(2 * math.pi * frequency * t) for frequency in frequencies) / len(frequencies);
+        period += struct.pack("<h", int(sample * 20000)) * channels;
+
+    with wave.open(path, "wb") as hWav:
+        hWav.setnchannels(channels);
+        hWav.setsampwidth(2);
+        hWav.setframerate(sampleRate);
+
+        remainingFrames: int = frameCount;
+        while remainingFrames > 0:
+            frames: int = min(remainingFrames, periodFrames);
+            hWav.writeframes(bytes(period[:frames * 2 * channels]));
+            remainingFrames -= frames;
+
+def IsFfmpegAvailable() -> bool:
+    return not shutil.which("ffmpeg") is None;
+
+#Returns None when the format needs ffmpeg & it isn't available
+def CreateSyntheticAudio(dir: str, format: str, durationSeconds: float) -> Optional[TSyntheticAudio]:
+    os.makedirs(dir, exist_ok=True);
+    baseName: str = f"synthetic-{durationSeconds:g}s";
+
+    if format == "wav":
+        path: str = os.path.join(dir, f"{baseName}.wav");
+        WriteSyntheticWav(path, durationSeconds);
+    elif format == "wav-mono":
+        path = os.path.join(dir, f"{baseName}-mono.wav");
+        WriteSyntheticWav(path, durationSeconds, channels=1);
+    elif format == "wav-mono-16k":
+        path = os.path.join(dir, f"{baseName}-mono-16k.wav");
+        WriteSyntheticWav(path, durationSeconds, sampleRate=16000, channels=1);
+    else:
+        if not IsFfmpegAvailable():
+            return None;
+
+        sourcePath: str = os.path.join(dir, f"{baseName}.source.wav");
+        if not os.path.isfile(sourcePath):
+            WriteSyntheticWav(sourcePath, durationSeconds);
+        path = os.path.join(dir, f"{baseName}.{format}");
+        subprocess.run(
+            ["ffmpeg", "-y", "-loglevel", "error", "-i", sourcePath, path],
+            check=True
+        );
+
+    return TSyntheticAudio(path, format, durationSeconds, os.path.getsize(path));
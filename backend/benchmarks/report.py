@@ -0,0 +1,127 @@
+import json
+import math
+import os
+import platform
+import subprocess
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+BASELINE_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines");
+
+@dataclass
+class TLatencySummary:
+    p50: float
+    p95: float
+    p99: float
+    max: float
+    mean: float
+
+@dataclass
+class TBenchmarkResult:
+    name: str
+    requests: int
+    errors: int
+    concurrency: int
+    wallSeconds: float
+    throughput: float #successful requests per second
+    latencyMs: TLatencySummary
+    params: Dict[str, Any] = field(default_factory=dict)
+
+@dataclass
+class TBenchmarkReport:
+    createdAt: str
+    environment: Dict[str, Any]
+    config: Dict[str, Any]
+    results: List[TBenchmarkResult]
+
+#Nearest rank
+def Percentile(sortedValues: List[float], percent: float) -> float:
+    if len(sortedValues) == 0:
+        return 0;
+    rank: int = max(1, math.ceil(percent / 100 * len(sortedValues)));
+    return sortedValues[rank - 1];
+
+def SummariseLatencies(latenciesSeconds: List[float]) -> TLatencySummary:
+    latenciesMs: List[float] = sorted(latency * 1000 for latency in latenciesSeconds);
+    return TLatencySummary(
+        p50=round(Percentile(latenciesMs, 50), 3),
+        p95=round(Percentile(latenciesMs, 95), 3),
+        p99=round(Percentile(latenciesMs, 99), 3),
+        max=round(latenciesMs[-1], 3) if len(latenciesMs) > 0 else 0,
+        mean=round(sum(latenciesMs) / len(latenciesMs), 3) if len(latenciesMs) > 0 else 0
+    );
+
+def _GetGitCommit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip();
+    except (OSError, subprocess.CalledProcessError):
+        return None;
+
+def GetEnvironment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpuCount": os.cpu_count(),
+        "gitCommit": _GetGitCommit()
+    };
+
+def CreateReport(config: Dict[str, Any], results: List[TBenchmarkResult]) -> TBenchmarkReport:
+    return TBenchmarkReport(datetime.now().isoformat(), GetEnvironment(), config, results);
+
+def WriteReport(report: TBenchmarkReport, path: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True);
+    with open(path, "w") as hFile:
+        json.dump(asdict(report), hFile, indent=2);
+
+def ReadReport(path: str) -> TBenchmarkReport:
+    with open(path, "r") as hFile:
+        data: Dict[str, Any] = json.load(hFile);
+
+    results: List[TBenchmarkResult] = [
+        TBenchmarkResult(**{**result, "latencyMs": TLatencySummary(**result["latencyMs"])})
+        for result in data["results"]
+    ];
+    return TBenchmarkReport(data["createdAt"], data["environment"], data["config"], results);
+
+def GetBaselinePath(name: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{name}.json");
+
+#Returns a description of every regression beyond "tolerance" (0.2 = 20% worse),
+#p95 latency & throughput are compared for benchmarks present in both reports
+def FindRegressions(baseline: TBenchmarkReport, current: TBenchmarkReport, tolerance: float) -> List[str]:
+    baselineResults: Dict[str, TBenchmarkResult] = {result.name: result for result in baseline.results};
+    regressions: List[str] = [];
+
+    for result in current.results:
+        baselineResult: Optional[TBenchmarkResult] = baselineResults.get(result.name);
+        if baselineResult is None:
+            continue;
+
+        if baselineResult.latencyMs.p95 > 0 and result.latencyMs.p95 > baselineResult.latencyMs.p95 * (1 + tolerance):
+            regressions.append(
+                f"{result.name}: p95 {result.latencyMs.p95:.1f}ms vs baseline {baselineResult.latencyMs.p95:.1f}ms"
+            );
+        if baselineResult.throughput > 0 and result.throughput < baselineResult.throughput * (1 - tolerance):
+            regressions.append(
+                f"{result.name}: throughput {result.throughput:.1f}/s vs baseline {baselineResult.throughput:.1f}/s"
+            );
+        if result.errors > baselineResult.errors:
+            regressions.append(f"{result.name}: {result.errors} errors vs baseline {baselineResult.errors}");
+
+    return regressions;
+
+def FormatResults(results: List[TBenchmarkResult]) -> str:
+    lines: List[str] = [
+        f"{'benchmark':<48} {'reqs':>6} {'errs':>5} {'conc':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    ];
+    for result in results:
+        lines.append(
+            f"{result.name:<48} {result.requests:>6} {result.errors:>5} {result.concurrency:>5} {result.throughput:>9.1f} "
+            f"{result.latencyMs.p50:>9.1f} {result.latencyMs.p95:>9.1f} {result.latencyMs.p99:>9.1f} {result.latencyMs.max:>9.1f}"
+        );
+    return "\n".join(lines);
@@ -0,0 +1,558 @@
+#End-to-end benchmarks of the transcription API, run from the backend directory:
+#   python -m benchmarks.run [--save-baseline NAME] [--compare NAME]
+#The app is served in-process against a throwaway DB & data directory, omnizart is replaced by
+#src/mock/omnizart_mock.py, which sleeps or burns CPU to stand in for inference (see --mock-inference)
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Callable, Awaitable, Optional, Tuple
+
+import httpx
+
+from .server import InProcessServer
+from .audio import CreateSyntheticAudio, TSyntheticAudio, SYNTHETIC_FORMATS
+from .report import (
+    TBenchmarkResult, CreateReport, WriteReport, ReadReport, SummariseLatencies,
+    FindRegressions, FormatResults, GetBaselinePath
+)
+
+TRequestFunction = Callable[[httpx.AsyncClient, int], Awaitable[bool]];
+
+#Added to the request numbers of these benchmarks' uploads, so they differ from the uploads of the other benchmarks
+MIXED_REQUEST_NO_OFFSET: int = 1_000_000;
+FAIR_SHARE_REQUEST_NO_OFFSET: int = 2_000_000;
+#Clients of the fair share benchmark
+HEAVY_CLIENT_API_KEY: str = "benchmark-heavy";
+NORMAL_CLIENT_API_KEY: str = "benchmark-normal";
+
+def ParseArgs() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks the transcription API in-process");
+    parser.add_argument("--port", type=int, default=18765);
+    parser.add_argument("--work-dir", help="DB, uploads & results go here, defaults to a temporary directory that is removed afterwards");
+    parser.add_argument("--only", help="comma separated benchmarks to run: transcribe,transcribe_mixed,transcribe_fair,status,status_all,download");
+
+    parser.add_argument("--formats", default="wav,wav-mono,mp3", help=f"synthetic audio formats, any of {','.join(SYNTHETIC_FORMATS)}");
+    parser.add_argument("--durations", default="5,30,120", help="synthetic audio durations in seconds");
+    parser.add_argument("--jobs", type=int, default=20, help="transcription jobs per format & duration");
+    parser.add_argument("--workers", type=int, default=2, help="TRANSCRIBER_MAX_CONCURRENT_JOBS");
+    parser.add_argument("--warm-workers", choices=["0", "1"], default="1", help="TRANSCRIBER_USE_WARM_WORKERS");
+    parser.add_argument("--mock-inference", choices=["none", "sleep", "cpu"], default="sleep");
+    parser.add_argument("--mock-fixed-seconds", type=float, default=0.05);
+    parser.add_argument("--mock-seconds-per-audio-second", type=float, default=0.002);
+
+    parser.add_argument("--history-rows", type=int, default=10000, help="finished jobs inserted before the read benchmarks");
+    parser.add_argument("--requests", type=int, default=2000, help="requests per read benchmark");
+    parser.add_argument("--warmup", type=int, default=50, help="unmeasured requests before each read benchmark");
+    parser.add_argument("--concurrency", type=int, default=16);
+
+    parser.add_argument("--output", help="writes the report to this path");
+    parser.add_argument("--save-baseline", metavar="NAME", help="saves the report as benchmarks/baselines/NAME.json");
+    parser.add_argument("--compare", metavar="NAME", help="compares against benchmarks/baselines/NAME.json, exits with 1 on regressions");
+    parser.add_argument("--tolerance", type=float, default=0.2, help="regression threshold for --compare, 0.2 = 20%% worse");
+    parser.add_argument("--seed", type=int, default=1);
+    return parser.parse_args();
+
+#Has to run before anything from src is imported, the app reads its configuration at import time
+def ConfigureEnvironment(args: argparse.Namespace, workDir: str) -> None:
+    os.environ.setdefault("PICCOLO_CONF", "src.piccolo_conf");
+    os.environ["TRANSCRIBER_DB_ENGINE"] = os.environ.get("TRANSCRIBER_DB_ENGINE", "sqlite");
+    os.environ.setdefault("TRANSCRIBER_NODE_ID", "benchmark");
+    os.environ["TRANSCRIBER_SQLITE_PATH"] = os.path.join(workDir, "db.sqlite");
+    os.environ["TRANSCRIBER_UPLOAD_DIR"] = os.path.join(workDir, "uploads");
+    os.environ["TRANSCRIBER_RESULT_STORE_DIR"] = os.path.join(workDir, "results");
+    os.environ["TRANSCRIBER_MAX_CONCURRENT_JOBS"] = str(args.workers);
+    os.environ["TRANSCRIBER_USE_WARM_WORKERS"] = args.warm_workers;
+    os.environ["TRANSCRIBER_MAX_QUEUED_JOBS"] = str(max(100, args.jobs * 2));
+    os.environ["TRANSCRIBER_MOCK_INFERENCE"] = args.mock_inference;
+    os.environ["TRANSCRIBER_MOCK_FIXED_SECONDS"] = str(args.mock_fixed_seconds);
+    os.environ["TRANSCRIBER_MOCK_SECONDS_PER_AUDIO_SECOND"] = str(args.mock_seconds_per_audio_second);
+    #All requests come from one address, the load generator would only measure the rate limits
+    os.environ["TRANSCRIBER_SUBMISSIONS_PER_MINUTE"] = "0";
+    os.environ["TRANSCRIBER_MAX_ACTIVE_JOBS_PER_CLIENT"] = "0";
+    os.environ["TRANSCRIBER_API_KEYS"] = f"{HEAVY_CLIENT_API_KEY},{NORMAL_CLIENT_API_KEY}";
+    #The seeded history must stay in place while it is read
+    os.environ["TRANSCRIBER_MAINTENANCE_INTERVAL_SECONDS"] = "0";
+
+    from src.constants import CONST
+    CONST.MOCK_OMNIZART = True;
+    CONST.MOCK_OMNIZART_ERROR = False;
+
+#Inserts finished jobs directly, so list queries run against a realistic amount of history
+def SeedHistory(rowCount: int, rng: random.Random) -> None:
+    from src.schemas import TranscriptionJob, JobStatus, StatusName
+
+    modes: List[str] = ["music", "vocal", "drum"];
+    statuses: List[str] = [StatusName(JobStatus.DONE)] * 8 + [StatusName(JobStatus.ERROR), StatusName(JobStatus.TERMINATED)];
+    startTime: datetime = datetime.now() - timedelta(days=90);
+
+    for chunkStart in range(0, rowCount, 500):
+        rows: List[TranscriptionJob] = [];
+        for rowNo in range(chunkStart, min(rowCount, chunkStart + 500)):
+            jobStart: datetime = startTime + timedelta(minutes=rowNo * 10);
+            rows.append(TranscriptionJob(
+                filename=f"history-{rowNo}.mp3",
+                mode=rng.choice(modes),
+                start_time=jobStart,
+                end_time=jobStart + timedelta(seconds=rng.uniform(30, 600)),
+                request_terminate=False,
+                status=rng.choice(statuses),
+                msg="",
+                completed_job=None
+            ));
+        TranscriptionJob.insert(*rows).run_sync();
+
+async def RunLoad(
+    client: httpx.AsyncClient,
+    name: str,
+    makeRequest: TRequestFunction,
+    requestCount: int,
+    concurrency: int,
+    params: Dict[str, Any]) -> TBenchmarkResult:
+
+    latencies: List[float] = [];
+    errors: int = 0;
+    nextRequestNo: int = 0;
+
+    async def Worker() -> None:
+        nonlocal errors, nextRequestNo;
+        while nextRequestNo < requestCount:
+            requestNo: int = nextRequestNo;
+            nextRequestNo += 1;
+
+            start: float = time.perf_counter();
+            try:
+                succeeded: bool = await makeRequest(client, requestNo);
+            except httpx.HTTPError:
+                succeeded = False;
+
+            if succeeded:
+                latencies.append(time.perf_counter() - start);
+            else:
+                errors += 1;
+
+    start: float = time.perf_counter();
+    await asyncio.gather(*[Worker() for _ in range(min(concurrency, requestCount))]);
+    wallSeconds: float = time.perf_counter() - start;
+
+    return TBenchmarkResult(
+        name=name,
+        requests=requestCount,
+        errors=errors,
+        concurrency=concurrency,
+        wallSeconds=round(wallSeconds, 3),
+        throughput=round(len(latencies) / wallSeconds, 2) if wallSeconds > 0 else 0,
+        latencyMs=SummariseLatencies(latencies),
+        params=params
+    );
+
+async def RunReadBenchmark(
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    name: str,
+    makeRequest: TRequestFunction,
+    params: Dict[str, Any]) -> TBenchmarkResult:
+
+    await RunLoad(client, name, makeRequest, args.warmup, args.concurrency, params);
+    return await RunLoad(client, name, makeRequest, args.requests, args.concurrency, params);
+
+#Tracks when jobs finish through the /music/events stream, which adds no polling load to the server
+class CompletionTracker:
+    def __init__(self):
+        self.finishedAt: Dict[int, Tuple[float, str]] = {}; #job id -> (perf_counter, status)
+        self._task: Optional[asyncio.Task] = None;
+        self._connected = asyncio.Event();
+
+    async def StartAsync(self, client: httpx.AsyncClient) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._Listen(client));
+        await asyncio.wait_for(self._connected.wait(), 30);
+
+    async def _Listen(self, client: httpx.AsyncClient) -> None:
+        async with client.stream("GET", "/music/events", timeout=None) as response:
+            self._connected.set();
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue;
+                event: Dict[str, Any] = json.loads(line[6:]);
+                if event.get("done") and not event.get("job_id") is None:
+                    self.finishedAt.setdefault(event["job_id"], (time.perf_counter(), event["status"]));
+
+    #Events may be missed (e.g. a subscriber queue overflow), jobs not seen by then are polled
+    async def WaitForJobsAsync(self, client: httpx.AsyncClient, jobIds: List[int], timeoutSeconds: float) -> None:
+        deadline: float = time.perf_counter() + timeoutSeconds;
+        while time.perf_counter() < deadline:
+            pendingJobIds: List[int] = [jobId for jobId in jobIds if not jobId in self.finishedAt];
+            if len(pendingJobIds) == 0:
+                return;
+
+            await asyncio.sleep(0.5);
+            for jobId in pendingJobIds:
+                if jobId in self.finishedAt:
+                    continue;
+                status: Dict[str, Any] = (await client.get(f"/music/status/{jobId}")).json();
+                if status["done"]:
+                    self.finishedAt.setdefault(jobId, (time.perf_counter(), status["status"]));
+
+        raise Exception(f"jobs didn't finish within {timeoutSeconds}s");
+
+    async def StopAsync(self) -> None:
+        if not self._task is None:
+            self._task.cancel();
+            try:
+                await self._task;
+            except (asyncio.CancelledError, httpx.HTTPError):
+                pass;
+
+#Each upload gets different trailing bytes, otherwise every job after the first is served from the result cache
+def MakeUniqueUpload(contents: bytes, audio: TSyntheticAudio, requestNo: int) -> bytes:
+    if audio.format.startswith("wav"):
+        #The last sample frames of the data chunk
+        return contents[:-8] + requestNo.to_bytes(8, "little");
+    return contents + requestNo.to_bytes(8, "little");
+
+async def BenchmarkTranscription(
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    audio: TSyntheticAudio,
+    tracker: CompletionTracker,
+    completedJobIds: List[int],
+    jobCount: int,
+    unique: bool) -> List[TBenchmarkResult]:
+
+    with open(audio.path, "rb") as hFile:
+        contents: bytes = hFile.read();
+
+    variant: str = "" if unique else ",cached";
+    params: Dict[str, Any] = {"format": audio.format, "durationSeconds": audio.durationSeconds, "bytes": audio.size, "cached": not unique};
+    filename: str = os.path.basename(audio.path);
+    submittedAt: Dict[int, float] = {};
+
+    async def Submit(client: httpx.AsyncClient, requestNo: int) -> bool:
+        start: float = time.perf_counter();
+        response: httpx.Response = await client.post(
+            "/music/transcribe-cancellable",
+            params={"mode": "music"},
+            #The cached variant repeats the first upload of the uncached run, which has been transcribed by then
+            files={"music-file": (filename, MakeUniqueUpload(contents, audio, requestNo if unique else 0), "application/octet-stream")}
+        );
+        if response.status_code != 200:
+            return False;
+        submittedAt[response.json()["id"]] = start;
+        return True;
+
+    name: str = f"transcribe_cancellable[{audio.format},{audio.durationSeconds:g}s{variant}]";
+    submitResult: TBenchmarkResult = await RunLoad(client, name, Submit, jobCount, args.concurrency, params);
+
+    await tracker.WaitForJobsAsync(client, list(submittedAt.keys()), 600);
+
+    endToEndResult: TBenchmarkResult = SummariseEndToEnd(
+        f"transcribe_e2e[{audio.format},{audio.durationSeconds:g}s{variant}]",
+        args,
+        tracker,
+        submittedAt,
+        submitResult.errors,
+        completedJobIds,
+        params
+    );
+    return [submitResult, endToEndResult];
+
+#Latency from submission until each job finished, "submittedAt" holds the perf_counter of each job's submission
+def SummariseEndToEnd(
+    name: str,
+    args: argparse.Namespace,
+    tracker: CompletionTracker,
+    submittedAt: Dict[int, float],
+    submitErrors: int,
+    completedJobIds: List[int],
+    params: Dict[str, Any]) -> TBenchmarkResult:
+
+    endToEndLatencies: List[float] = [];
+    errors: int = submitErrors;
+    for (jobId, submitTime) in submittedAt.items():
+        (finishTime, status) = tracker.finishedAt[jobId];
+        if status == "DONE":
+            endToEndLatencies.append(finishTime - submitTime);
+            completedJobIds.append(jobId);
+        else:
+            errors += 1;
+
+    start: float = min(submittedAt.values(), default=0);
+    wallSeconds: float = max((tracker.finishedAt[jobId][0] for jobId in submittedAt), default=start) - start;
+    return TBenchmarkResult(
+        name=name,
+        requests=len(submittedAt) + submitErrors,
+        errors=errors,
+        concurrency=args.concurrency,
+        wallSeconds=round(wallSeconds, 3),
+        throughput=round(len(endToEndLatencies) / wallSeconds, 2) if wallSeconds > 0 else 0,
+        latencyMs=SummariseLatencies(endToEndLatencies),
+        params=params
+    );
+
+#Short & long uploads submitted in one shuffled burst, shows how long short jobs wait behind long ones
+async def BenchmarkMixedTranscription(
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    shortAudio: TSyntheticAudio,
+    longAudio: TSyntheticAudio,
+    tracker: CompletionTracker,
+    completedJobIds: List[int],
+    jobCount: int,
+    rng: random.Random) -> List[TBenchmarkResult]:
+
+    uploads: List[Tuple[TSyntheticAudio, bytes]] = [];
+    for audio in [shortAudio, longAudio]:
+        with open(audio.path, "rb") as hFile:
+            uploads.append((audio, hFile.read()));
+    submissions: List[Tuple[TSyntheticAudio, bytes]] = [uploads[requestNo % 2] for requestNo in range(jobCount)];
+    rng.shuffle(submissions);
+    submittedAt: List[Dict[int, float]] = [{}, {}]; #short, long
+    submitErrors: List[int] = [0, 0];
+
+    async def Submit(client: httpx.AsyncClient, requestNo: int) -> bool:
+        (audio, contents) = submissions[requestNo];
+        kind: int = 0 if audio is shortAudio else 1;
+        start: float = time.perf_counter();
+        response: httpx.Response = await client.post(
+            "/music/transcribe-cancellable",
+            params={"mode": "music"},
+            files={"music-file": (
+                os.path.basename(audio.path), 
+                MakeUniqueUpload(contents, audio, MIXED_REQUEST_NO_OFFSET + requestNo), 
+                "application/octet-stream"
+            )}
+        );
+        if response.status_code != 200:
+            submitErrors[kind] += 1;
+            return False;
+        submittedAt[kind][response.json()["id"]] = start;
+        return True;
+
+    await RunLoad(client, "transcribe_mixed", Submit, jobCount, args.concurrency, {});
+    await tracker.WaitForJobsAsync(client, list(submittedAt[0].keys()) + list(submittedAt[1].keys()), 600);
+
+    label: str = f"{shortAudio.format},{shortAudio.durationSeconds:g}s+{longAudio.durationSeconds:g}s";
+    return [
+        SummariseEndToEnd(
+            f"transcribe_mixed_e2e[{label},{kind}]",
+            args,
+            tracker,
+            submittedAt[kindNo],
+            submitErrors[kindNo],
+            completedJobIds,
+            {"format": audio.format, "durationSeconds": audio.durationSeconds, "mixedWith": otherAudio.durationSeconds}
+        )
+        for (kindNo, kind, audio, otherAudio) in [(0, "short", shortAudio, longAudio), (1, "long", longAudio, shortAudio)]
+    ];
+
+#One client submits a burst of jobs, another client submits a few right after it,
+#shows how long the second client waits behind the first one's backlog
+async def BenchmarkFairShare(
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    audio: TSyntheticAudio,
+    tracker: CompletionTracker,
+    completedJobIds: List[int],
+    jobCount: int) -> List[TBenchmarkResult]:
+
+    with open(audio.path, "rb") as hFile:
+        contents: bytes = hFile.read();
+    normalJobCount: int = max(2, jobCount // 5);
+    submittedAt: Dict[str, Dict[int, float]] = {HEAVY_CLIENT_API_KEY: {}, NORMAL_CLIENT_API_KEY: {}};
+    submitErrors: Dict[str, int] = {HEAVY_CLIENT_API_KEY: 0, NORMAL_CLIENT_API_KEY: 0};
+
+    def MakeSubmit(apiKey: str, requestNoOffset: int) -> TRequestFunction:
+        async def Submit(client: httpx.AsyncClient, requestNo: int) -> bool:
+            start: float = time.perf_counter();
+            response: httpx.Response = await client.post(
+                "/music/transcribe-cancellable",
+                params={"mode": "music"},
+                headers={"X-API-Key": apiKey},
+                files={"music-file": (
+                    os.path.basename(audio.path),
+                    MakeUniqueUpload(contents, audio, requestNoOffset + requestNo),
+                    "application/octet-stream"
+                )}
+            );
+            if response.status_code != 200:
+                submitErrors[apiKey] += 1;
+                return False;
+            submittedAt[apiKey][response.json()["id"]] = start;
+            return True;
+        return Submit;
+
+    await RunLoad(client, "transcribe_fair[heavy]", MakeSubmit(HEAVY_CLIENT_API_KEY, FAIR_SHARE_REQUEST_NO_OFFSET), jobCount, args.concurrency, {});
+    await RunLoad(client, "transcribe_fair[normal]", MakeSubmit(NORMAL_CLIENT_API_KEY, FAIR_SHARE_REQUEST_NO_OFFSET + jobCount), normalJobCount, 1, {});
+    await tracker.WaitForJobsAsync(
+        client, 
+        list(submittedAt[HEAVY_CLIENT_API_KEY].keys()) + list(submittedAt[NORMAL_CLIENT_API_KEY].keys()), 
+        600
+    );
+
+    return [
+        SummariseEndToEnd(
+            f"transcribe_fair_e2e[{audio.format},{audio.durationSeconds:g}s,{kind}]",
+            args,
+            tracker,
+            submittedAt[apiKey],
+            submitErrors[apiKey],
+            completedJobIds,
+            {"format": audio.format, "durationSeconds": audio.durationSeconds, "heavyJobs": jobCount, "normalJobs": normalJobCount}
+        )
+        for (kind, apiKey) in [("heavy", HEAVY_CLIENT_API_KEY), ("normal", NORMAL_CLIENT_API_KEY)]
+    ];
+
+async def RunBenchmarksAsync(args: argparse.Namespace, baseUrl: str, audioFiles: List[TSyntheticAudio], historyIds: List[int]) -> List[TBenchmarkResult]:
+    selected: Optional[List[str]] = args.only.split(",") if args.only else None;
+    def IsSelected(name: str) -> bool:
+        return selected is None or name in selected;
+
+    rng = random.Random(args.seed);
+    results: List[TBenchmarkResult] = [];
+    completedJobIds: List[int] = [];
+    limits = httpx.Limits(max_connections=args.concurrency + 1, max_keepalive_connections=args.concurrency + 1);
+
+    async with httpx.AsyncClient(base_url=baseUrl, timeout=600, limits=limits) as client:
+        #Audio files are grouped by format, the first group is used where a single format is needed
+        durationCount: int = len(args.durations.split(","));
+        if any(IsSelected(name) for name in ["transcribe", "transcribe_mixed", "transcribe_fair", "download"]):
+            tracker = CompletionTracker();
+            await tracker.StartAsync(client);
+            try:
+                #Unmeasured, starts the warm workers
+                await BenchmarkTranscription(client, args, audioFiles[0], tracker, [], args.workers, True);
+                if IsSelected("transcribe") or IsSelected("download"):
+                    transcriptionResults: List[TBenchmarkResult] = [];
+                    for audio in audioFiles:
+                        transcriptionResults += await BenchmarkTranscription(client, args, audio, tracker, completedJobIds, args.jobs, True);
+                        print(FormatResults(transcriptionResults[-2:]), flush=True);
+                    #Identical uploads, completed from the result cache
+                    transcriptionResults += await BenchmarkTranscription(client, args, audioFiles[0], tracker, completedJobIds, args.jobs, False);
+                    print(FormatResults(transcriptionResults[-2:]), flush=True);
+
+                    if IsSelected("transcribe"):
+                        results += transcriptionResults;
+
+                if IsSelected("transcribe_mixed"):
+                    shortAudio: TSyntheticAudio = min(audioFiles[:durationCount], key=lambda audio: audio.durationSeconds);
+                    longAudio: TSyntheticAudio = max(audioFiles[:durationCount], key=lambda audio: audio.durationSeconds);
+                    results += await BenchmarkMixedTranscription(
+                        client, args, shortAudio, longAudio, tracker, completedJobIds, args.jobs, rng
+                    );
+                    print(FormatResults(results[-2:]), flush=True);
+
+                if IsSelected("transcribe_fair"):
+                    longAudio = max(audioFiles[:durationCount], key=lambda audio: audio.durationSeconds);
+                    results += await BenchmarkFairShare(client, args, longAudio, tracker, completedJobIds, args.jobs);
+                    print(FormatResults(results[-2:]), flush=True);
+            finally:
+                await tracker.StopAsync();
+
+        jobIds: List[int] = historyIds + completedJobIds;
+
+        if IsSelected("status"):
+            async def GetStatus(client: httpx.AsyncClient, _: int) -> bool:
+                response: httpx.Response = await client.get(f"/music/status/{rng.choice(jobIds)}");
+                return response.status_code == 200;
+            results.append(await RunReadBenchmark(client, args, "status", GetStatus, {"jobs": len(jobIds)}));
+            print(FormatResults(results[-1:]), flush=True);
+
+        if IsSelected("status_all"):
+            listQueries: List[Tuple[str, Callable[[], Dict[str, Any]]]] = [
+                ("status_all", lambda: {"limit": 100}),
+                ("status_all[filtered]", lambda: {"limit": 100, "status": "DONE", "mode": "music"}),
+                ("status_all[filename]", lambda: {"limit": 100, "filename": f"history-{rng.randrange(1000)}"}),
+                ("status_all[cursor]", lambda: {"limit": 100, "cursor": rng.choice(jobIds)}),
+                ("status_all[fields]", lambda: {"limit": 1000, "fields": "id,status,done"})
+            ];
+            for (name, makeParams) in listQueries:
+                async def ListStatus(client: httpx.AsyncClient, _: int, makeParams=makeParams) -> bool:
+                    response: httpx.Response = await client.get("/music/status/all", params=makeParams());
+                    return response.status_code == 200;
+                results.append(await RunReadBenchmark(client, args, name, ListStatus, {"historyRows": len(jobIds)}));
+                print(FormatResults(results[-1:]), flush=True);
+
+        if IsSelected("download"):
+            if len(completedJobIds) == 0:
+                print("download: no completed jobs, skipped", file=sys.stderr);
+            else:
+                async def Download(client: httpx.AsyncClient, _: int) -> bool:
+                    response: httpx.Response = await client.get(f"/music/download-result/{rng.choice(completedJobIds)}");
+                    return response.status_code == 200 and len(response.content) > 0;
+                results.append(await RunReadBenchmark(client, args, "download_result", Download, {"results": len(completedJobIds)}));
+                print(FormatResults(results[-1:]), flush=True);
+
+    return results;
+
+def CreateAudioFiles(args: argparse.Namespace, audioDir: str) -> List[TSyntheticAudio]:
+    audioFiles: List[TSyntheticAudio] = [];
+    for format in args.formats.split(","):
+        if not format in SYNTHETIC_FORMATS:
+            raise Exception(f"unknown format <{format}>, expected one of {SYNTHETIC_FORMATS}");
+        for duration in args.durations.split(","):
+            audio: Optional[TSyntheticAudio] = CreateSyntheticAudio(audioDir, format, float(duration));
+            if audio is None:
+                print(f"ffmpeg not found, skipping {format}", file=sys.stderr);
+                break;
+            audioFiles.append(audio);
+
+    if len(audioFiles) == 0:
+        raise Exception("no synthetic audio could be created");
+    return audioFiles;
+
+def main() -> None:
+    args: argparse.Namespace = ParseArgs();
+    workDir: str = args.work_dir or tempfile.mkdtemp(prefix="transcriber-benchmark-");
+    os.makedirs(workDir, exist_ok=True);
+    ConfigureEnvironment(args, workDir);
+
+    try:
+        audioFiles: List[TSyntheticAudio] = CreateAudioFiles(args, os.path.join(workDir, "audio"));
+
+        from src.main import app
+        from src.schemas import TranscriptionJob
+
+        SeedHistory(args.history_rows, random.Random(args.seed));
+        historyIds: List[int] = [row["id"] for row in TranscriptionJob.select(TranscriptionJob.id).run_sync()];
+
+        server = InProcessServer(app, "127.0.0.1", args.port);
+        server.Start();
+        try:
+            results: List[TBenchmarkResult] = asyncio.run(RunBenchmarksAsync(args, server.GetBaseUrl(), audioFiles, historyIds));
+        finally:
+            server.Stop();
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(workDir, ignore_errors=True);
+
+    config: Dict[str, Any] = {
+        key: value for (key, value) in vars(args).items()
+        if not key in ["output", "save_baseline", "compare", "work_dir", "port"]
+    };
+    report = CreateReport(config, results);
+    print();
+    print(FormatResults(results));
+
+    if args.output:
+        WriteReport(report, args.output);
+    if args.save_baseline:
+        WriteReport(report, GetBaselinePath(args.save_baseline));
+        print(f"baseline saved to {GetBaselinePath(args.save_baseline)}");
+
+    if args.compare:
+        regressions: List[str] = FindRegressions(ReadReport(GetBaselinePath(args.compare)), report, args.tolerance);
+        if len(regressions) > 0:
+            print(f"\n{len(regressions)} regression(s) against baseline <{args.compare}>:");
+            for regression in regressions:
+                print(f"  {regression}");
+            sys.exit(1);
+        print(f"\nno regressions against baseline <{args.compare}>");
+
+if __name__ == "__main__":
+    main();
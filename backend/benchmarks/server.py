@@ -0,0 +1,67 @@
+import asyncio
+import threading
+from typing import Optional, Any
+
+#Runs the app (imported from src.main) on its own thread & event loop, so the load generator
+#doesn't share a loop with the server it is measuring
+class InProcessServer:
+    def __init__(self, app: Any, host: str, port: int):
+        self._app = app;
+        self._host: str = host;
+        self._port: int = port;
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None;
+        self._server: Any = None;
+        self._started = threading.Event();
+        self._startupError: Optional[BaseException] = None;
+        self._thread = threading.Thread(target=self._Run, name="benchmark-server", daemon=True);
+
+    def GetBaseUrl(self) -> str:
+        return f"http://{self._host}:{self._port}";
+
+    def Start(self, timeoutSeconds: float = 60) -> None:
+        self._thread.start();
+        if not self._started.wait(timeoutSeconds):
+            raise Exception(f"server didn't start within {timeoutSeconds}s");
+        if not self._startupError is None:
+            raise self._startupError;
+
+    def Stop(self) -> None:
+        if self._loop is None:
+            return;
+
+        asyncio.run_coroutine_threadsafe(self._StopAsync(), self._loop).result();
+        self._loop.call_soon_threadsafe(self._loop.stop);
+        self._thread.join();
+
+    def _Run(self) -> None:
+        self._loop = asyncio.new_event_loop();
+        asyncio.set_event_loop(self._loop);
+
+        try:
+            self._loop.run_until_complete(self._StartAsync());
+        except BaseException as e:
+            self._startupError = e;
+            self._started.set();
+            return;
+
+        self._started.set();
+        self._loop.run_forever();
+        self._loop.close();
+
+    async def _StartAsync(self) -> None:
+        self._server = await self._app.create_server(
+            host=self._host,
+            port=self._port,
+            return_asyncio_server=True,
+            access_log=False
+        );
+        await self._server.startup();
+        await self._server.before_start();
+        await self._server.after_start();
+        await self._server.start_serving();
+
+    async def _StopAsync(self) -> None:
+        await self._server.before_stop();
+        await self._server.close();
+        await self._server.after_stop();
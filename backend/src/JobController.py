@@ -1,7 +1,27 @@
 from typing import Tuple, Optional, Dict, Any, List
 from datetime import datetime
 from logging import Logger
-from .schemas import JobStatus, TranscriptionJob, CompletedJob, TOmnizartMode, StatusName
+import asyncio
+import os
+import re
+from piccolo.columns.combination import WhereRaw
+from dataclasses import dataclass
+from .util import RemoveUpload, RemovePartialResult, GetOmnizartVersion
+from .schemas import JobStatus, TranscriptionJob, CompletedJob, BatchJob, TOmnizartMode, StatusName, FinishedStatusNames, ActiveStatusNames, ESTIMATE_COLUMN_NAMES
+from .cancellation import GetCancellationRegistry
+from .job_events import GetJobEventBus
+from .result_store import GetResultStore, TStoredResult
+from .database import RunSync, IsPostgres
+from .constants import CONST
+from .metrics import Span
+from .throughput import GetThroughputModel, GetClientBacklogs, ComputeScheduleKey
+
+@dataclass
+class TCompletedJobFile:
+    filePath: str
+    filename: str
+    sha256: str
+    size: int
 
 class JobController:
     #returns the id of the newly created job
@@ -9,99 +29,480 @@ class JobController:
     async def InitJob(
         transcriptionMode: TOmnizartMode,
         srcFilename: str,
-        time: datetime = datetime.now()
+        time: Optional[datetime] = None, #defaults to now
+        batchId: Optional[int] = None,
+        clientId: Optional[str] = None
         ) -> int:
 
         newJob = (await TranscriptionJob.insert(
             TranscriptionJob(
                 filename=srcFilename,
                 mode=transcriptionMode,
-                start_time=time,
+                start_time=time or datetime.now(),
                 end_time=None,
                 request_terminate=False,
                 status=StatusName(JobStatus.NONE),
                 msg="",
-                completed_job=None
+                completed_job=None,
+                batch_job=batchId,
+                node=CONST.NODE_ID,
+                client_id=clientId
             )
         ))[0];
 
+        GetJobEventBus().PublishStatus(newJob["id"], JobStatus.NONE);
         return newJob["id"];
 
+    #returns the id of the newly created batch, its jobs are created with InitJob
+    @staticmethod
+    async def InitBatchJob(modes: List[TOmnizartMode], inputCount: int) -> int:
+        newBatch = (await BatchJob.insert(
+            BatchJob(
+                start_time=datetime.now(),
+                modes=",".join(modes),
+                input_count=inputCount
+            )
+        ))[0];
+
+        return newBatch["id"];
+
+    @staticmethod
+    async def GetBatchJobAsync(batchId: int) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        batch: Optional[Dict[str, Any]] = await BatchJob.select().where(BatchJob.id == batchId).first();
+        if batch is None:
+            return None;
+
+        jobs: List[Dict[str, Any]] = await TranscriptionJob.select().where(
+            TranscriptionJob.batch_job == batchId
+        ).order_by(
+            TranscriptionJob.id
+        );
+
+        return (batch, jobs);
+
+    #Uploads can be shared by several jobs, they may only be removed once all of them are finished
+    @staticmethod
+    def IsSourceInUse(sourcePath: str) -> bool:
+        return RunSync(TranscriptionJob.exists().where(
+            (TranscriptionJob.source_path == sourcePath) &
+            TranscriptionJob.status.not_in(FinishedStatusNames())
+        ));
+
+    #Hands an uploaded job over to the scheduler
+    @staticmethod
+    async def EnqueueJob(
+        jobId: int, 
+        sourcePath: str, 
+        sourceHash: str, 
+        audioDuration: Optional[float], 
+        sourceSize: Optional[int], 
+        priority: int = 0) -> None:
+
+        await JobController.EnqueueJobs([jobId], sourcePath, sourceHash, audioDuration, sourceSize, priority);
+
+    #Jobs sharing one upload are queued in a single statement,
+    #so none of them can finish & remove the upload before the others reference it
+    @staticmethod
+    async def EnqueueJobs(
+        jobIds: List[int], 
+        sourcePath: str, 
+        sourceHash: str, 
+        audioDuration: Optional[float], #seconds, None if the upload couldn't be probed
+        sourceSize: Optional[int],
+        priority: int = 0) -> None:
+
+        #Jobs aren't claimable until they are queued, so their schedule keys can be set one mode at a time
+        enqueueTime: datetime = datetime.now();
+        jobs: List[Dict[str, Any]] = await TranscriptionJob.select(
+            TranscriptionJob.id,
+            TranscriptionJob.mode,
+            TranscriptionJob.client_id
+        ).where(
+            TranscriptionJob.id.is_in(jobIds)
+        );
+        #The jobs of one upload belong to one client
+        clientId: Optional[str] = jobs[0]["client_id"] if len(jobs) > 0 else None;
+        scheduleKeys: Dict[str, float] = {};
+        for mode in sorted(set(job["mode"] for job in jobs)):
+            jobCount: int = sum(1 for job in jobs if job["mode"] == mode);
+            estimatedSeconds: float = GetThroughputModel().EstimateSeconds(mode, audioDuration, sourceSize);
+            clientBacklogSeconds: float = (
+                await GetClientBacklogs().AddAsync(clientId, estimatedSeconds * jobCount) 
+                if not clientId is None else 
+                0
+            );
+            scheduleKeys[mode] = ComputeScheduleKey(enqueueTime, estimatedSeconds, clientBacklogSeconds);
+
+        for (mode, scheduleKey) in scheduleKeys.items():
+            await TranscriptionJob.update({
+                TranscriptionJob.audio_duration: audioDuration,
+                TranscriptionJob.source_size: sourceSize,
+                TranscriptionJob.schedule_key: scheduleKey
+            }).where(
+                TranscriptionJob.id.is_in([job["id"] for job in jobs if job["mode"] == mode])
+            );
+
+        await TranscriptionJob.update({
+            TranscriptionJob.status: StatusName(JobStatus.QUEUED),
+            TranscriptionJob.source_path: sourcePath,
+            TranscriptionJob.source_hash: sourceHash,
+            TranscriptionJob.priority: priority
+        }).where(
+            TranscriptionJob.id.is_in(jobIds)
+        );
+        for jobId in jobIds:
+            GetJobEventBus().PublishStatus(jobId, JobStatus.QUEUED);
+
     @staticmethod
-    def ShouldTerminateJob(jobId: int) -> bool:
+    async def CountActiveJobsAsync(clientId: str) -> int:
+        return await TranscriptionJob.count().where(
+            (TranscriptionJob.client_id == clientId) &
+            TranscriptionJob.status.is_in(ActiveStatusNames())
+        );
+
+    #Unfinished jobs of the client, with the columns needed to estimate their progress
+    @staticmethod
+    async def GetActiveJobsAsync(clientId: str) -> List[Dict[str, Any]]:
+        return await TranscriptionJob.select(
+            *[TranscriptionJob._meta.get_column_by_name(name) for name in ESTIMATE_COLUMN_NAMES]
+        ).where(
+            (TranscriptionJob.client_id == clientId) &
+            TranscriptionJob.status.is_in(ActiveStatusNames())
+        );
+
+    #Completes a job immediately using a result from the cache
+    @staticmethod
+    async def LinkCompletedJobAsync(jobId: int, completedJobId: int) -> None:
+        await TranscriptionJob.update({
+            TranscriptionJob.completed_job: completedJobId,
+            TranscriptionJob.status: StatusName(JobStatus.DONE),
+            TranscriptionJob.end_time: datetime.now()
+        }).where(
+            TranscriptionJob.id == jobId
+        );
+        GetJobEventBus().Publish(jobId, "result", None);
+        GetJobEventBus().PublishStatus(jobId, JobStatus.DONE);
+
+    #Keyset pagination on id, newest first unless "descending" is False
+    #Returns at most "limit" jobs and whether further pages exist
+    @staticmethod
+    async def ListJobsAsync(
+        limit: int,
+        cursor: Optional[int] = None,
+        descending: bool = True,
+        statuses: Optional[List[str]] = None,
+        modes: Optional[List[str]] = None,
+        filenameSubstring: Optional[str] = None,
+        startedAfter: Optional[datetime] = None,
+        startedBefore: Optional[datetime] = None,
+        columnNames: Optional[List[str]] = None
+        ) -> Tuple[List[Dict[str, Any]], bool]:
+
+        columns = (
+            [TranscriptionJob.id] + [TranscriptionJob._meta.get_column_by_name(name) for name in columnNames]
+            if not columnNames is None else
+            []
+        );
+        query = TranscriptionJob.select(*columns);
+
+        if not cursor is None:
+            query = query.where(TranscriptionJob.id < cursor if descending else TranscriptionJob.id > cursor);
+        if statuses:
+            query = query.where(TranscriptionJob.status.is_in(statuses));
+        if modes:
+            query = query.where(TranscriptionJob.mode.is_in(modes));
+        if filenameSubstring:
+            #"%" & "_" in the substring are matched as they are, sqlite's LIKE is case insensitive already
+            pattern: str = "%" + re.sub(r"([\\%_])", r"\\\1", filenameSubstring) + "%";
+            query = query.where(WhereRaw(
+                f"\"filename\" {'ILIKE' if IsPostgres() else 'LIKE'} {{}} ESCAPE '\\'",
+                pattern
+            ));
+        if not startedAfter is None:
+            query = query.where(TranscriptionJob.start_time >= startedAfter);
+        if not startedBefore is None:
+            query = query.where(TranscriptionJob.start_time < startedBefore);
+
+        #One extra row tells whether another page follows
+        jobs: List[Dict[str, Any]] = await query.order_by(
+            TranscriptionJob.id, ascending=not descending
+        ).limit(limit + 1);
+
+        return (jobs[:limit], len(jobs) > limit);
+
+    @staticmethod
+    async def CountQueuedJobsAsync() -> int:
+        return await TranscriptionJob.count().where(
+            TranscriptionJob.status == StatusName(JobStatus.QUEUED)
+        );
+
+    #Moves the next queued job (highest priority, then lowest schedule key) to RUNNING and returns it
+    @staticmethod
+    def ClaimNextQueuedJob() -> Optional[Dict[str, Any]]:
         job: Optional[Dict[str, Any]] = (
+            JobController._ClaimNextQueuedJobSkipLocked()
+            if IsPostgres() else
+            JobController._ClaimNextQueuedJobOptimistic()
+        );
+
+        if not job is None:
+            GetJobEventBus().PublishStatus(job["id"], JobStatus.RUNNING);
+        return job;
+
+    #The job ClaimNextQueuedJob would claim, without claiming it
+    @staticmethod
+    def PeekNextQueuedJob() -> Optional[Dict[str, Any]]:
+        return RunSync(
             TranscriptionJob
                 .select()
-                .where(TranscriptionJob.id == jobId)
+                .where(TranscriptionJob.status == StatusName(JobStatus.QUEUED))
+                .order_by(TranscriptionJob.priority, ascending=False)
+                .order_by(TranscriptionJob.schedule_key)
+                .order_by(TranscriptionJob.id)
                 .first()
-                .run_sync()
         );
-        shouldTerminate = job["request_terminate"];
-        assert(isinstance(shouldTerminate, bool));
-        return shouldTerminate;
+
+    #Rows locked by another node's claim are skipped instead of waited for
+    @staticmethod
+    def _ClaimNextQueuedJobSkipLocked() -> Optional[Dict[str, Any]]:
+        claimedRows: List[Dict[str, Any]] = RunSync(TranscriptionJob.raw(
+            f"""
+            UPDATE {TranscriptionJob._meta.tablename} SET status = {{}}, node = {{}}, run_start_time = {{}}
+            WHERE id = (
+                SELECT id FROM {TranscriptionJob._meta.tablename}
+                WHERE status = {{}}
+                ORDER BY priority DESC, schedule_key, id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+            """,
+            StatusName(JobStatus.RUNNING),
+            CONST.NODE_ID,
+            datetime.now(),
+            StatusName(JobStatus.QUEUED)
+        ));
+
+        return claimedRows[0] if len(claimedRows) > 0 else None;
+
+    #sqlite has a single writer, so the status check only has to guard against stale reads
+    @staticmethod
+    def _ClaimNextQueuedJobOptimistic() -> Optional[Dict[str, Any]]:
+        while True:
+            job: Optional[Dict[str, Any]] = JobController.PeekNextQueuedJob();
+
+            if job is None:
+                return None;
+
+            runStartTime: datetime = datetime.now();
+            claimedRows: List[Dict[str, Any]] = RunSync(TranscriptionJob.update({
+                TranscriptionJob.status: StatusName(JobStatus.RUNNING),
+                TranscriptionJob.node: CONST.NODE_ID,
+                TranscriptionJob.run_start_time: runStartTime
+            }).where(
+                (TranscriptionJob.id == job["id"]) &
+                (TranscriptionJob.status == StatusName(JobStatus.QUEUED))
+            ).returning(
+                TranscriptionJob.id
+            ));
+
+            if len(claimedRows) > 0:
+                job["status"] = StatusName(JobStatus.RUNNING);
+                job["node"] = CONST.NODE_ID;
+                job["run_start_time"] = runStartTime;
+                return job;
+
+    #Ids of the given jobs that were asked to terminate, used to pick up cancel requests received by other nodes
+    @staticmethod
+    def GetTerminationRequests(jobIds: List[int]) -> List[int]:
+        if len(jobIds) == 0:
+            return [];
+
+        rows: List[Dict[str, Any]] = RunSync(TranscriptionJob.select(
+            TranscriptionJob.id
+        ).where(
+            TranscriptionJob.id.is_in(jobIds) &
+            (TranscriptionJob.request_terminate == True)
+        ));
+        return [row["id"] for row in rows];
+
+    #Jobs interrupted by a restart are put back in the queue if their upload is still available,
+    #jobs that never finished uploading are marked as failed
+    @staticmethod
+    async def RecoverInterruptedJobsAsync(logger: Logger) -> None:
+        query = TranscriptionJob.select(
+            TranscriptionJob.id,
+            TranscriptionJob.status,
+            TranscriptionJob.request_terminate,
+            TranscriptionJob.source_path
+        ).where(
+            TranscriptionJob.status.is_in([
+                StatusName(JobStatus.NONE),
+                StatusName(JobStatus.RUNNING),
+                StatusName(JobStatus.STOPPING)
+            ])
+        );
+        #Jobs of other nodes sharing the DB are still running there. With sqlite every job is this node's,
+        #whatever node id it was claimed under
+        if IsPostgres():
+            query = query.where((TranscriptionJob.node == CONST.NODE_ID) | TranscriptionJob.node.is_null());
+        interruptedJobs: List[Dict[str, Any]] = await query;
+
+        for job in interruptedJobs:
+            sourceAvailable: bool = bool(job["source_path"]) and os.path.isfile(job["source_path"]);
+            newStatus: JobStatus = JobStatus.QUEUED;
+
+            if job["request_terminate"]:
+                newStatus = JobStatus.TERMINATED;
+            elif job["status"] == StatusName(JobStatus.NONE) or not sourceAvailable:
+                newStatus = JobStatus.ERROR;
+
+            logger.info(f"Job <{job['id']}> was interrupted in state <{job['status']}>, now <{StatusName(newStatus)}>");
+            await TranscriptionJob.update({
+                TranscriptionJob.status: StatusName(newStatus)
+            }).where(
+                TranscriptionJob.id == job["id"]
+            );
+            GetJobEventBus().PublishStatus(job["id"], newStatus);
+
+            #Once the job is finished, so it doesn't count as using its own upload
+            if newStatus != JobStatus.QUEUED and sourceAvailable and not JobController.IsSourceInUse(job["source_path"]):
+                RemoveUpload(job["source_path"]);
+            RemovePartialResult(job["id"]);
+
+    @staticmethod
+    async def GetJobStatusAsync(jobId: int) -> Optional[str]:
+        job: Optional[Dict[str, Any]] = await TranscriptionJob.select(
+            TranscriptionJob.status
+        ).where(
+            TranscriptionJob.id == jobId
+        ).first();
+        return job["status"] if not job is None else None;
+
+    #Blocking, removes the upload unless other unfinished jobs share it
+    @staticmethod
+    def _RemoveUnusedSource(sourcePath: str) -> None:
+        if not JobController.IsSourceInUse(sourcePath):
+            RemoveUpload(sourcePath);
 
     @staticmethod
     async def MarkJobForTermination(jobId: int) -> bool:
+        #Queued jobs are terminated right away, rather than once a worker claims them.
+        #Until then they would count as queued & active, keep their upload & hold up the jobs behind them
+        terminatedRows: List[Dict[str, Any]] = await TranscriptionJob.update({
+            TranscriptionJob.request_terminate: True,
+            TranscriptionJob.status: StatusName(JobStatus.TERMINATED),
+            TranscriptionJob.end_time: datetime.now()
+        }).where(
+            (TranscriptionJob.id == jobId) &
+            (TranscriptionJob.status == StatusName(JobStatus.QUEUED))
+        ).returning(
+            TranscriptionJob.source_path
+        );
+        if len(terminatedRows) > 0:
+            GetJobEventBus().PublishStatus(jobId, JobStatus.TERMINATED);
+            if terminatedRows[0]["source_path"]:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, JobController._RemoveUnusedSource, terminatedRows[0]["source_path"]
+                );
+            return True;
+
+        #Finished jobs are left as they are, every write to a job has to be followed by an event (see status_cache)
         updatedRows: List[Dict[str, Any]] = await TranscriptionJob.update({
             TranscriptionJob.request_terminate: True
         }).where(
-            TranscriptionJob.id == jobId
+            (TranscriptionJob.id == jobId) &
+            TranscriptionJob.status.not_in(FinishedStatusNames())
         ).returning(
-            TranscriptionJob.id
+            TranscriptionJob.id,
+            TranscriptionJob.status
         );
-    
-        rowWasUpdated = len(updatedRows) > 0;
-        return rowWasUpdated;
+        if len(updatedRows) == 0:
+            return await TranscriptionJob.exists().where(TranscriptionJob.id == jobId);
+
+        GetCancellationRegistry().RequestCancel(jobId);
+        GetJobEventBus().Publish(jobId, "terminate-requested", updatedRows[0]["status"]);
+        return True;
 
     @staticmethod
     def UpdateStatus(
         id: int, 
         newStatus: JobStatus, 
-        time: datetime = datetime.now()) -> None:
+        time: Optional[datetime] = None) -> None: #defaults to now
 
-        TranscriptionJob.update({
+        RunSync(TranscriptionJob.update({
             TranscriptionJob.status: StatusName(newStatus),
-            TranscriptionJob.end_time: time
+            TranscriptionJob.end_time: time or datetime.now()
         }).where(
             TranscriptionJob.id == id
-        ).run_sync();
+        ));
+        GetJobEventBus().PublishStatus(id, newStatus);
 
     @staticmethod
     def CreateCompletedJob(
         parentJobId: int, 
         filename: str,
-        transcribedFileContents: bytes) -> None:
+        transcribedFilePath: str,
+        sourceHash: Optional[str],
+        mode: TOmnizartMode) -> None:
+
+        with Span("result_store", mode, parentJobId):
+            storedResult: TStoredResult = GetResultStore().PutFile(transcribedFilePath);
+
+        with Span("db_insert", mode, parentJobId):
+            JobController._InsertCompletedJob(parentJobId, filename, storedResult, sourceHash, mode);
+        GetJobEventBus().Publish(parentJobId, "result", None);
+
+    @staticmethod
+    def _InsertCompletedJob(
+        parentJobId: int,
+        filename: str,
+        storedResult: TStoredResult,
+        sourceHash: Optional[str],
+        mode: TOmnizartMode) -> None:
 
-        completedJob = CompletedJob.insert(
+        now: datetime = datetime.now();
+        completedJob = RunSync(CompletedJob.insert(
             CompletedJob(
                 filename=filename,
-                blob=transcribedFileContents
+                blob=b"",
+                result_path=storedResult.location,
+                result_hash=storedResult.sha256,
+                source_hash=sourceHash,
+                mode=mode,
+                omnizart_version=GetOmnizartVersion(),
+                size=storedResult.size,
+                created_at=now,
+                last_used=now
             )
-        ).run_sync()[0];
+        ))[0];
         
         assert(not completedJob is None);
         assert(isinstance(completedJob["id"], int));
 
-        TranscriptionJob.update({
+        RunSync(TranscriptionJob.update({
             TranscriptionJob.completed_job: completedJob["id"]
         }).where(
             TranscriptionJob.id == parentJobId
-        ).run_sync();
+        ));
 
     @staticmethod
-    async def GetCompletedJobAsync(logger: Logger, jobId: int) -> Optional[Tuple[bytes, str]]:
+    async def GetCompletedJobAsync(logger: Logger, jobId: int) -> Optional[TCompletedJobFile]:
         completedJob = (
             await TranscriptionJob
-                .select(TranscriptionJob.completed_job.filename, TranscriptionJob.completed_job.blob)
+                .select(
+                    TranscriptionJob.completed_job.filename, 
+                    TranscriptionJob.completed_job.result_path,
+                    TranscriptionJob.completed_job.result_hash,
+                    TranscriptionJob.completed_job.size
+                )
                 .where(TranscriptionJob.id == jobId)
                 .first()
         );
 
-        logger.info(f"completedJob = {completedJob.keys()}");
-        
         missingFile: bool = (
             completedJob is None or 
-            completedJob["completed_job.blob"] is None or
+            completedJob["completed_job.result_path"] is None or
             completedJob["completed_job.filename"] is None
         );
 
@@ -109,4 +510,45 @@ class JobController:
             logger.error(f"Job id<{jobId}> - missing result")
             return None;    
 
-        return (completedJob["completed_job.blob"], completedJob["completed_job.filename"]);
\ No newline at end of file
+        return TCompletedJobFile(
+            filePath=GetResultStore().GetLocalPath(completedJob["completed_job.result_path"]),
+            filename=completedJob["completed_job.filename"],
+            sha256=completedJob["completed_job.result_hash"],
+            size=completedJob["completed_job.size"]
+        );
+
+    #Moves results stored by older versions from CompletedJob.blob into the result store
+    @staticmethod
+    def MigrateResultBlobs(logger: Logger) -> None:
+        pendingIds: List[Dict[str, Any]] = RunSync(CompletedJob.select(
+            CompletedJob.id
+        ).where(
+            CompletedJob.result_path.is_null()
+        ));
+
+        if len(pendingIds) == 0:
+            return;
+
+        logger.info(f"Moving {len(pendingIds)} result(s) out of the DB");
+        for row in pendingIds:
+            #One blob at a time, to keep memory usage flat
+            blobRow: Dict[str, Any] = RunSync(CompletedJob.select(
+                CompletedJob.blob
+            ).where(
+                CompletedJob.id == row["id"]
+            ).first());
+
+            storedResult: TStoredResult = GetResultStore().Put(blobRow["blob"]);
+            RunSync(CompletedJob.update({
+                CompletedJob.blob: b"",
+                CompletedJob.result_path: storedResult.location,
+                CompletedJob.result_hash: storedResult.sha256,
+                CompletedJob.size: storedResult.size
+            }).where(
+                CompletedJob.id == row["id"]
+            ));
+
+        #Return the space freed by the blobs to the OS, postgres' autovacuum takes care of that by itself
+        if not IsPostgres():
+            RunSync(CompletedJob.raw("VACUUM"));
+        logger.info("Result migration complete");
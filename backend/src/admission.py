@@ -0,0 +1,157 @@
+import math
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Optional, List, Any, Callable, Awaitable
+from sanic import Request
+from sanic.exceptions import SanicException
+
+from .JobController import JobController
+from .throughput import QueueForecast
+from .constants import CONST
+from .util import CreateLogger
+
+logger = CreateLogger(__name__);
+
+#Retry-After sent when no better estimate is available
+DEFAULT_RETRY_AFTER_SECONDS: float = 30;
+
+class TokenBucket:
+    def __init__(self, capacity: float, refillPerSecond: float, now: float):
+        self._capacity: float = capacity;
+        self._refillPerSecond: float = refillPerSecond;
+        self._tokens: float = capacity;
+        self._updatedAt: float = now;
+
+    def _Refill(self, now: float) -> None:
+        self._tokens = min(self._capacity, self._tokens + (now - self._updatedAt) * self._refillPerSecond);
+        self._updatedAt = now;
+
+    #Returns 0 if a token was taken, otherwise the seconds until one is available
+    def TryTake(self, now: float) -> float:
+        self._Refill(now);
+        if self._tokens >= 1:
+            self._tokens -= 1;
+            return 0;
+        return (1 - self._tokens) / self._refillPerSecond;
+
+    def IsFull(self, now: float) -> bool:
+        self._Refill(now);
+        return self._tokens >= self._capacity;
+
+#One token bucket per client, only used from the event loop serving requests (or relaying them to the executor).
+#Buckets are kept per node, so with several nodes a client gets the rate of each node it reaches.
+class RateLimiter:
+    def __init__(self, ratePerMinute: float, burst: int, maxClients: int):
+        self._ratePerSecond: float = ratePerMinute / 60;
+        self._burst: int = max(1, burst);
+        self._maxClients: int = maxClients;
+        #Least recently seen clients first
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict();
+        self._relay: Optional[Callable[[str], Awaitable[Optional[float]]]] = None;
+
+    #HTTP workers take their tokens from the executor's buckets, which all of them share
+    def AttachRelay(self, relay: Callable[[str], Awaitable[Optional[float]]]) -> None:
+        self._relay = relay;
+
+    async def TryAcquireAsync(self, clientId: str) -> Optional[float]:
+        if not self._relay is None:
+            try:
+                return await self._relay(clientId);
+            except Exception as e:
+                logger.warning(f"Could not reach the executor's rate limiter, limiting in this worker: {e}");
+        return self.TryAcquire(clientId);
+
+    #Returns None if the client may proceed, otherwise the seconds until it may retry
+    def TryAcquire(self, clientId: str) -> Optional[float]:
+        if self._ratePerSecond <= 0:
+            return None;
+
+        now: float = time.monotonic();
+        bucket: Optional[TokenBucket] = self._buckets.get(clientId);
+        if bucket is None:
+            if len(self._buckets) >= self._maxClients:
+                self._ForgetClients(now);
+            bucket = TokenBucket(self._burst, self._ratePerSecond, now);
+            self._buckets[clientId] = bucket;
+        self._buckets.move_to_end(clientId);
+
+        waitSeconds: float = bucket.TryTake(now);
+        return waitSeconds if waitSeconds > 0 else None;
+
+    #Clients whose bucket has refilled are in the same state as new ones. When none has, the least recently seen
+    #clients are forgotten anyway, so clients rotating their address can't make the buckets grow without bound
+    def _ForgetClients(self, now: float) -> None:
+        for (clientId, bucket) in list(self._buckets.items()):
+            if bucket.IsFull(now):
+                del self._buckets[clientId];
+        while len(self._buckets) >= self._maxClients:
+            self._buckets.popitem(last=False);
+
+#Known API keys identify a client, otherwise its address does (set Sanic's PROXIES_COUNT or REAL_IP_HEADER
+#behind a reverse proxy). Keys are stored hashed.
+def GetClientId(request: Request) -> str:
+    apiKey: Optional[str] = request.headers.get("X-API-Key");
+    if not apiKey is None and apiKey in CONST.API_KEYS:
+        return f"key:{hashlib.sha256(apiKey.encode()).hexdigest()[:16]}";
+
+    return f"ip:{request.remote_addr or request.ip}";
+
+#Quiet, rejections are logged as a warning instead of with a traceback
+def TooManyRequests(message: str, retryAfterSeconds: float) -> SanicException:
+    return SanicException(
+        message,
+        429,
+        quiet=True,
+        headers={"Retry-After": str(max(1, math.ceil(retryAfterSeconds)))}
+    );
+
+#Called before the upload is received, so rejected clients don't get to send it
+async def AdmitSubmissionAsync(request: Request) -> str:
+    clientId: str = GetClientId(request);
+
+    retryAfterSeconds: Optional[float] = await GetRateLimiter().TryAcquireAsync(clientId);
+    if not retryAfterSeconds is None:
+        logger.warning(f"Client <{clientId}> exceeded the submission rate");
+        raise TooManyRequests("Too many submissions, try again later", retryAfterSeconds);
+
+    await CheckClientCapacityAsync(clientId, 1);
+    return clientId;
+
+#Rejects the submission of "newJobCount" jobs if the client would have too many unfinished jobs
+async def CheckClientCapacityAsync(clientId: str, newJobCount: int) -> None:
+    if CONST.MAX_ACTIVE_JOBS_PER_CLIENT <= 0:
+        return;
+    if newJobCount > CONST.MAX_ACTIVE_JOBS_PER_CLIENT:
+        raise SanicException(f"at most {CONST.MAX_ACTIVE_JOBS_PER_CLIENT} jobs can be submitted at once", 413);
+
+    activeJobs: int = await JobController.CountActiveJobsAsync(clientId);
+    if activeJobs + newJobCount <= CONST.MAX_ACTIVE_JOBS_PER_CLIENT:
+        return;
+
+    logger.warning(f"Client <{clientId}> has {activeJobs} unfinished jobs, rejecting {newJobCount} more");
+    #Until the client's first job is expected to finish
+    clientJobs: List[Dict[str, Any]] = await JobController.GetActiveJobsAsync(clientId);
+    forecast: QueueForecast = await QueueForecast.CreateAsync(clientJobs);
+    etaSeconds: List[float] = [
+        eta for (_, eta) in (forecast.Estimate(job) for job in clientJobs) if not eta is None
+    ];
+    raise TooManyRequests(
+        f"Too many unfinished jobs (at most {CONST.MAX_ACTIVE_JOBS_PER_CLIENT}), try again later",
+        min(etaSeconds, default=DEFAULT_RETRY_AFTER_SECONDS)
+    );
+
+#Rejects submissions while the queue is full
+async def CheckQueueCapacityAsync(newJobCount: int) -> None:
+    queuedJobs: int = await JobController.CountQueuedJobsAsync();
+    if queuedJobs + newJobCount <= CONST.MAX_QUEUED_JOBS:
+        return;
+
+    logger.warning(f"Queue full ({queuedJobs} jobs), rejecting {newJobCount} more");
+    forecast: QueueForecast = await QueueForecast.CreateForQueueAsync();
+    raise TooManyRequests("Too many jobs queued, try again later", forecast.GetSecondsUntilWorkerFree());
+
+rateLimiter = RateLimiter(CONST.SUBMISSIONS_PER_MINUTE, CONST.SUBMISSION_BURST, CONST.MAX_TRACKED_CLIENTS);
+
+def GetRateLimiter() -> RateLimiter:
+    return rateLimiter;
@@ -0,0 +1,43 @@
+import threading
+from typing import Dict, Optional, Callable
+
+#In-process signal for cancel requests, lets the thread supervising a job react immediately
+#instead of polling the DB. The request_terminate column remains the durable record.
+class CancellationRegistry:
+    def __init__(self):
+        self._lock = threading.Lock();
+        self._events: Dict[int, threading.Event] = {};
+        #Set in HTTP workers whose jobs run in the dedicated executor (see executor.py)
+        self._relay: Optional[Callable[[int], None]] = None;
+
+    def AttachRelay(self, relay: Callable[[int], None]) -> None:
+        self._relay = relay;
+
+    def GetEvent(self, jobId: int) -> threading.Event:
+        with self._lock:
+            event = self._events.get(jobId);
+            if event is None:
+                event = threading.Event();
+                self._events[jobId] = event;
+            return event;
+
+    def RequestCancel(self, jobId: int) -> None:
+        if not self._relay is None:
+            self._relay(jobId);
+            return;
+        self.GetEvent(jobId).set();
+
+    def IsCancelRequested(self, jobId: int) -> bool:
+        with self._lock:
+            event = self._events.get(jobId);
+            return not event is None and event.is_set();
+
+    #Call once the job has finished, no further cancel requests can affect it
+    def Release(self, jobId: int) -> None:
+        with self._lock:
+            self._events.pop(jobId, None);
+
+cancellationRegistry = CancellationRegistry();
+
+def GetCancellationRegistry() -> CancellationRegistry:
+    return cancellationRegistry;
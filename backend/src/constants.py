@@ -1,6 +1,199 @@
-from typing import Final
+from typing import Final, FrozenSet, Dict
+import os
+import socket
 
 class CONST:
     APPLICATION_NAME: Final[str] = "transcriber";
     MOCK_OMNIZART: Final[bool] = False;
-    MOCK_OMNIZART_ERROR: Final[bool] = True;
\ No newline at end of file
+    MOCK_OMNIZART_ERROR: Final[bool] = True;
+
+    #Uploaded source files are kept here until their job finishes, so queued jobs survive a restart
+    UPLOAD_DIR: Final[str] = os.environ.get("TRANSCRIBER_UPLOAD_DIR", "/data/uploads");
+    #Transcribed prefix of running segmented jobs (see /music/partial-result), removed once the job finishes
+    PARTIAL_RESULT_DIR: Final[str] = os.path.join(UPLOAD_DIR, "partial");
+
+    #Transcription results are kept outside of the DB, "local" is the only store available for now
+    RESULT_STORE: Final[str] = os.environ.get("TRANSCRIBER_RESULT_STORE", "local");
+    RESULT_STORE_DIR: Final[str] = os.environ.get("TRANSCRIBER_RESULT_STORE_DIR", "/data/results");
+    FILE_CHUNK_SIZE: Final[int] = 64 * 1024;
+
+    #Uploads are streamed to disk, these limits are checked while the body is received
+    MAX_UPLOAD_BYTES: Final[int] = int(os.environ.get("TRANSCRIBER_MAX_UPLOAD_BYTES", 200_000_000));
+    MAX_FORM_FIELD_BYTES: Final[int] = 64 * 1024;
+    #Number of input files accepted by one batch upload, zip archives are counted by their members
+    MAX_BATCH_INPUTS: Final[int] = int(os.environ.get("TRANSCRIBER_MAX_BATCH_INPUTS", 20));
+
+    #Number of omnizart processes allowed to run at once, each one is CPU & memory heavy
+    MAX_CONCURRENT_JOBS: Final[int] = int(os.environ.get(
+        "TRANSCRIBER_MAX_CONCURRENT_JOBS", 
+        max(1, (os.cpu_count() or 1) // 2)
+    ));
+    #Jobs are sent to long-lived omnizart processes that keep their models loaded,
+    #set to "0" to start the omnizart CLI for every job instead
+    USE_WARM_WORKERS: Final[bool] = os.environ.get("TRANSCRIBER_USE_WARM_WORKERS", "1") == "1";
+    #Warm workers are replaced after this many jobs, to keep their memory use in check
+    WORKER_MAX_JOBS: Final[int] = int(os.environ.get("TRANSCRIBER_WORKER_MAX_JOBS", 20));
+    #Long recordings are split into overlapping segments that are transcribed in parallel,
+    #only for modes whose output can be stitched back together (see transcriber.segmentableModes).
+    #Segments are started in time order, the transcribed prefix is available before the job finishes
+    SEGMENTED_TRANSCRIPTION: Final[bool] = os.environ.get("TRANSCRIBER_SEGMENTED_TRANSCRIPTION", "0") == "1";
+    SEGMENT_SECONDS: Final[float] = float(os.environ.get("TRANSCRIBER_SEGMENT_SECONDS", 60));
+    SEGMENT_OVERLAP_SECONDS: Final[float] = float(os.environ.get("TRANSCRIBER_SEGMENT_OVERLAP_SECONDS", 4));
+    #Segments of one job transcribed at once, each one is an omnizart process next to those of the other running jobs.
+    #Defaults to the cores left to each of MAX_CONCURRENT_JOBS
+    MAX_PARALLEL_SEGMENTS: Final[int] = int(os.environ.get(
+        "TRANSCRIBER_MAX_PARALLEL_SEGMENTS",
+        max(1, (os.cpu_count() or 1) // MAX_CONCURRENT_JOBS)
+    ));
+    #Jobs are only started while the memory of the running ones (at least what their mode is expected to need)
+    #and of idle warm workers leaves room for them under this budget, the next job waits otherwise.
+    #"0" uses MEMORY_BUDGET_FRACTION of the physical memory or of the container's limit, whichever is lower
+    MEMORY_BUDGET_MB: Final[int] = int(os.environ.get("TRANSCRIBER_MEMORY_BUDGET_MB", 0));
+    MEMORY_BUDGET_FRACTION: Final[float] = 0.8;
+    #Peak memory of one omnizart process assumed for a mode until jobs of that mode have been sampled
+    DEFAULT_PROCESS_MEMORY_MB: Final[Dict[str, int]] = {
+        "music": 3072,
+        "drum": 2048,
+        "chord": 1024,
+        "vocal": 4096,
+        "vocal-contour": 2048
+    };
+    #Weight of each finished job's peak in the learned memory per mode, higher peaks replace it right away
+    MEMORY_ESTIMATE_SMOOTHING: Final[float] = 0.2;
+    #omnizart processes using more resident memory are killed & their job ends as OOM_KILLED, "0" disables the limit
+    PROCESS_MEMORY_LIMIT_MB: Final[int] = int(os.environ.get("TRANSCRIBER_PROCESS_MEMORY_LIMIT_MB", 0));
+    #RLIMIT_AS of the omnizart processes, "0" disables the limit.
+    #Tensorflow reserves a lot more address space than it uses, leave plenty of headroom
+    PROCESS_ADDRESS_SPACE_LIMIT_MB: Final[int] = int(os.environ.get("TRANSCRIBER_PROCESS_ADDRESS_SPACE_LIMIT_MB", 0));
+    #Memory & CPU of the omnizart processes are sampled (from /proc) at this interval
+    RESOURCE_SAMPLE_SECONDS: Final[float] = 1;
+    #Jobs whose decoding or inference takes longer fail, "0" disables the limit
+    DECODE_TIMEOUT_SECONDS: Final[float] = float(os.environ.get("TRANSCRIBER_DECODE_TIMEOUT_SECONDS", 600));
+    INFERENCE_TIMEOUT_SECONDS: Final[float] = float(os.environ.get("TRANSCRIBER_INFERENCE_TIMEOUT_SECONDS", 4 * 3600));
+    #/music/transcribe waits this long for its job before giving up on it, the response timeout is raised to match
+    SYNC_TRANSCRIPTION_TIMEOUT_SECONDS: Final[float] = float(os.environ.get("TRANSCRIBER_SYNC_TRANSCRIPTION_TIMEOUT_SECONDS", 1800));
+    #Submissions are rejected once this many jobs are waiting in the queue
+    MAX_QUEUED_JOBS: Final[int] = int(os.environ.get("TRANSCRIBER_MAX_QUEUED_JOBS", 100));
+    #Within a priority, jobs expected to finish sooner are dequeued first. A job can be overtaken by shorter ones
+    #submitted up to this many seconds later per second of estimated compute they save, "0" dequeues in FIFO order
+    SJF_WEIGHT: Final[float] = float(os.environ.get("TRANSCRIBER_SJF_WEIGHT", 1));
+    #Jobs of clients with more work waiting are pushed back, a job can be overtaken by other clients' jobs
+    #submitted up to this many seconds later per second of estimated work its client submitted before it
+    FAIR_SHARE_WEIGHT: Final[float] = float(os.environ.get("TRANSCRIBER_FAIR_SHARE_WEIGHT", 1));
+    #Compute seconds per second of audio assumed for a mode until jobs of that mode have completed
+    DEFAULT_COMPUTE_SECONDS_PER_AUDIO_SECOND: Final[float] = float(os.environ.get(
+        "TRANSCRIBER_DEFAULT_COMPUTE_SECONDS_PER_AUDIO_SECOND",
+        1
+    ));
+    #Weight of each completed job in the learned cost per mode, and the number of past jobs it is seeded from
+    THROUGHPUT_SMOOTHING: Final[float] = 0.2;
+    THROUGHPUT_HISTORY_SIZE: Final[int] = 50;
+    #Duration assumed from an upload's size when it can't be probed (128kbps)
+    ESTIMATED_BYTES_PER_AUDIO_SECOND: Final[int] = 16000;
+    #Idle workers recheck the queue at this interval in case a wakeup was missed
+    SCHEDULER_IDLE_POLL_SECONDS: Final[float] = 30;
+
+    #Clients are told by their API key (X-API-Key header), only keys listed here are accepted,
+    #other clients are told by their IP address
+    API_KEYS: Final[FrozenSet[str]] = frozenset(
+        key.strip() for key in os.environ.get("TRANSCRIBER_API_KEYS", "").split(",") if key.strip() != ""
+    );
+    #Submissions each client may make, with bursts of up to SUBMISSION_BURST, "0" disables the limit
+    SUBMISSIONS_PER_MINUTE: Final[float] = float(os.environ.get("TRANSCRIBER_SUBMISSIONS_PER_MINUTE", 30));
+    SUBMISSION_BURST: Final[int] = int(os.environ.get("TRANSCRIBER_SUBMISSION_BURST", 10));
+    #Unfinished jobs a client may have at once, "0" disables the limit
+    MAX_ACTIVE_JOBS_PER_CLIENT: Final[int] = int(os.environ.get("TRANSCRIBER_MAX_ACTIVE_JOBS_PER_CLIENT", 50));
+    #Idle clients are forgotten by the rate limiter & the fair share bookkeeping once they track this many
+    MAX_TRACKED_CLIENTS: Final[int] = 10000;
+
+    #Results are reused for identical uploads (same file, mode & omnizart version)
+    #until the cache exceeds either of these limits, least recently used entries go first
+    RESULT_CACHE_MAX_BYTES: Final[int] = int(os.environ.get("TRANSCRIBER_RESULT_CACHE_MAX_BYTES", 1_000_000_000));
+    RESULT_CACHE_MAX_AGE_DAYS: Final[float] = float(os.environ.get("TRANSCRIBER_RESULT_CACHE_MAX_AGE_DAYS", 30));
+
+    #Note arrays & audio previews of results (see derived_cache) are built on first request & kept here,
+    #least recently used ones are deleted once they take more than DERIVED_CACHE_MAX_BYTES
+    DERIVED_CACHE_DIR: Final[str] = os.environ.get("TRANSCRIBER_DERIVED_CACHE_DIR", "/data/derived");
+    DERIVED_CACHE_MAX_BYTES: Final[int] = int(os.environ.get("TRANSCRIBER_DERIVED_CACHE_MAX_BYTES", 500_000_000));
+    #Builds running at once per server process, requests for other artifacts wait for a slot
+    DERIVED_MAX_CONCURRENT_BUILDS: Final[int] = int(os.environ.get("TRANSCRIBER_DERIVED_MAX_CONCURRENT_BUILDS", 2));
+    DERIVED_BUILD_TIMEOUT_SECONDS: Final[float] = float(os.environ.get("TRANSCRIBER_DERIVED_BUILD_TIMEOUT_SECONDS", 300));
+    #Audio previews are rendered by fluidsynth with this General MIDI soundfont & encoded to mp3 by ffmpeg
+    SOUNDFONT_PATH: Final[str] = os.environ.get("TRANSCRIBER_SOUNDFONT_PATH", "/usr/share/sounds/sf2/FluidR3_GM.sf2");
+    PREVIEW_SAMPLE_RATE: Final[int] = 22050;
+    PREVIEW_BITRATE: Final[str] = "96k";
+
+    #Finished jobs are deleted this long after they ended, "0" keeps them forever.
+    #Results no longer linked to a job or held by the result cache are deleted along with them
+    JOB_RETENTION_DAYS: Final[float] = float(os.environ.get("TRANSCRIBER_JOB_RETENTION_DAYS", 90));
+    #Retention, result garbage collection & DB compaction run in the background at this interval
+    MAINTENANCE_INTERVAL_SECONDS: Final[float] = float(os.environ.get("TRANSCRIBER_MAINTENANCE_INTERVAL_SECONDS", 3600));
+    MAINTENANCE_START_DELAY_SECONDS: Final[float] = 60;
+    #Maintenance deletes this many rows (or frees this many sqlite pages) at a time & pauses in between,
+    #so requests are never stuck behind it for long
+    MAINTENANCE_BATCH_SIZE: Final[int] = 200;
+    MAINTENANCE_VACUUM_PAGES: Final[int] = 256;
+    MAINTENANCE_PAUSE_SECONDS: Final[float] = 0.05;
+    #Results younger than this are never collected, they may be about to be linked to a job
+    ORPHAN_GRACE_SECONDS: Final[float] = 3600;
+
+    #"sqlite" keeps all state in one file, so only one node can run.
+    #With "postgres" several nodes can share the job queue (as well as UPLOAD_DIR & RESULT_STORE_DIR)
+    DB_ENGINE: Final[str] = os.environ.get("TRANSCRIBER_DB_ENGINE", "sqlite");
+    SQLITE_PATH: Final[str] = os.environ.get("TRANSCRIBER_SQLITE_PATH", "/data/db.sqlite");
+    POSTGRES_HOST: Final[str] = os.environ.get("TRANSCRIBER_POSTGRES_HOST", "localhost");
+    POSTGRES_PORT: Final[int] = int(os.environ.get("TRANSCRIBER_POSTGRES_PORT", 5432));
+    POSTGRES_DATABASE: Final[str] = os.environ.get("TRANSCRIBER_POSTGRES_DATABASE", "transcriber");
+    POSTGRES_USER: Final[str] = os.environ.get("TRANSCRIBER_POSTGRES_USER", "postgres");
+    POSTGRES_PASSWORD: Final[str] = os.environ.get("TRANSCRIBER_POSTGRES_PASSWORD", "");
+    POSTGRES_POOL_SIZE: Final[int] = int(os.environ.get("TRANSCRIBER_POSTGRES_POOL_SIZE", 10));
+    #Identifies the node that claimed a job, so a node restarting with postgres only recovers its own jobs.
+    #Required with postgres as it has to survive restarts, the hostname of a recreated container doesn't
+    NODE_ID: Final[str] = os.environ.get("TRANSCRIBER_NODE_ID", socket.gethostname());
+    #Cancel requests received by another node are picked up from the DB at this interval
+    REMOTE_TERMINATION_POLL_SECONDS: Final[float] = 2;
+    #Jobs enqueued by another node don't wake this node's workers, they recheck the queue at this interval instead
+    SHARED_QUEUE_POLL_SECONDS: Final[float] = float(os.environ.get("TRANSCRIBER_SHARED_QUEUE_POLL_SECONDS", 1));
+
+    #Run jobs in one process started by Sanic's worker manager next to the HTTP workers (--workers N),
+    #so they all share one queue & MAX_CONCURRENT_JOBS. Otherwise every server process runs jobs itself
+    DEDICATED_EXECUTOR: Final[bool] = os.environ.get("TRANSCRIBER_DEDICATED_EXECUTOR", "0") == "1";
+    #Unix socket the HTTP workers reach the executor through
+    EXECUTOR_SOCKET_PATH: Final[str] = os.environ.get("TRANSCRIBER_EXECUTOR_SOCKET_PATH", "/tmp/transcriber-executor.sock");
+    #Messages for the executor are kept this long while it can't be reached
+    EXECUTOR_MAX_PENDING_MESSAGES: Final[int] = 1000;
+    EXECUTOR_RECONNECT_SECONDS: Final[float] = 1;
+    EXECUTOR_REQUEST_TIMEOUT_SECONDS: Final[float] = 5;
+
+    #Reader connections kept open by the DB engine, writes all go through one connection
+    DB_READ_CONNECTIONS: Final[int] = int(os.environ.get("TRANSCRIBER_DB_READ_CONNECTIONS", 4));
+    #Writes queued together are committed in one transaction, up to this many
+    DB_MAX_WRITE_BATCH_SIZE: Final[int] = 64;
+
+    #Number of past job events kept for clients resuming an event stream
+    JOB_EVENT_HISTORY_SIZE: Final[int] = 1000;
+    #Subscribers that fall this far behind are told to resync instead of receiving every event
+    JOB_EVENT_SUBSCRIBER_QUEUE_SIZE: Final[int] = 256;
+    JOB_EVENT_KEEPALIVE_SECONDS: Final[float] = 15;
+
+    #/music/status responses are kept serialized until the job changes, for this many jobs & list queries.
+    #They are read again after STATUS_CACHE_MAX_AGE_SECONDS anyway, in case the job was deleted by maintenance.
+    #Progress & ETAs of unfinished jobs are recomputed after STATUS_ESTIMATE_MAX_AGE_SECONDS
+    STATUS_CACHE_MAX_JOBS: Final[int] = int(os.environ.get("TRANSCRIBER_STATUS_CACHE_MAX_JOBS", 10000));
+    STATUS_CACHE_MAX_LISTS: Final[int] = 256;
+    STATUS_CACHE_MAX_AGE_SECONDS: Final[float] = 60;
+    STATUS_ESTIMATE_MAX_AGE_SECONDS: Final[float] = 1;
+
+    #Page size of /music/status/all when no limit is given, and the largest page that may be requested
+    STATUS_PAGE_DEFAULT_LIMIT: Final[int] = 100;
+    STATUS_PAGE_MAX_LIMIT: Final[int] = 1000;
+
+#Every segment has to start past the previous one, SplitWav would never get to the end of the recording otherwise
+if CONST.SEGMENT_SECONDS <= 0 or not 0 <= CONST.SEGMENT_OVERLAP_SECONDS < CONST.SEGMENT_SECONDS / 2:
+    raise ValueError(
+        f"TRANSCRIBER_SEGMENT_SECONDS ({CONST.SEGMENT_SECONDS:g}) has to be positive & "
+        f"TRANSCRIBER_SEGMENT_OVERLAP_SECONDS ({CONST.SEGMENT_OVERLAP_SECONDS:g}) less than half of it"
+    );
+
+if CONST.DB_ENGINE == "postgres" and not "TRANSCRIBER_NODE_ID" in os.environ:
+    raise ValueError("TRANSCRIBER_NODE_ID has to be set with postgres, each node needs an id that stays the same across restarts");
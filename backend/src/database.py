@@ -0,0 +1,198 @@
+import asyncio
+import sqlite3
+from contextlib import closing
+from logging import Logger
+from typing import Optional, List, Any, Tuple
+from aiosqlite import Connection
+from piccolo.engine.sqlite import SQLiteEngine
+from piccolo.engine.finder import engine_finder
+
+from .constants import CONST
+
+#Value of "PRAGMA auto_vacuum" once incremental vacuum is enabled
+SQLITE_AUTO_VACUUM_INCREMENTAL: int = 2;
+
+#(sql, args, query type, table, result future)
+TPendingWrite = Tuple[str, Optional[List[Any]], str, Any, asyncio.Future];
+
+#SQLiteEngine opens a new connection for every query, while the server runs this engine keeps
+#one writer connection, fed by a queue whose writes are committed in batches, and a few reader connections.
+#The DB is switched to WAL, so reads aren't blocked by writes.
+#Queries from other event loops (startup code, run_sync) use SQLiteEngine's connection per query.
+class PooledSQLiteEngine(SQLiteEngine):
+    def __init__(self, path: str, readConnectionCount: int, maxWriteBatchSize: int, **connectionKwargs):
+        super().__init__(path=path, **connectionKwargs);
+
+        self._readConnectionCount: int = readConnectionCount;
+        self._maxWriteBatchSize: int = maxWriteBatchSize;
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None;
+        self._writerConnection: Optional[Connection] = None;
+        self._readConnections: List[Connection] = [];
+        self._nextReadConnection: int = 0;
+        self._writeQueue: Optional[asyncio.Queue] = None;
+        self._writerTask: Optional[asyncio.Task] = None;
+
+    async def get_connection(self) -> Connection:
+        connection: Connection = await super().get_connection();
+        #With WAL, NORMAL only risks the latest commits on power loss, not corruption
+        await connection.execute("PRAGMA synchronous = NORMAL");
+        return connection;
+
+    def GetAttachedLoop(self) -> Optional[asyncio.AbstractEventLoop]:
+        return self._loop;
+
+    #Call from the event loop serving requests, queries on that loop use the pooled connections from then on
+    async def OpenAsync(self) -> None:
+        self._writerConnection = await self.get_connection();
+        #The cursor has to be consumed, an unfinished statement keeps the DB locked
+        async with self._writerConnection.execute("PRAGMA journal_mode = WAL") as cursor:
+            await cursor.fetchall();
+        self._readConnections = [await self.get_connection() for _ in range(self._readConnectionCount)];
+
+        self._writeQueue = asyncio.Queue();
+        self._writerTask = asyncio.get_running_loop().create_task(self._WriterLoop());
+        self._loop = asyncio.get_running_loop();
+
+    #Queued writes are completed first
+    async def CloseAsync(self) -> None:
+        if self._loop is None:
+            return;
+
+        self._loop = None;
+        self._writeQueue.put_nowait(None);
+        await self._writerTask;
+
+        for connection in [self._writerConnection] + self._readConnections:
+            await connection.close();
+        self._writerConnection = None;
+        self._readConnections = [];
+
+    async def _run_in_new_connection(
+        self,
+        query: str,
+        args: Optional[List[Any]] = None,
+        query_type: str = "generic",
+        table: Any = None
+        ) -> Any:
+
+        if self._loop is None or asyncio.get_running_loop() is not self._loop:
+            return await super()._run_in_new_connection(query, args, query_type, table);
+
+        if query.lstrip()[:6].upper() == "SELECT":
+            connection: Connection = self._readConnections[self._nextReadConnection % len(self._readConnections)];
+            self._nextReadConnection += 1;
+            return await self._run_in_existing_connection(connection, query, args, query_type, table);
+
+        result: asyncio.Future = self._loop.create_future();
+        self._writeQueue.put_nowait((query, args, query_type, table, result));
+        return await result;
+
+    async def _WriterLoop(self) -> None:
+        while True:
+            write: Optional[TPendingWrite] = await self._writeQueue.get();
+            if write is None:
+                return;
+
+            batch: List[TPendingWrite] = [write];
+            while len(batch) < self._maxWriteBatchSize and not self._writeQueue.empty():
+                write = self._writeQueue.get_nowait();
+                if write is None:
+                    #Closing, stop once this batch is written
+                    self._writeQueue.put_nowait(None);
+                    break;
+                batch.append(write);
+
+            await self._RunWriteBatch(batch);
+
+    #Writes queued at the same time share one transaction, so one commit (& fsync) instead of one each
+    async def _RunWriteBatch(self, batch: List[TPendingWrite]) -> None:
+        if len(batch) > 1:
+            try:
+                await self._writerConnection.execute("BEGIN IMMEDIATE");
+                results: List[Any] = [
+                    await self._run_in_existing_connection(self._writerConnection, query, args, queryType, table)
+                    for (query, args, queryType, table, _) in batch
+                ];
+                await self._writerConnection.execute("COMMIT");
+            except Exception:
+                #A failing write mustn't take the rest of the batch with it, they are retried one at a time
+                try:
+                    await self._writerConnection.execute("ROLLBACK");
+                except Exception:
+                    pass;
+            else:
+                for ((_, _, _, _, resultFuture), result) in zip(batch, results):
+                    if not resultFuture.done():
+                        resultFuture.set_result(result);
+                return;
+
+        for (query, args, queryType, table, resultFuture) in batch:
+            try:
+                result: Any = await self._run_in_existing_connection(self._writerConnection, query, args, queryType, table);
+                if not resultFuture.done():
+                    resultFuture.set_result(result);
+            except Exception as e:
+                if not resultFuture.done():
+                    resultFuture.set_exception(e);
+
+#Event loop of the server, once the DB has been opened on it
+attachedLoop: Optional[asyncio.AbstractEventLoop] = None;
+
+#Call from the event loop serving requests
+async def OpenDatabaseAsync() -> None:
+    global attachedLoop;
+    engine = engine_finder();
+    if isinstance(engine, PooledSQLiteEngine):
+        await engine.OpenAsync();
+    elif engine.engine_type == "postgres":
+        await engine.start_connection_pool(max_size=CONST.POSTGRES_POOL_SIZE);
+
+    attachedLoop = asyncio.get_running_loop();
+
+async def CloseDatabaseAsync() -> None:
+    global attachedLoop;
+    attachedLoop = None;
+
+    engine = engine_finder();
+    if isinstance(engine, PooledSQLiteEngine):
+        await engine.CloseAsync();
+    elif engine.engine_type == "postgres":
+        await engine.close_connection_pool();
+
+#Freed pages are only returned to the OS by a full VACUUM unless auto_vacuum is INCREMENTAL,
+#which in turn can only be switched on by rebuilding the DB once (with VACUUM). Call before the server starts.
+def EnableIncrementalVacuum(logger: Logger) -> None:
+    if engine_finder().engine_type != "sqlite":
+        return;
+
+    with closing(sqlite3.connect(CONST.SQLITE_PATH, isolation_level=None)) as connection:
+        if connection.execute("PRAGMA auto_vacuum").fetchone()[0] == SQLITE_AUTO_VACUUM_INCREMENTAL:
+            return;
+
+        logger.info("Rebuilding the DB to enable incremental vacuum, this only happens once");
+        connection.execute("PRAGMA auto_vacuum = INCREMENTAL");
+        connection.execute("VACUUM");
+
+#Returns up to "pageCount" free pages to the OS, blocking. Python's sqlite3 only steps this pragma once (freeing
+#one page) unless it is run as a script, which the engine can't do, so it gets a connection of its own
+def IncrementalVacuum(pageCount: int) -> None:
+    with closing(sqlite3.connect(CONST.SQLITE_PATH, isolation_level=None)) as connection:
+        connection.executescript(f"PRAGMA incremental_vacuum({int(pageCount)})");
+
+def IsPostgres() -> bool:
+    return engine_finder().engine_type == "postgres";
+
+#For worker threads, runs the query on the server's event loop (and its pooled connections) once the DB is open
+def RunSync(query: Any) -> Any:
+    loop: Optional[asyncio.AbstractEventLoop] = attachedLoop;
+
+    try:
+        onLoopThread: bool = asyncio.get_running_loop() is loop;
+    except RuntimeError:
+        onLoopThread = False;
+
+    if loop is None or onLoopThread:
+        return query.run_sync();
+
+    return asyncio.run_coroutine_threadsafe(query.run(), loop).result();
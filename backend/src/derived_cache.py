@@ -0,0 +1,329 @@
+import asyncio
+import fcntl
+import json
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from logging import Logger
+from typing import BinaryIO, Callable, Dict, List, Optional, Set, Tuple
+
+from .midi_util import MidiUtil, TMidiFile
+from .sound_util import SoundUtil
+from .metrics import derivedCacheLookups, derivedBuildDuration
+from .constants import CONST
+from .util import CreateLogger
+
+#Compact note array for piano roll rendering, little endian:
+#b"TNA1", uint32 note count, 16 uint8 programs by channel (255 where none is set),
+#then for each note uint32 start & uint32 duration in milliseconds, uint8 pitch, velocity & channel and a padding byte
+NOTES_BINARY_MAGIC: bytes = b"TNA1";
+NOTES_BINARY_HEADER = struct.Struct("<4sI16s");
+NOTES_BINARY_NOTE = struct.Struct("<IIBBBx");
+
+@dataclass
+class TDerivedKind:
+    name: str
+    extension: str
+    mimeType: str
+    #Builds the artifact from the result file (1st argument) into the 2nd, blocking
+    build: Callable[[str, str], None]
+    #Bumped whenever the output changes, older artifacts are rebuilt & ETags change along
+    version: int
+    isAvailable: Callable[[], bool]
+    #What building it takes, told to clients when it isn't available
+    requirements: str
+
+def _GetDurationSeconds(midiFile: TMidiFile) -> float:
+    return max((note.end for note in midiFile.notes), default=0);
+
+def _BuildNotesJson(srcPath: str, destPath: str) -> None:
+    midiFile: TMidiFile = MidiUtil.Read(srcPath);
+    with open(destPath, "w") as hFile:
+        json.dump({
+            "duration": round(_GetDurationSeconds(midiFile), 3),
+            "programs": {str(channel): program for (channel, program) in sorted(midiFile.programs.items())},
+            #[start, end, pitch, velocity, channel] in seconds, by start time
+            "notes": [
+                [round(note.start, 3), round(note.end, 3), note.pitch, note.velocity, note.channel]
+                for note in midiFile.notes
+            ]
+        }, hFile, separators=(",", ":"));
+
+def _BuildNotesBinary(srcPath: str, destPath: str) -> None:
+    midiFile: TMidiFile = MidiUtil.Read(srcPath);
+    programs: bytearray = bytearray([255] * 16);
+    for (channel, program) in midiFile.programs.items():
+        programs[channel] = program;
+
+    with open(destPath, "wb") as hFile:
+        hFile.write(NOTES_BINARY_HEADER.pack(NOTES_BINARY_MAGIC, len(midiFile.notes), bytes(programs)));
+        for note in midiFile.notes:
+            startMilliseconds: int = round(note.start * 1000);
+            hFile.write(NOTES_BINARY_NOTE.pack(
+                startMilliseconds,
+                max(0, round(note.end * 1000) - startMilliseconds),
+                note.pitch,
+                note.velocity,
+                note.channel
+            ));
+
+def _RunTool(cmd: List[str]) -> None:
+    try:
+        completedProcess = subprocess.run(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            timeout=CONST.DERIVED_BUILD_TIMEOUT_SECONDS
+        );
+    except subprocess.TimeoutExpired:
+        raise Exception(f"{cmd[0]} did not finish within {CONST.DERIVED_BUILD_TIMEOUT_SECONDS:g}s");
+
+    if completedProcess.returncode != 0:
+        raise Exception(
+            f"{cmd[0]} returncode = {completedProcess.returncode}: " +
+            completedProcess.stderr.decode(errors="replace").strip()
+        );
+
+#Renders the MIDI file with fluidsynth, the .wav it writes is encoded to mp3 as it's ~10x the size
+def _BuildPreview(srcPath: str, destPath: str) -> None:
+    with tempfile.TemporaryDirectory() as workDir:
+        wavPath: str = os.path.join(workDir, "preview.wav");
+        _RunTool([
+            "fluidsynth", "-ni",
+            "-F", wavPath,
+            "-T", "wav",
+            "-r", str(CONST.PREVIEW_SAMPLE_RATE),
+            CONST.SOUNDFONT_PATH,
+            srcPath
+        ]);
+        _RunTool([
+            "ffmpeg", "-nostdin", "-y", "-v", "error",
+            "-i", wavPath,
+            "-b:a", CONST.PREVIEW_BITRATE,
+            "-f", "mp3", destPath
+        ]);
+
+def _IsPreviewAvailable() -> bool:
+    return (
+        not shutil.which("fluidsynth") is None and
+        SoundUtil.IsFfmpegAvailable() and
+        os.path.isfile(CONST.SOUNDFONT_PATH)
+    );
+
+NOTES_JSON = TDerivedKind(
+    "notes", ".json", "application/json", _BuildNotesJson, 1,
+    lambda: True, ""
+);
+NOTES_BINARY = TDerivedKind(
+    "notes-binary", ".bin", "application/octet-stream", _BuildNotesBinary, 1,
+    lambda: True, ""
+);
+PREVIEW = TDerivedKind(
+    "preview", ".mp3", "audio/mpeg", _BuildPreview, 1,
+    _IsPreviewAvailable, f"fluidsynth, ffmpeg & the soundfont <{CONST.SOUNDFONT_PATH}>"
+);
+
+#Artifacts derived from transcription results, built the first time they are requested.
+#Files are named after the result's sha256, jobs sharing a result share its artifacts.
+#Serving an artifact touches its file, the least recently served ones are deleted past "maxBytes".
+#Concurrent requests in a process wait for the same build, other server processes wait on the artifact's lock file.
+#Lock files are only removed while holding them, a builder that locked one removed meanwhile locks the new one
+class DerivedCache:
+    def __init__(self, rootDir: str, maxBytes: int, maxConcurrentBuilds: int, logger: Logger):
+        self._rootDir: str = rootDir;
+        self._maxBytes: int = maxBytes;
+        self._logger: Logger = logger;
+
+        #Running builds by artifact path
+        self._builds: Dict[str, asyncio.Future] = {};
+        self._buildSlots = threading.BoundedSemaphore(maxConcurrentBuilds);
+        self._evictLock = threading.Lock();
+
+    #Artifacts only depend on the result & the kind's version, clients can revalidate without a build
+    @staticmethod
+    def GetEtag(sha256: str, kind: TDerivedKind) -> str:
+        return f'"{sha256}-{kind.name}-v{kind.version}"';
+
+    def _GetPath(self, sha256: str, kind: TDerivedKind) -> str:
+        return os.path.join(self._rootDir, f"{sha256}.{kind.name}-v{kind.version}{kind.extension}");
+
+    #Path of the artifact of the result "sha256" stored at "resultPath", built first if needed
+    async def GetAsync(self, sha256: str, resultPath: str, kind: TDerivedKind) -> str:
+        path: str = self._GetPath(sha256, kind);
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop();
+        if not path in self._builds and await loop.run_in_executor(None, self._Touch, path):
+            derivedCacheLookups.Inc(kind.name, "hit");
+            return path;
+
+        build: Optional[asyncio.Future] = self._builds.get(path);
+        if build is None:
+            derivedCacheLookups.Inc(kind.name, "miss");
+            build = loop.run_in_executor(None, self._Build, sha256, resultPath, path, kind);
+            self._builds[path] = build;
+            build.add_done_callback(lambda _: self._builds.pop(path, None));
+        else:
+            derivedCacheLookups.Inc(kind.name, "shared");
+
+        #A request going away doesn't stop the build for the others
+        return await asyncio.shield(build);
+
+    #"GetAsync" but opened. An opened artifact stays readable when it is evicted,
+    #one evicted by another server process before it could be opened is built again
+    async def OpenAsync(self, sha256: str, resultPath: str, kind: TDerivedKind) -> BinaryIO:
+        while True:
+            path: str = await self.GetAsync(sha256, resultPath, kind);
+            try:
+                return await asyncio.get_running_loop().run_in_executor(None, open, path, "rb");
+            except FileNotFoundError:
+                self._logger.info(f"{kind.name} of result <{sha256}> was evicted before it was served, building it again");
+
+    @staticmethod
+    def _Touch(path: str) -> bool:
+        try:
+            os.utime(path);
+            return True;
+        except FileNotFoundError:
+            return False;
+
+    def _Build(self, sha256: str, resultPath: str, path: str, kind: TDerivedKind) -> str:
+        os.makedirs(self._rootDir, exist_ok=True);
+        with self._Lock(path + ".lock"):
+            if self._Touch(path):
+                return path;
+
+            with self._buildSlots:
+                start: float = time.perf_counter();
+                #Written next to the artifact so the rename below stays on one filesystem
+                (fd, tempPath) = tempfile.mkstemp(dir=self._rootDir, prefix=".build-", suffix=kind.extension);
+                os.close(fd);
+                try:
+                    kind.build(resultPath, tempPath);
+                    os.replace(tempPath, path);
+                finally:
+                    if os.path.exists(tempPath):
+                        os.remove(tempPath);
+
+            buildSeconds: float = time.perf_counter() - start;
+            derivedBuildDuration.Observe(buildSeconds, kind.name);
+            self._logger.info(f"Built {kind.name} of result <{sha256}> in {buildSeconds:.2f}s");
+
+        #Not evicted before the caller gets to open it even when it doesn't fit by itself
+        self._Evict(os.path.basename(path));
+        return path;
+
+    @staticmethod
+    def _Lock(lockPath: str) -> BinaryIO:
+        while True:
+            hLockFile: BinaryIO = open(lockPath, "ab");
+            fcntl.flock(hLockFile, fcntl.LOCK_EX);
+            try:
+                if os.stat(lockPath).st_ino == os.fstat(hLockFile.fileno()).st_ino:
+                    return hLockFile;
+            except FileNotFoundError:
+                pass;
+            hLockFile.close();
+
+    #(name, size, last served) of every artifact
+    def _ListArtifacts(self) -> List[Tuple[str, int, float]]:
+        artifacts: List[Tuple[str, int, float]] = [];
+        try:
+            entries: List[os.DirEntry] = list(os.scandir(self._rootDir));
+        except FileNotFoundError:
+            return artifacts;
+
+        for entry in entries:
+            try:
+                stat: os.stat_result = entry.stat();
+            except FileNotFoundError:
+                continue;
+
+            if entry.name.startswith(".build-"):
+                #Left behind by a server process that stopped while building
+                if stat.st_mtime < time.time() - 2 * CONST.DERIVED_BUILD_TIMEOUT_SECONDS:
+                    self._RemoveFile(entry.name);
+            elif not entry.name.endswith(".lock"):
+                artifacts.append((entry.name, stat.st_size, stat.st_mtime));
+        return artifacts;
+
+    #Artifact "keepName" is never evicted
+    def _Evict(self, keepName: str) -> None:
+        with self._evictLock:
+            artifacts: List[Tuple[str, int, float]] = self._ListArtifacts();
+            totalBytes: int = sum(size for (_, size, _) in artifacts);
+            evicted: int = 0;
+            for (name, size, _) in sorted(artifacts, key=lambda artifact: artifact[2]):
+                if totalBytes <= self._maxBytes:
+                    break;
+                if name == keepName:
+                    continue;
+                self._Remove(name);
+                totalBytes -= size;
+                evicted += 1;
+
+        if evicted > 0:
+            self._logger.info(f"Evicted {evicted} derived artifacts");
+
+    def _Remove(self, name: str) -> None:
+        self._RemoveFile(name);
+        self._RemoveLockFile(name + ".lock");
+
+    def _RemoveFile(self, name: str) -> None:
+        try:
+            os.remove(os.path.join(self._rootDir, name));
+        except FileNotFoundError:
+            pass;
+
+    #Left in place while a build holds it, it's removed with the next eviction or deletion of the artifact
+    def _RemoveLockFile(self, name: str) -> None:
+        lockPath: str = os.path.join(self._rootDir, name);
+        try:
+            with open(lockPath, "rb") as hLockFile:
+                fcntl.flock(hLockFile, fcntl.LOCK_EX | fcntl.LOCK_NB);
+                if os.stat(lockPath).st_ino == os.fstat(hLockFile.fileno()).st_ino:
+                    os.remove(lockPath);
+        except (FileNotFoundError, BlockingIOError):
+            pass;
+
+    #Lock files left in place by "_RemoveLockFile"
+    def _ListLockFiles(self) -> List[str]:
+        try:
+            return [name for name in os.listdir(self._rootDir) if name.endswith(".lock")];
+        except FileNotFoundError:
+            return [];
+
+    #Blocking, hashes of the results that have artifacts
+    def ListResultHashes(self) -> Set[str]:
+        return {name.split(".")[0] for (name, _, _) in self._ListArtifacts()} | {
+            name.split(".")[0] for name in self._ListLockFiles()
+        };
+
+    #Blocking, removes every artifact of the results "sha256s", returns (artifacts, bytes) deleted
+    def Delete(self, sha256s: List[str]) -> Tuple[int, int]:
+        deleted: Set[str] = set(sha256s);
+        deletedArtifacts: int = 0;
+        deletedBytes: int = 0;
+        for (name, size, _) in self._ListArtifacts():
+            if name.split(".")[0] in deleted:
+                self._Remove(name);
+                deletedArtifacts += 1;
+                deletedBytes += size;
+        for name in self._ListLockFiles():
+            if name.split(".")[0] in deleted:
+                self._RemoveLockFile(name);
+        return (deletedArtifacts, deletedBytes);
+
+derivedCache = DerivedCache(
+    CONST.DERIVED_CACHE_DIR,
+    CONST.DERIVED_CACHE_MAX_BYTES,
+    CONST.DERIVED_MAX_CONCURRENT_BUILDS,
+    CreateLogger(__name__)
+);
+
+def GetDerivedCache() -> DerivedCache:
+    return derivedCache;
@@ -0,0 +1,286 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+from collections import deque
+from dataclasses import asdict
+from datetime import datetime
+from typing import Optional, Dict, Any, Set, Deque
+
+from .job_scheduler import GetScheduler
+from .job_events import GetJobEventBus
+from .cancellation import GetCancellationRegistry
+from .maintenance import GetMaintenanceTask
+from .throughput import GetThroughputModel, GetClientBacklogs
+from .admission import GetRateLimiter
+from .database import OpenDatabaseAsync, CloseDatabaseAsync
+from .metrics import GetMetricsRegistry, activeWorkers, workerCount
+from .schemas import JobEvent
+from .constants import CONST
+from .util import CreateLogger, ConvertDatetimeToIsoString
+
+logger = CreateLogger(__name__);
+
+#Messages are JSON objects, one per line. Metrics can make for long lines
+MAX_MESSAGE_BYTES: int = 16 * 1024 * 1024;
+
+#HTTP workers -> executor
+#   {"type": "notify"}                                         a job was enqueued
+#   {"type": "cancel", "job_id"}                               a running job was asked to terminate
+#   {"type": "publish", "job_id", "event_type", "status"}      a job event to number & send to every HTTP worker
+#   {"type": "request", "id", "name", "args"}                  "metrics", "maintenance-stats",
+#                                                              "rate-limit" {client_id} or "client-backlog" {client_id, seconds}
+#executor -> HTTP workers
+#   {"type": "event", "event"}                                 a JobEvent
+#   {"type": "state", "seconds_per_audio_second"}              the learned cost per mode, whenever a job finishes
+#   {"type": "reply", "id", "data" or "error"}
+def _Encode(message: Dict[str, Any]) -> bytes:
+    return (json.dumps(message) + "\n").encode();
+
+#Server processes started by Sanic's worker manager are named "Sanic-Server-<n>-<m>"
+def IsExecutorClient() -> bool:
+    return CONST.DEDICATED_EXECUTOR and "Server" in os.environ.get("SANIC_WORKER_NAME", "");
+
+#Runs in the executor process, relays the HTTP workers' messages to the scheduler & sends job events back to all of them
+class ExecutorServer:
+    def __init__(self, socketPath: str):
+        self._socketPath: str = socketPath;
+        self._server: Optional[asyncio.AbstractServer] = None;
+        self._connections: Set[asyncio.StreamWriter] = set();
+
+    async def StartAsync(self) -> None:
+        #Left behind by an executor that didn't shut down cleanly
+        if os.path.exists(self._socketPath):
+            os.remove(self._socketPath);
+
+        self._server = await asyncio.start_unix_server(
+            self._HandleConnectionAsync,
+            self._socketPath,
+            limit=MAX_MESSAGE_BYTES
+        );
+        GetJobEventBus().AddListener(self._OnEvent);
+
+    async def StopAsync(self) -> None:
+        self._server.close();
+        for writer in list(self._connections):
+            writer.close();
+        await self._server.wait_closed();
+
+    def _OnEvent(self, event: JobEvent) -> None:
+        self._Broadcast({"type": "event", "event": ConvertDatetimeToIsoString(asdict(event))});
+        if event.done:
+            self._Broadcast(self._GetStateMessage());
+
+    @staticmethod
+    def _GetStateMessage() -> Dict[str, Any]:
+        return {"type": "state", "seconds_per_audio_second": GetThroughputModel().GetState()};
+
+    def _Broadcast(self, message: Dict[str, Any]) -> None:
+        data: bytes = _Encode(message);
+        for writer in self._connections:
+            if not writer.is_closing():
+                writer.write(data);
+
+    async def _HandleConnectionAsync(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections.add(writer);
+        writer.write(_Encode(self._GetStateMessage()));
+        try:
+            while True:
+                line: bytes = await reader.readline();
+                if line == b"":
+                    return;
+                self._Handle(json.loads(line), writer);
+        except ConnectionError:
+            pass;
+        finally:
+            self._connections.discard(writer);
+            writer.close();
+
+    def _Handle(self, message: Dict[str, Any], writer: asyncio.StreamWriter) -> None:
+        messageType: str = message["type"];
+        if messageType == "notify":
+            GetScheduler().Notify();
+        elif messageType == "cancel":
+            GetCancellationRegistry().RequestCancel(message["job_id"]);
+        elif messageType == "publish":
+            GetJobEventBus().Publish(message["job_id"], message["event_type"], message["status"]);
+        elif messageType == "request":
+            reply: Dict[str, Any] = {"type": "reply", "id": message["id"]};
+            try:
+                reply["data"] = self._Answer(message["name"], message.get("args", {}));
+            except Exception as e:
+                logger.error(f"Request <{message['name']}> failed: {e}");
+                reply["error"] = str(e);
+            writer.write(_Encode(reply));
+        else:
+            logger.warning(f"Unknown message type <{messageType}>");
+
+    @staticmethod
+    def _Answer(name: str, args: Dict[str, Any]) -> Any:
+        #Submissions of every HTTP worker are limited & scheduled fairly together
+        if name == "rate-limit":
+            return GetRateLimiter().TryAcquire(args["client_id"]);
+        if name == "client-backlog":
+            return GetClientBacklogs().Add(args["client_id"], args["seconds"]);
+        if name == "metrics":
+            activeWorkers.Set(GetScheduler().GetActiveJobCount());
+            workerCount.Set(GetScheduler().GetWorkerCount());
+            return GetMetricsRegistry().Export();
+        if name == "maintenance-stats":
+            return ConvertDatetimeToIsoString(asdict(GetMaintenanceTask().GetStats()));
+
+        raise Exception(f"unknown request <{name}>");
+
+#Runs in each HTTP worker, stands in for the scheduler, the cancellation registry & the event bus of the executor
+class ExecutorClient:
+    def __init__(self, socketPath: str):
+        self._socketPath: str = socketPath;
+        self._loop: Optional[asyncio.AbstractEventLoop] = None;
+        self._task: Optional[asyncio.Task] = None;
+        self._writer: Optional[asyncio.StreamWriter] = None;
+        #Sent once the executor can be reached (again)
+        self._pending: Deque[bytes] = deque(maxlen=CONST.EXECUTOR_MAX_PENDING_MESSAGES);
+        self._replies: Dict[int, asyncio.Future] = {};
+        self._lastRequestId: int = 0;
+
+    #Call from the event loop serving requests
+    def Start(self) -> None:
+        self._loop = asyncio.get_running_loop();
+        GetScheduler().AttachRelay(lambda: self._Send({"type": "notify"}));
+        GetCancellationRegistry().AttachRelay(lambda jobId: self._Send({"type": "cancel", "job_id": jobId}));
+        GetJobEventBus().AttachRelay(lambda jobId, eventType, status: self._Send({
+            "type": "publish",
+            "job_id": jobId,
+            "event_type": eventType,
+            "status": status
+        }));
+        GetRateLimiter().AttachRelay(lambda clientId: self.RequestAsync("rate-limit", {"client_id": clientId}));
+        GetClientBacklogs().AttachRelay(lambda clientId, seconds: self.RequestAsync(
+            "client-backlog",
+            {"client_id": clientId, "seconds": seconds}
+        ));
+        self._task = self._loop.create_task(self._RunAsync());
+
+    async def StopAsync(self) -> None:
+        if self._task is None:
+            return;
+        self._task.cancel();
+        try:
+            await self._task;
+        except asyncio.CancelledError:
+            pass;
+        self._task = None;
+
+    #Thread-safe
+    def _Send(self, message: Dict[str, Any]) -> None:
+        self._loop.call_soon_threadsafe(self._Write, _Encode(message));
+
+    def _Write(self, data: bytes) -> None:
+        if self._writer is None:
+            if len(self._pending) == self._pending.maxlen:
+                logger.warning("The executor can't be reached, dropping the oldest message waiting for it");
+            self._pending.append(data);
+            return;
+        self._writer.write(data);
+
+    #Answered by the executor, raises ConnectionError while it can't be reached
+    async def RequestAsync(self, name: str, args: Dict[str, Any] = {}) -> Any:
+        if self._writer is None:
+            raise ConnectionError("the executor can't be reached");
+
+        self._lastRequestId += 1;
+        requestId: int = self._lastRequestId;
+        reply: asyncio.Future = self._loop.create_future();
+        self._replies[requestId] = reply;
+        try:
+            self._writer.write(_Encode({"type": "request", "id": requestId, "name": name, "args": args}));
+            return await asyncio.wait_for(reply, CONST.EXECUTOR_REQUEST_TIMEOUT_SECONDS);
+        finally:
+            self._replies.pop(requestId, None);
+
+    async def _RunAsync(self) -> None:
+        while True:
+            try:
+                (reader, writer) = await asyncio.open_unix_connection(self._socketPath, limit=MAX_MESSAGE_BYTES);
+            except OSError:
+                #Not started yet or restarting
+                await asyncio.sleep(CONST.EXECUTOR_RECONNECT_SECONDS);
+                continue;
+
+            logger.info(f"Connected to the executor on <{self._socketPath}>");
+            self._writer = writer;
+            while len(self._pending) > 0:
+                writer.write(self._pending.popleft());
+
+            try:
+                while True:
+                    line: bytes = await reader.readline();
+                    if line == b"":
+                        break;
+                    self._Handle(json.loads(line));
+            except ConnectionError:
+                pass;
+            finally:
+                self._writer = None;
+                writer.close();
+                for reply in self._replies.values():
+                    if not reply.done():
+                        reply.set_exception(ConnectionError("lost the connection to the executor"));
+
+            logger.warning("Lost the connection to the executor, reconnecting");
+            await asyncio.sleep(CONST.EXECUTOR_RECONNECT_SECONDS);
+
+    def _Handle(self, message: Dict[str, Any]) -> None:
+        messageType: str = message["type"];
+        if messageType == "event":
+            event: Dict[str, Any] = message["event"];
+            event["time"] = datetime.fromisoformat(event["time"]);
+            GetJobEventBus().Receive(JobEvent(**event));
+        elif messageType == "state":
+            GetThroughputModel().SetState(message["seconds_per_audio_second"]);
+        elif messageType == "reply":
+            reply: Optional[asyncio.Future] = self._replies.get(message["id"]);
+            if reply is None or reply.done():
+                return;
+            if "error" in message:
+                reply.set_exception(Exception(message["error"]));
+            else:
+                reply.set_result(message["data"]);
+        else:
+            logger.warning(f"Unknown message type <{messageType}>");
+
+#Entry point of the process Sanic's worker manager starts for CONST.DEDICATED_EXECUTOR
+def RunExecutor(socketPath: str) -> None:
+    #The manager starts its processes as daemons, which multiprocessing doesn't allow to start the warm workers
+    multiprocessing.current_process().daemon = False;
+    asyncio.run(_RunExecutorAsync(socketPath));
+
+async def _RunExecutorAsync(socketPath: str) -> None:
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop();
+    stopping = asyncio.Event();
+    #The manager stops its processes with SIGINT
+    for signalNo in [signal.SIGINT, signal.SIGTERM]:
+        loop.add_signal_handler(signalNo, stopping.set);
+
+    await OpenDatabaseAsync();
+    GetJobEventBus().Attach(loop);
+    server = ExecutorServer(socketPath);
+    await server.StartAsync();
+    await GetScheduler().StartAsync();
+    GetMaintenanceTask().Start();
+    logger.info(f"Executor listening on <{socketPath}>");
+
+    try:
+        await stopping.wait();
+    finally:
+        await GetMaintenanceTask().StopAsync();
+        GetScheduler().Stop();
+        await server.StopAsync();
+        await CloseDatabaseAsync();
+        logger.info("Executor stopped");
+
+executorClient = ExecutorClient(CONST.EXECUTOR_SOCKET_PATH);
+
+def GetExecutorClient() -> ExecutorClient:
+    return executorClient;
@@ -0,0 +1,162 @@
+import asyncio
+import json
+from collections import deque
+from dataclasses import asdict
+from datetime import datetime
+from contextlib import contextmanager
+from typing import Optional, Deque, Set, AsyncIterator, List, Iterator, Callable
+
+from .schemas import JobEvent, JobStatus, StatusName, IsJobDone
+from .util import ConvertDatetimeToIsoString
+from .constants import CONST
+
+class _Subscriber:
+    def __init__(self, jobId: Optional[int]):
+        self.jobId: Optional[int] = jobId;
+        self.queue: asyncio.Queue = asyncio.Queue(CONST.JOB_EVENT_SUBSCRIBER_QUEUE_SIZE);
+        self.overflowed: bool = False;
+
+    def Accepts(self, event: JobEvent) -> bool:
+        return self.jobId is None or event.job_id is None or event.job_id == self.jobId;
+
+#Fans job status transitions out to /music/events subscribers.
+#Events can be published from any thread, they are dispatched on the server's event loop.
+#With a dedicated executor every event is numbered by the executor & sent to all HTTP workers (see executor.py),
+#so event ids are the same whichever worker a client reconnects to.
+class JobEventBus:
+    def __init__(self, historySize: int):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None;
+        self._history: Deque[JobEvent] = deque(maxlen=historySize);
+        self._subscribers: Set[_Subscriber] = set();
+        self._lastEventId: int = 0;
+        self._relay: Optional[Callable[[int, str, Optional[str]], None]] = None;
+        self._listeners: List[Callable[[JobEvent], None]] = [];
+
+    def Attach(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop;
+
+    #Published events are handed to "relay" instead of being dispatched here
+    def AttachRelay(self, relay: Callable[[int, str, Optional[str]], None]) -> None:
+        self._relay = relay;
+
+    #"listener" is called on the event loop with every event, before the subscribers get it
+    def AddListener(self, listener: Callable[[JobEvent], None]) -> None:
+        self._listeners.append(listener);
+
+    def Publish(self, jobId: int, eventType: str, status: Optional[str]) -> None:
+        if not self._relay is None:
+            self._relay(jobId, eventType, status);
+            return;
+        if self._loop is None:
+            return;
+
+        self._loop.call_soon_threadsafe(self._Dispatch, jobId, eventType, status, datetime.now());
+
+    def PublishStatus(self, jobId: int, status: JobStatus) -> None:
+        self.Publish(jobId, "status", StatusName(status));
+
+    def _Dispatch(self, jobId: int, eventType: str, status: Optional[str], time: datetime) -> None:
+        event = JobEvent(
+            event_id=self._lastEventId + 1,
+            type=eventType,
+            job_id=jobId,
+            status=status,
+            done=not status is None and IsJobDone(status),
+            time=time
+        );
+        self.Receive(event);
+
+    #Call on the event loop with an event numbered elsewhere
+    def Receive(self, event: JobEvent) -> None:
+        if event.event_id <= self._lastEventId:
+            #Numbered by a restarted executor, events kept so far can't be told apart from the new ones
+            self._history.clear();
+        self._lastEventId = event.event_id;
+        self._history.append(event);
+
+        for listener in self._listeners:
+            listener(event);
+
+        for subscriber in self._subscribers:
+            if not subscriber.Accepts(event):
+                continue;
+            try:
+                subscriber.queue.put_nowait(event);
+            except asyncio.QueueFull:
+                subscriber.overflowed = True;
+
+    def _ResyncEvent(self) -> JobEvent:
+        return JobEvent(
+            event_id=self._lastEventId,
+            type="resync",
+            job_id=None,
+            status=None,
+            done=False,
+            time=datetime.now()
+        );
+
+    #Events missed since lastEventId, or a resync event if they are no longer in the history
+    def _Replay(self, subscriber: _Subscriber, lastEventId: int) -> List[JobEvent]:
+        if lastEventId == self._lastEventId:
+            return [];
+
+        oldestEventId: int = self._history[0].event_id if len(self._history) > 0 else self._lastEventId + 1;
+        if lastEventId > self._lastEventId or lastEventId + 1 < oldestEventId:
+            return [self._ResyncEvent()];
+
+        return [
+            event for event in self._history
+            if event.event_id > lastEventId and subscriber.Accepts(event)
+        ];
+
+    #Yields None whenever no event arrived within the keepalive interval
+    async def Subscribe(
+        self, 
+        jobId: Optional[int], 
+        lastEventId: Optional[int]) -> AsyncIterator[Optional[JobEvent]]:
+
+        subscriber = _Subscriber(jobId);
+        self._subscribers.add(subscriber);
+        try:
+            #Registering & replaying happen without yielding to the loop, so no event is missed or repeated
+            missedEvents: List[JobEvent] = [] if lastEventId is None else self._Replay(subscriber, lastEventId);
+            for event in missedEvents:
+                yield event;
+
+            while True:
+                if subscriber.overflowed:
+                    while not subscriber.queue.empty():
+                        subscriber.queue.get_nowait();
+                    subscriber.overflowed = False;
+                    yield self._ResyncEvent();
+
+                try:
+                    event: JobEvent = await asyncio.wait_for(
+                        subscriber.queue.get(), 
+                        CONST.JOB_EVENT_KEEPALIVE_SECONDS
+                    );
+                    yield event;
+                except asyncio.TimeoutError:
+                    yield None;
+        finally:
+            self._subscribers.discard(subscriber);
+
+    #Queue receiving the events of "jobId" from now on, registered without yielding to the loop
+    #so checking the job's state right after can't miss an event
+    @contextmanager
+    def Watch(self, jobId: int) -> Iterator[asyncio.Queue]:
+        subscriber = _Subscriber(jobId);
+        self._subscribers.add(subscriber);
+        try:
+            yield subscriber.queue;
+        finally:
+            self._subscribers.discard(subscriber);
+
+def FormatServerSentEvent(event: JobEvent) -> str:
+    data: str = json.dumps(ConvertDatetimeToIsoString(asdict(event)));
+    return f"id: {event.event_id}\nevent: {event.type}\ndata: {data}\n\n";
+
+jobEventBus = JobEventBus(CONST.JOB_EVENT_HISTORY_SIZE);
+
+def GetJobEventBus() -> JobEventBus:
+    return jobEventBus;
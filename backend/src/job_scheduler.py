@@ -0,0 +1,188 @@
+import threading
+from datetime import datetime
+from logging import Logger
+from typing import Optional, Dict, Any, List, Set, Callable, Tuple
+
+from .JobController import JobController
+from .transcriber import Transcriber
+from .result_cache import GetResultCache
+from .cancellation import GetCancellationRegistry
+from .omnizart_worker import GetWorkerPool
+from .pipeline_stages import EstimateProcessCount
+from .resource_monitor import GetResourceMonitor
+from .constants import CONST
+from .util import CreateLogger
+from .database import IsPostgres
+from .metrics import queueWait
+from .throughput import GetThroughputModel
+
+#Runs queued TranscriptionJobs on a fixed number of worker threads.
+#The queue itself lives in the DB (status QUEUED), so pending jobs survive restarts.
+#Jobs are also held back while they wouldn't fit in the memory budget (see resource_monitor)
+class JobScheduler:
+    def __init__(self, workerCount: int, logger: Logger):
+        self._workerCount: int = workerCount;
+        self._logger: Logger = logger;
+
+        self._workers: List[threading.Thread] = [];
+        self._claimLock = threading.Lock();
+        self._wakeupCondition = threading.Condition();
+        self._pendingWakeups: int = 0;
+        self._stopping = threading.Event();
+
+        self._runningJobsLock = threading.Lock();
+        self._runningJobIds: Set[int] = set();
+        self._idlePollSeconds: float = CONST.SCHEDULER_IDLE_POLL_SECONDS;
+        #Set in HTTP workers whose jobs run in the dedicated executor (see executor.py)
+        self._relay: Optional[Callable[[], None]] = None;
+
+    def AttachRelay(self, relay: Callable[[], None]) -> None:
+        self._relay = relay;
+
+    async def StartAsync(self) -> None:
+        await JobController.RecoverInterruptedJobsAsync(self._logger);
+        await GetThroughputModel().LoadAsync();
+        GetResourceMonitor().Start();
+
+        self._stopping.clear();
+        self._idlePollSeconds = CONST.SHARED_QUEUE_POLL_SECONDS if IsPostgres() else CONST.SCHEDULER_IDLE_POLL_SECONDS;
+        for workerNo in range(self._workerCount):
+            worker = threading.Thread(
+                target=self._WorkerLoop,
+                name=f"transcription-worker-{workerNo}",
+                daemon=True
+            );
+            worker.start();
+            self._workers.append(worker);
+
+        #Cancel requests may arrive at any node sharing the DB
+        if IsPostgres():
+            remoteTerminationPoller = threading.Thread(
+                target=self._RemoteTerminationLoop,
+                name="remote-termination-poller",
+                daemon=True
+            );
+            remoteTerminationPoller.start();
+            self._workers.append(remoteTerminationPoller);
+
+        self._logger.info(f"Scheduler started with {self._workerCount} worker(s)");
+
+    #Running jobs are left to finish, jobs still in the queue are picked up on the next start
+    def Stop(self) -> None:
+        self._stopping.set();
+        with self._wakeupCondition:
+            self._wakeupCondition.notify_all();
+
+        self._workers = [];
+        GetWorkerPool().Shutdown();
+        GetResourceMonitor().Stop();
+
+    def GetWorkerCount(self) -> int:
+        return self._workerCount;
+
+    #Workers currently running a job
+    def GetActiveJobCount(self) -> int:
+        with self._runningJobsLock:
+            return len(self._runningJobIds);
+
+    #Call after a job has been enqueued
+    def Notify(self) -> None:
+        if not self._relay is None:
+            self._relay();
+            return;
+        with self._wakeupCondition:
+            self._pendingWakeups += 1;
+            self._wakeupCondition.notify();
+
+    def _WaitForWork(self) -> None:
+        with self._wakeupCondition:
+            if self._pendingWakeups == 0 and not self._stopping.is_set():
+                self._wakeupCondition.wait(self._idlePollSeconds);
+
+            self._pendingWakeups = max(0, self._pendingWakeups - 1);
+
+    @staticmethod
+    def _EstimateMemoryBytes(job: Dict[str, Any]) -> int:
+        processCount: int = EstimateProcessCount(job["mode"], job["audio_duration"]);
+        return GetResourceMonitor().EstimateProcessBytes(job["mode"]) * processCount;
+
+    #Returns the claimed job (if any) & whether the next job is waiting for memory.
+    #Jobs are started in queue order, the next one isn't overtaken by smaller ones while it waits
+    def _ClaimNextJob(self) -> Tuple[Optional[Dict[str, Any]], bool]:
+        with self._claimLock:
+            nextJob: Optional[Dict[str, Any]] = JobController.PeekNextQueuedJob();
+            if nextJob is None:
+                return (None, False);
+
+            mode: str = nextJob["mode"];
+            requiredBytes: int = self._EstimateMemoryBytes(nextJob);
+            reusablePids: List[int] = GetWorkerPool().GetIdleWorkerPids(mode)[:EstimateProcessCount(mode, nextJob["audio_duration"])];
+            if not GetResourceMonitor().Fits(mode, requiredBytes, reusablePids):
+                stoppedCount: int = GetWorkerPool().StopIdleWorkers(mode);
+                if stoppedCount > 0:
+                    self._logger.info(f"Stopped {stoppedCount} idle omnizart worker(s) to make room for job <{nextJob['id']}>");
+                return (None, True);
+
+            #Another node may have claimed it in the meantime, the claimed job reserves what it needs itself
+            job: Optional[Dict[str, Any]] = JobController.ClaimNextQueuedJob();
+            if not job is None:
+                GetResourceMonitor().Reserve(job["id"], job["mode"], self._EstimateMemoryBytes(job));
+            return (job, False);
+
+    def _WorkerLoop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                (job, waitingForMemory) = self._ClaimNextJob();
+            except Exception as e:
+                self._logger.error(f"Failed to claim job: {e}");
+                (job, waitingForMemory) = (None, False);
+
+            if waitingForMemory:
+                GetResourceMonitor().WaitForChange(self._idlePollSeconds);
+                continue;
+            if job is None:
+                self._WaitForWork();
+                continue;
+
+            self._logger.info(f"Job <{job['id']}> dequeued by {threading.current_thread().name}");
+            if isinstance(job["start_time"], datetime):
+                queueWait.Observe(max(0, (datetime.now() - job["start_time"]).total_seconds()), job["mode"]);
+            if job["request_terminate"]:
+                GetCancellationRegistry().RequestCancel(job["id"]);
+
+            with self._runningJobsLock:
+                self._runningJobIds.add(job["id"]);
+            try:
+                Transcriber.TranscribeCancellable_Proc(
+                    job["source_path"],
+                    job["source_hash"],
+                    job["mode"],
+                    self._logger,
+                    job["id"],
+                    job["audio_duration"]
+                );
+            finally:
+                with self._runningJobsLock:
+                    self._runningJobIds.discard(job["id"]);
+                GetResourceMonitor().Release(job["id"]);
+
+            try:
+                GetResultCache().Evict();
+            except Exception as e:
+                self._logger.error(f"Result cache eviction failed: {e}");
+
+    def _RemoteTerminationLoop(self) -> None:
+        while not self._stopping.wait(CONST.REMOTE_TERMINATION_POLL_SECONDS):
+            with self._runningJobsLock:
+                runningJobIds: List[int] = list(self._runningJobIds);
+
+            try:
+                for jobId in JobController.GetTerminationRequests(runningJobIds):
+                    GetCancellationRegistry().RequestCancel(jobId);
+            except Exception as e:
+                self._logger.error(f"Failed to check for termination requests: {e}");
+
+scheduler = JobScheduler(CONST.MAX_CONCURRENT_JOBS, CreateLogger(__name__));
+
+def GetScheduler() -> JobScheduler:
+    return scheduler;
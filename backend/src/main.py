@@ -1,16 +1,65 @@
 from sanic import Sanic, Request, text
 from .constants import CONST
 from .music_transcribe import transcribeBP
+from .monitoring import monitoringBP
 from sanic_ext import Extend
-from .schemas import CreateAllTables;
+from .migrations import ApplyMigrations
+from .job_scheduler import GetScheduler
+from .job_events import GetJobEventBus
+from .JobController import JobController
+from .util import CreateLogger
+from .database import OpenDatabaseAsync, CloseDatabaseAsync, EnableIncrementalVacuum
+from .maintenance import GetMaintenanceTask
+from .executor import RunExecutor, IsExecutorClient, GetExecutorClient
+import asyncio
+import os
 
 def AppFactory() -> Sanic:
-    CreateAllTables();
+    #Every process started by Sanic's worker manager loads the app again, the DB only needs preparing once
+    if os.environ.get("SANIC_WORKER_NAME") is None:
+        ApplyMigrations(CreateLogger(__name__));
+        JobController.MigrateResultBlobs(CreateLogger(__name__));
+        EnableIncrementalVacuum(CreateLogger(__name__));
     
     app = Sanic(CONST.APPLICATION_NAME)
     app.blueprint(transcribeBP)
+    app.blueprint(monitoringBP)
     app.config.CORS_ORIGINS = "*"
+    app.config.CORS_EXPOSE_HEADERS = "X-Next-Cursor,Retry-After,ETag,X-Partial-Result"
+    #/music/transcribe only responds once its job is done
+    app.config.RESPONSE_TIMEOUT = max(app.config.RESPONSE_TIMEOUT, CONST.SYNC_TRANSCRIPTION_TIMEOUT_SECONDS + 60)
     Extend(app)
+
+    #With several workers each one would run its own scheduler under the same node id & recover the jobs
+    #the others are running when it starts, they have to share the executor
+    @app.main_process_ready
+    async def StartExecutor(app: Sanic):
+        if CONST.DEDICATED_EXECUTOR:
+            app.manager.manage("Executor", RunExecutor, {"socketPath": CONST.EXECUTOR_SOCKET_PATH});
+        elif app.state.workers > 1:
+            raise RuntimeError(
+                f"{app.state.workers} workers need TRANSCRIBER_DEDICATED_EXECUTOR=1 to run their jobs in one process"
+            );
+
+    @app.before_server_start
+    async def StartScheduler(_: Sanic):
+        await OpenDatabaseAsync();
+        GetJobEventBus().Attach(asyncio.get_running_loop());
+        if IsExecutorClient():
+            GetExecutorClient().Start();
+            return;
+        await GetScheduler().StartAsync();
+        GetMaintenanceTask().Start();
+
+    @app.after_server_stop
+    async def StopScheduler(_: Sanic):
+        if IsExecutorClient():
+            await GetExecutorClient().StopAsync();
+        else:
+            await GetMaintenanceTask().StopAsync();
+            GetScheduler().Stop();
+        await CloseDatabaseAsync();
+
     print(app.config);
     return app
 
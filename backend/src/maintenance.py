@@ -0,0 +1,269 @@
+import asyncio
+import time
+from contextlib import suppress
+from datetime import datetime, timedelta
+from logging import Logger
+from typing import Optional, Dict, Any, List, Set, Tuple
+
+from .schemas import TranscriptionJob, BatchJob, CompletedJob, FinishedStatusNames, ResponseMaintenanceStats
+from .result_store import GetResultStore, TStoredFile
+from .derived_cache import GetDerivedCache
+from .database import IsPostgres, IncrementalVacuum
+from .metrics import maintenanceDuration, maintenanceDeleted, maintenanceReclaimedBytes, databaseSize
+from .constants import CONST
+from .util import CreateLogger
+
+#Deletes expired jobs, results nothing refers to anymore & returns the space they took to the OS.
+#Runs on the event loop serving requests, in small batches with pauses in between so requests keep their latency.
+#With several nodes each one runs it, every step is safe to run concurrently.
+class MaintenanceTask:
+    def __init__(self, logger: Logger):
+        self._logger: Logger = logger;
+        self._task: Optional[asyncio.Task] = None;
+
+        self._runs: int = 0;
+        self._lastRunTime: Optional[datetime] = None;
+        self._lastRunSeconds: Optional[float] = None;
+        self._deleted: Dict[str, int] = {"job": 0, "batch": 0, "result": 0, "file": 0, "derived": 0};
+        self._reclaimedBytes: Dict[str, int] = {"db": 0, "results": 0, "derived": 0};
+        self._dbSpace: Optional[Tuple[int, int]] = None;
+
+    #Call from the event loop serving requests, after the DB has been opened
+    def Start(self) -> None:
+        if CONST.MAINTENANCE_INTERVAL_SECONDS <= 0:
+            return;
+        self._task = asyncio.get_running_loop().create_task(self._RunPeriodicallyAsync());
+
+    async def StopAsync(self) -> None:
+        if self._task is None:
+            return;
+        self._task.cancel();
+        with suppress(asyncio.CancelledError):
+            await self._task;
+        self._task = None;
+
+    async def _RunPeriodicallyAsync(self) -> None:
+        await asyncio.sleep(CONST.MAINTENANCE_START_DELAY_SECONDS);
+        while True:
+            try:
+                await self.RunOnceAsync();
+            except Exception:
+                self._logger.exception("Maintenance run failed");
+            await asyncio.sleep(CONST.MAINTENANCE_INTERVAL_SECONDS);
+
+    async def RunOnceAsync(self) -> None:
+        start: float = time.perf_counter();
+        self._lastRunTime = datetime.now();
+
+        if CONST.JOB_RETENTION_DAYS > 0:
+            expiry: datetime = datetime.now() - timedelta(days=CONST.JOB_RETENTION_DAYS);
+            await self._DeleteExpiredJobsAsync(expiry);
+            await self._DeleteEmptyBatchesAsync(expiry);
+
+        graceExpiry: datetime = datetime.now() - timedelta(seconds=CONST.ORPHAN_GRACE_SECONDS);
+        await self._DeleteOrphanedResultsAsync(graceExpiry);
+        await self._DeleteUnreferencedFilesAsync(graceExpiry);
+        await self._DeleteUnreferencedDerivedAsync();
+
+        if not IsPostgres():
+            await self._VacuumAsync();
+        #postgres' autovacuum reuses the space of deleted rows by itself
+
+        self._runs += 1;
+        self._lastRunSeconds = time.perf_counter() - start;
+        maintenanceDuration.Observe(self._lastRunSeconds);
+        self._logger.info(
+            f"Maintenance done in {self._lastRunSeconds:.1f}s, deleted so far {self._deleted}, reclaimed so far {self._reclaimedBytes} bytes"
+        );
+
+    async def _DeleteExpiredJobsAsync(self, expiry: datetime) -> None:
+        while True:
+            rows: List[Dict[str, Any]] = await TranscriptionJob.select(
+                TranscriptionJob.id
+            ).where(
+                TranscriptionJob.status.is_in(FinishedStatusNames()) & (
+                    (TranscriptionJob.end_time < expiry) |
+                    (TranscriptionJob.end_time.is_null() & (TranscriptionJob.start_time < expiry))
+                )
+            ).limit(CONST.MAINTENANCE_BATCH_SIZE);
+            if len(rows) == 0:
+                return;
+
+            await TranscriptionJob.delete().where(
+                TranscriptionJob.id.is_in([row["id"] for row in rows])
+            );
+            self._CountDeleted("job", len(rows));
+            await asyncio.sleep(CONST.MAINTENANCE_PAUSE_SECONDS);
+
+    #Only batches old enough to have expired, a new batch has no jobs until its uploads are received
+    async def _DeleteEmptyBatchesAsync(self, expiry: datetime) -> None:
+        while True:
+            rows: List[Dict[str, Any]] = await BatchJob.raw(
+                "SELECT id FROM batch_job WHERE start_time < {} AND NOT EXISTS "
+                "(SELECT 1 FROM transcription_job WHERE transcription_job.batch_job = batch_job.id) LIMIT {}",
+                expiry,
+                CONST.MAINTENANCE_BATCH_SIZE
+            );
+            if len(rows) == 0:
+                return;
+
+            await BatchJob.delete().where(
+                BatchJob.id.is_in([row["id"] for row in rows])
+            );
+            self._CountDeleted("batch", len(rows));
+            await asyncio.sleep(CONST.MAINTENANCE_PAUSE_SECONDS);
+
+    #Results no job links to that aren't in the result cache either. Recent ones are left alone,
+    #jobs are linked to their result right after it is stored
+    async def _DeleteOrphanedResultsAsync(self, graceExpiry: datetime) -> None:
+        while True:
+            rows: List[Dict[str, Any]] = await CompletedJob.raw(
+                "SELECT id, result_path FROM completed_job WHERE source_hash IS NULL "
+                "AND (created_at IS NULL OR created_at < {}) AND (last_used IS NULL OR last_used < {}) AND NOT EXISTS "
+                "(SELECT 1 FROM transcription_job WHERE transcription_job.completed_job = completed_job.id) LIMIT {}",
+                graceExpiry,
+                graceExpiry,
+                CONST.MAINTENANCE_BATCH_SIZE
+            );
+            if len(rows) == 0:
+                return;
+
+            await CompletedJob.delete().where(
+                CompletedJob.id.is_in([row["id"] for row in rows])
+            );
+            self._CountDeleted("result", len(rows));
+
+            #Identical results share a file
+            locations: List[str] = list({row["result_path"] for row in rows if not row["result_path"] is None});
+            stillReferenced: Set[str] = await self._GetReferencedLocationsAsync(locations);
+            await self._DeleteFilesAsync(
+                [location for location in locations if not location in stillReferenced],
+                graceExpiry
+            );
+            await asyncio.sleep(CONST.MAINTENANCE_PAUSE_SECONDS);
+
+    #Files left behind by interrupted writes or deletes
+    async def _DeleteUnreferencedFilesAsync(self, graceExpiry: datetime) -> None:
+        storedFiles: List[TStoredFile] = await asyncio.get_running_loop().run_in_executor(
+            None,
+            lambda: list(GetResultStore().ListFiles())
+        );
+        if len(storedFiles) == 0:
+            return;
+
+        referenced: Set[str] = await self._GetReferencedLocationsAsync();
+        await self._DeleteFilesAsync(
+            [storedFile.location for storedFile in storedFiles if not storedFile.location in referenced],
+            graceExpiry
+        );
+
+    #Note arrays & previews of results that were deleted, the derived cache would only evict them once full
+    async def _DeleteUnreferencedDerivedAsync(self) -> None:
+        sha256s: List[str] = list(await asyncio.get_running_loop().run_in_executor(
+            None,
+            GetDerivedCache().ListResultHashes
+        ));
+        for batchStart in range(0, len(sha256s), CONST.MAINTENANCE_BATCH_SIZE):
+            batch: List[str] = sha256s[batchStart:batchStart + CONST.MAINTENANCE_BATCH_SIZE];
+            referenced: Set[str] = {
+                row["result_hash"] for row in await CompletedJob.select(
+                    CompletedJob.result_hash
+                ).where(
+                    CompletedJob.result_hash.is_in(batch)
+                )
+            };
+            (deletedArtifacts, deletedBytes) = await asyncio.get_running_loop().run_in_executor(
+                None,
+                GetDerivedCache().Delete,
+                [sha256 for sha256 in batch if not sha256 in referenced]
+            );
+            self._CountDeleted("derived", deletedArtifacts);
+            self._CountReclaimed("derived", deletedBytes);
+            await asyncio.sleep(CONST.MAINTENANCE_PAUSE_SECONDS);
+
+    #All result locations in the DB, or those among "locations"
+    async def _GetReferencedLocationsAsync(self, locations: Optional[List[str]] = None) -> Set[str]:
+        if not locations is None and len(locations) == 0:
+            return set();
+
+        query = CompletedJob.select(CompletedJob.result_path).where(CompletedJob.result_path.is_not_null());
+        if not locations is None:
+            query = query.where(CompletedJob.result_path.is_in(locations));
+        return {row["result_path"] for row in await query};
+
+    #Files modified since "graceExpiry" were just written again, possibly for a result that isn't in the DB yet
+    async def _DeleteFilesAsync(self, locations: List[str], graceExpiry: datetime) -> None:
+        def DeleteFiles(batch: List[str]) -> Tuple[int, int]:
+            deletedFiles: int = 0;
+            deletedBytes: int = 0;
+            for location in batch:
+                storedFile: Optional[TStoredFile] = GetResultStore().Stat(location);
+                if storedFile is None or storedFile.modifiedTime >= graceExpiry.timestamp():
+                    continue;
+                GetResultStore().Delete(location);
+                deletedFiles += 1;
+                deletedBytes += storedFile.size;
+            return (deletedFiles, deletedBytes);
+
+        for batchStart in range(0, len(locations), CONST.MAINTENANCE_BATCH_SIZE):
+            (deletedFiles, deletedBytes) = await asyncio.get_running_loop().run_in_executor(
+                None,
+                DeleteFiles,
+                locations[batchStart:batchStart + CONST.MAINTENANCE_BATCH_SIZE]
+            );
+            self._CountDeleted("file", deletedFiles);
+            self._CountReclaimed("results", deletedBytes);
+
+    #Frees the pages of deleted rows a few at a time, needs auto_vacuum=INCREMENTAL (see database.EnableIncrementalVacuum)
+    async def _VacuumAsync(self) -> None:
+        (size, free) = await self._GetSqliteSpaceAsync();
+        while free > 0:
+            await asyncio.get_running_loop().run_in_executor(None, IncrementalVacuum, CONST.MAINTENANCE_VACUUM_PAGES);
+            (newSize, free) = await self._GetSqliteSpaceAsync();
+            if newSize >= size:
+                #auto_vacuum isn't enabled, pages can only be freed by a full VACUUM
+                break;
+            self._CountReclaimed("db", size - newSize);
+            size = newSize;
+            await asyncio.sleep(CONST.MAINTENANCE_PAUSE_SECONDS);
+
+    #(size of the DB file, bytes of it in free pages)
+    async def _GetSqliteSpaceAsync(self) -> Tuple[int, int]:
+        rows: List[Dict[str, Any]] = await TranscriptionJob.raw(
+            "SELECT page_count * page_size AS size, freelist_count * page_size AS free "
+            "FROM pragma_page_count(), pragma_page_size(), pragma_freelist_count()"
+        );
+        self._dbSpace = (rows[0]["size"], rows[0]["free"]);
+        databaseSize.Set(self._dbSpace[0], "total");
+        databaseSize.Set(self._dbSpace[1], "free");
+        return self._dbSpace;
+
+    def _CountDeleted(self, kind: str, count: int) -> None:
+        self._deleted[kind] += count;
+        maintenanceDeleted.Inc(kind, amount=count);
+
+    def _CountReclaimed(self, storage: str, size: int) -> None:
+        self._reclaimedBytes[storage] += size;
+        maintenanceReclaimedBytes.Inc(storage, amount=size);
+
+    def GetStats(self) -> ResponseMaintenanceStats:
+        return ResponseMaintenanceStats(
+            runs=self._runs,
+            last_run_time=self._lastRunTime,
+            last_run_seconds=round(self._lastRunSeconds, 3) if not self._lastRunSeconds is None else None,
+            deleted_jobs=self._deleted["job"],
+            deleted_batches=self._deleted["batch"],
+            deleted_results=self._deleted["result"],
+            deleted_files=self._deleted["file"],
+            deleted_derived=self._deleted["derived"],
+            reclaimed_db_bytes=self._reclaimedBytes["db"],
+            reclaimed_result_bytes=self._reclaimedBytes["results"],
+            reclaimed_derived_bytes=self._reclaimedBytes["derived"],
+            db_size=self._dbSpace[0] if not self._dbSpace is None else None,
+            db_free=self._dbSpace[1] if not self._dbSpace is None else None
+        );
+
+maintenanceTask = MaintenanceTask(CreateLogger(__name__));
+
+def GetMaintenanceTask() -> MaintenanceTask:
+    return maintenanceTask;
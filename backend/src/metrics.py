@@ -0,0 +1,333 @@
+import math
+from abc import ABC, abstractmethod
+import threading
+import time
+from contextlib import contextmanager
+from logging import Logger
+from typing import Dict, List, Tuple, Iterator, Optional, Any
+
+from .util import CreateLogger
+
+TLabelValues = Tuple[str, ...];
+#(label values, value) of each series of a metric, as sent between processes (see executor.py).
+#The value of a histogram series is ([count per bucket], sum)
+TMetricSamples = List[Tuple[TLabelValues, Any]];
+
+#Seconds, spans from a few ms (DB writes) to tens of minutes (inference on long recordings)
+DURATION_BUCKETS: List[float] = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800];
+#Bytes, 16MB to 16GB
+MEMORY_BUCKETS: List[float] = [float(2 ** power) for power in range(24, 35)];
+
+def _EscapeLabelValue(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"');
+
+def _FormatLabels(labelNames: Tuple[str, ...], labelValues: TLabelValues, extraLabels: str = "") -> str:
+    labels: List[str] = [f'{name}="{_EscapeLabelValue(value)}"' for (name, value) in zip(labelNames, labelValues)];
+    if extraLabels != "":
+        labels.append(extraLabels);
+    return "{" + ",".join(labels) + "}" if len(labels) > 0 else "";
+
+def _FormatValue(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf";
+    return repr(float(value)) if not float(value).is_integer() else str(int(value));
+
+class _Metric(ABC):
+    metricType: str = "";
+
+    def __init__(self, name: str, description: str, labelNames: Tuple[str, ...]):
+        self.name: str = name;
+        self.description: str = description;
+        self.labelNames: Tuple[str, ...] = labelNames;
+        self._lock = threading.Lock();
+
+    def _CheckLabels(self, labelValues: TLabelValues) -> None:
+        if len(labelValues) != len(self.labelNames):
+            raise Exception(f"<{self.name}> expects labels {self.labelNames}, got {labelValues}");
+
+    @abstractmethod
+    def Export(self) -> TMetricSamples:
+        ...
+
+    #"imported" are the samples of the same metric in another process
+    @abstractmethod
+    def _RenderSamples(self, imported: TMetricSamples) -> List[str]:
+        ...
+
+    def Render(self, imported: TMetricSamples = []) -> str:
+        lines: List[str] = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.metricType}"
+        ] + self._RenderSamples(imported);
+        return "\n".join(lines);
+
+class Counter(_Metric):
+    metricType = "counter";
+
+    def __init__(self, name: str, description: str, labelNames: Tuple[str, ...] = ()):
+        super().__init__(name, description, labelNames);
+        self._values: Dict[TLabelValues, float] = {};
+
+    def Inc(self, *labelValues: str, amount: float = 1) -> None:
+        self._CheckLabels(labelValues);
+        with self._lock:
+            self._values[labelValues] = self._values.get(labelValues, 0) + amount;
+
+    def Export(self) -> TMetricSamples:
+        with self._lock:
+            return list(self._values.items());
+
+    #Counts of both processes add up
+    def _RenderSamples(self, imported: TMetricSamples) -> List[str]:
+        with self._lock:
+            merged: Dict[TLabelValues, float] = dict(self._values);
+        for (labels, value) in imported:
+            merged[tuple(labels)] = merged.get(tuple(labels), 0) + value;
+
+        values: List[Tuple[TLabelValues, float]] = sorted(merged.items());
+        return [f"{self.name}{_FormatLabels(self.labelNames, labels)} {_FormatValue(value)}" for (labels, value) in values];
+
+class Gauge(_Metric):
+    metricType = "gauge";
+
+    def __init__(self, name: str, description: str, labelNames: Tuple[str, ...] = ()):
+        super().__init__(name, description, labelNames);
+        self._values: Dict[TLabelValues, float] = {};
+
+    def Set(self, value: float, *labelValues: str) -> None:
+        self._CheckLabels(labelValues);
+        with self._lock:
+            self._values[labelValues] = value;
+
+    def Export(self) -> TMetricSamples:
+        with self._lock:
+            return list(self._values.items());
+
+    #Values set by the other process win, gauges are set by the process that owns what they measure
+    def _RenderSamples(self, imported: TMetricSamples) -> List[str]:
+        with self._lock:
+            merged: Dict[TLabelValues, float] = dict(self._values);
+        merged.update((tuple(labels), value) for (labels, value) in imported);
+
+        values: List[Tuple[TLabelValues, float]] = sorted(merged.items());
+        return [f"{self.name}{_FormatLabels(self.labelNames, labels)} {_FormatValue(value)}" for (labels, value) in values];
+
+class Histogram(_Metric):
+    metricType = "histogram";
+
+    def __init__(self, name: str, description: str, labelNames: Tuple[str, ...], buckets: List[float]):
+        super().__init__(name, description, labelNames);
+        self._buckets: List[float] = sorted(buckets) + [math.inf];
+        self._counts: Dict[TLabelValues, List[int]] = {}; #per bucket, not cumulative
+        self._sums: Dict[TLabelValues, float] = {};
+
+    def Observe(self, value: float, *labelValues: str) -> None:
+        self._CheckLabels(labelValues);
+        bucketNo: int = next(no for (no, upperBound) in enumerate(self._buckets) if value <= upperBound);
+        with self._lock:
+            counts: List[int] = self._counts.setdefault(labelValues, [0] * len(self._buckets));
+            counts[bucketNo] += 1;
+            self._sums[labelValues] = self._sums.get(labelValues, 0) + value;
+
+    def Export(self) -> TMetricSamples:
+        with self._lock:
+            return [(labels, (list(counts), self._sums[labels])) for (labels, counts) in self._counts.items()];
+
+    def _RenderSamples(self, imported: TMetricSamples) -> List[str]:
+        with self._lock:
+            merged: Dict[TLabelValues, Tuple[List[int], float]] = {
+                labels: (list(counts), self._sums[labels]) for (labels, counts) in self._counts.items()
+            };
+        for (labels, (counts, total)) in imported:
+            (mergedCounts, mergedTotal) = merged.get(tuple(labels), ([0] * len(self._buckets), 0));
+            merged[tuple(labels)] = ([a + b for (a, b) in zip(mergedCounts, counts)], mergedTotal + total);
+
+        series: List[Tuple[TLabelValues, List[int], float]] = [
+            (labels, counts, total) for (labels, (counts, total)) in sorted(merged.items())
+        ];
+
+        lines: List[str] = [];
+        for (labels, counts, total) in series:
+            cumulativeCount: int = 0;
+            for (upperBound, count) in zip(self._buckets, counts):
+                cumulativeCount += count;
+                bucketLabels: str = _FormatLabels(self.labelNames, labels, f'le="{_FormatValue(upperBound)}"');
+                lines.append(f"{self.name}_bucket{bucketLabels} {cumulativeCount}");
+            lines.append(f"{self.name}_sum{_FormatLabels(self.labelNames, labels)} {_FormatValue(total)}");
+            lines.append(f"{self.name}_count{_FormatLabels(self.labelNames, labels)} {cumulativeCount}");
+        return lines;
+
+#Process wide metrics, rendered in the Prometheus text format by /metrics
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock();
+        self._metrics: Dict[str, _Metric] = {};
+
+    def Register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise Exception(f"metric <{metric.name}> is already registered");
+            self._metrics[metric.name] = metric;
+        return metric;
+
+    def Export(self) -> Dict[str, TMetricSamples]:
+        with self._lock:
+            metrics: List[_Metric] = list(self._metrics.values());
+        return {metric.name: metric.Export() for metric in metrics};
+
+    #Merged with the "Export()" of another process's registry, if given
+    def Render(self, imported: Dict[str, TMetricSamples] = {}) -> str:
+        with self._lock:
+            metrics: List[_Metric] = list(self._metrics.values());
+        return "\n".join(metric.Render(imported.get(metric.name, [])) for metric in metrics) + "\n";
+
+registry = MetricsRegistry();
+
+def GetMetricsRegistry() -> MetricsRegistry:
+    return registry;
+
+stageDuration: Histogram = registry.Register(Histogram(
+    "transcriber_stage_duration_seconds",
+    "Duration of each stage of a transcription job",
+    ("stage", "mode"),
+    DURATION_BUCKETS
+));
+stageFailures: Counter = registry.Register(Counter(
+    "transcriber_stage_failures_total",
+    "Stages that raised an exception",
+    ("stage", "mode")
+));
+queueWait: Histogram = registry.Register(Histogram(
+    "transcriber_queue_wait_seconds",
+    "Time from submission until a worker claimed the job",
+    ("mode",),
+    DURATION_BUCKETS
+));
+jobDuration: Histogram = registry.Register(Histogram(
+    "transcriber_job_duration_seconds",
+    "Time from claim to completion, by final status",
+    ("mode", "status"),
+    DURATION_BUCKETS
+));
+childCpuSeconds: Histogram = registry.Register(Histogram(
+    "transcriber_child_cpu_seconds",
+    "CPU time (user + system) of each omnizart run, segments of a job run separately",
+    ("mode",),
+    DURATION_BUCKETS
+));
+childPeakRss: Histogram = registry.Register(Histogram(
+    "transcriber_child_peak_rss_bytes",
+    "Peak resident memory of the omnizart process of each run",
+    ("mode",),
+    MEMORY_BUCKETS
+));
+childRss: Gauge = registry.Register(Gauge(
+    "transcriber_child_rss_bytes",
+    "Resident memory of the omnizart processes, running a job or idle",
+    ("state",)
+));
+childCpuCores: Gauge = registry.Register(Gauge(
+    "transcriber_child_cpu_cores",
+    "CPU used by the omnizart processes running a job, over the last sample"
+));
+memoryProjected: Gauge = registry.Register(Gauge(
+    "transcriber_memory_projected_bytes",
+    "Memory of the running jobs (at least their estimate) & of idle omnizart processes, new jobs have to fit next to it"
+));
+memoryBudget: Gauge = registry.Register(Gauge(
+    "transcriber_memory_budget_bytes",
+    "Memory the running jobs & idle omnizart processes may use"
+));
+memoryDeferrals: Counter = registry.Register(Counter(
+    "transcriber_memory_deferrals_total",
+    "Times the next job was held back because it would not fit in the memory budget",
+    ("mode",)
+));
+memoryLimitKills: Counter = registry.Register(Counter(
+    "transcriber_memory_limit_kills_total",
+    "omnizart processes killed for exceeding the per process memory limit",
+    ("mode",)
+));
+queueDepth: Gauge = registry.Register(Gauge(
+    "transcriber_queue_depth",
+    "Jobs waiting in the queue"
+));
+activeWorkers: Gauge = registry.Register(Gauge(
+    "transcriber_active_workers",
+    "Scheduler workers currently running a job"
+));
+workerCount: Gauge = registry.Register(Gauge(
+    "transcriber_workers",
+    "Scheduler workers"
+));
+computePerAudioSecond: Gauge = registry.Register(Gauge(
+    "transcriber_compute_seconds_per_audio_second",
+    "Learned transcription cost used for scheduling & ETAs",
+    ("mode",)
+));
+maintenanceDuration: Histogram = registry.Register(Histogram(
+    "transcriber_maintenance_duration_seconds",
+    "Duration of each background maintenance run",
+    (),
+    DURATION_BUCKETS
+));
+maintenanceDeleted: Counter = registry.Register(Counter(
+    "transcriber_maintenance_deleted_total",
+    "Expired jobs & batches, orphaned results, unreferenced result files & derived artifacts of deleted results deleted by maintenance",
+    ("kind",)
+));
+maintenanceReclaimedBytes: Counter = registry.Register(Counter(
+    "transcriber_maintenance_reclaimed_bytes_total",
+    "Space freed by maintenance, in the DB file, the result store & the derived cache",
+    ("storage",)
+));
+databaseSize: Gauge = registry.Register(Gauge(
+    "transcriber_database_size_bytes",
+    "Size of the sqlite DB & how much of it is free pages",
+    ("kind",)
+));
+
+statusCacheLookups: Counter = registry.Register(Counter(
+    "transcriber_status_cache_lookups_total",
+    "Status responses served from memory (hit) or built from the DB (miss)",
+    ("kind", "result")
+));
+derivedCacheLookups: Counter = registry.Register(Counter(
+    "transcriber_derived_cache_lookups_total",
+    "Note arrays & audio previews served from disk (hit), built from the result (miss) or waited for while built (shared)",
+    ("kind", "result")
+));
+derivedBuildDuration: Histogram = registry.Register(Histogram(
+    "transcriber_derived_build_duration_seconds",
+    "Time to build a note array or audio preview from a result",
+    ("kind",),
+    DURATION_BUCKETS
+));
+
+spanLogger: Logger = CreateLogger(__name__);
+
+#Times the enclosed stage into transcriber_stage_duration_seconds & logs it as one key=value line
+@contextmanager
+def Span(stage: str, mode: str = "", jobId: Optional[int] = None) -> Iterator[None]:
+    start: float = time.perf_counter();
+    outcome: str = "ok";
+    try:
+        yield;
+    except BaseException:
+        outcome = "error";
+        stageFailures.Inc(stage, mode);
+        raise;
+    finally:
+        duration: float = time.perf_counter() - start;
+        stageDuration.Observe(duration, stage, mode);
+        spanLogger.info(f"span stage={stage} mode={mode or '-'} job={jobId if not jobId is None else '-'} duration_ms={duration * 1000:.1f} outcome={outcome}");
+
+#ru_maxrss is in kilobytes on linux
+def MaxRssToBytes(maxRss: int) -> int:
+    return maxRss * 1024;
+
+#"peakRssBytes" is None when the run's peak couldn't be measured
+def RecordChildUsage(mode: str, cpuSeconds: float, peakRssBytes: Optional[int]) -> None:
+    childCpuSeconds.Observe(cpuSeconds, mode);
+    if not peakRssBytes is None:
+        childPeakRss.Observe(peakRssBytes, mode);
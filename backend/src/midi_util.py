@@ -0,0 +1,220 @@
+import struct
+from dataclasses import dataclass, field
+from typing import List, Dict, Tuple, BinaryIO, Optional
+
+@dataclass
+class TMidiNote:
+    start: float #seconds
+    end: float #seconds
+    pitch: int
+    velocity: int
+    channel: int
+
+@dataclass
+class TMidiFile:
+    notes: List[TMidiNote] = field(default_factory=list)
+    programs: Dict[int, int] = field(default_factory=dict) #program by channel
+
+#A transcribed segment, "start" is the segment's offset into the full recording
+#Notes starting within [ownedStart, ownedEnd) are kept when stitching, the rest belong to a neighbouring segment
+@dataclass
+class TMidiSegment:
+    path: str
+    start: float
+    ownedStart: float
+    ownedEnd: float
+
+#Minimal standard MIDI file support, enough to read omnizart's output & write the stitched result
+class MidiUtil:
+    OUTPUT_TICKS_PER_BEAT: int = 480;
+    OUTPUT_TEMPO: int = 500000; #microseconds per beat, 120 bpm
+
+    @staticmethod
+    def _ReadVariableLength(data: bytes, pos: int) -> Tuple[int, int]:
+        value: int = 0;
+        while True:
+            byte: int = data[pos];
+            pos += 1;
+            value = (value << 7) | (byte & 0x7F);
+            if byte & 0x80 == 0:
+                return (value, pos);
+
+    @staticmethod
+    def _WriteVariableLength(value: int) -> bytes:
+        encoded: bytearray = bytearray([value & 0x7F]);
+        value >>= 7;
+        while value > 0:
+            encoded.insert(0, (value & 0x7F) | 0x80);
+            value >>= 7;
+        return bytes(encoded);
+
+    #Returns the events of one track as (absolute tick, status, data)
+    @staticmethod
+    def _ReadTrack(data: bytes) -> List[Tuple[int, int, bytes]]:
+        events: List[Tuple[int, int, bytes]] = [];
+        pos: int = 0;
+        tick: int = 0;
+        runningStatus: int = 0;
+
+        while pos < len(data):
+            (delta, pos) = MidiUtil._ReadVariableLength(data, pos);
+            tick += delta;
+
+            status: int = data[pos];
+            if status & 0x80:
+                pos += 1;
+            else:
+                status = runningStatus;
+
+            if status == 0xFF:
+                metaType: int = data[pos];
+                (length, pos) = MidiUtil._ReadVariableLength(data, pos + 1);
+                events.append((tick, status, bytes([metaType]) + data[pos:pos + length]));
+                pos += length;
+            elif status in (0xF0, 0xF7):
+                (length, pos) = MidiUtil._ReadVariableLength(data, pos);
+                pos += length;
+            else:
+                runningStatus = status;
+                length = 1 if (status & 0xF0) in (0xC0, 0xD0) else 2;
+                events.append((tick, status, data[pos:pos + length]));
+                pos += length;
+
+        return events;
+
+    @staticmethod
+    def Read(path: str) -> TMidiFile:
+        with open(path, "rb") as hFile:
+            data: bytes = hFile.read();
+
+        if data[:4] != b"MThd":
+            raise Exception(f"<{path}> is not a MIDI file");
+
+        (headerLength,) = struct.unpack(">I", data[4:8]);
+        (_, trackCount, division) = struct.unpack(">HHH", data[8:14]);
+        if division & 0x8000:
+            raise Exception(f"<{path}> uses SMPTE timing, which isn't supported");
+
+        tracks: List[List[Tuple[int, int, bytes]]] = [];
+        pos: int = 8 + headerLength;
+        while pos + 8 <= len(data) and len(tracks) < trackCount:
+            chunkType: bytes = data[pos:pos + 4];
+            (chunkLength,) = struct.unpack(">I", data[pos + 4:pos + 8]);
+            if chunkType == b"MTrk":
+                tracks.append(MidiUtil._ReadTrack(data[pos + 8:pos + 8 + chunkLength]));
+            pos += 8 + chunkLength;
+
+        #Tempo changes apply to every track
+        tempoChanges: List[Tuple[int, int]] = sorted(
+            (tick, int.from_bytes(eventData[1:4], "big"))
+            for track in tracks for (tick, status, eventData) in track
+            if status == 0xFF and eventData[0] == 0x51
+        );
+
+        def TickToSeconds(tick: int) -> float:
+            seconds: float = 0;
+            lastTick: int = 0;
+            tempo: int = MidiUtil.OUTPUT_TEMPO;
+            for (changeTick, newTempo) in tempoChanges:
+                if changeTick >= tick:
+                    break;
+                seconds += (changeTick - lastTick) * tempo / division / 1e6;
+                (lastTick, tempo) = (changeTick, newTempo);
+            return seconds + (tick - lastTick) * tempo / division / 1e6;
+
+        midiFile = TMidiFile();
+        for track in tracks:
+            activeNotes: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}; #(channel, pitch) -> [(start tick, velocity)]
+            for (tick, status, eventData) in track:
+                eventType: int = status & 0xF0;
+                channel: int = status & 0x0F;
+
+                if eventType == 0x90 and eventData[1] > 0:
+                    activeNotes.setdefault((channel, eventData[0]), []).append((tick, eventData[1]));
+                elif eventType == 0x80 or eventType == 0x90:
+                    started: List[Tuple[int, int]] = activeNotes.get((channel, eventData[0]), []);
+                    if len(started) > 0:
+                        (startTick, velocity) = started.pop(0);
+                        midiFile.notes.append(TMidiNote(
+                            TickToSeconds(startTick),
+                            TickToSeconds(tick),
+                            eventData[0],
+                            velocity,
+                            channel
+                        ));
+                elif eventType == 0xC0:
+                    midiFile.programs.setdefault(channel, eventData[0]);
+
+        midiFile.notes.sort(key=lambda note: (note.start, note.pitch));
+        return midiFile;
+
+    #Writes a single track (format 0) file at a fixed tempo
+    @staticmethod
+    def Write(midiFile: TMidiFile, path: str) -> None:
+        ticksPerSecond: float = MidiUtil.OUTPUT_TICKS_PER_BEAT * 1e6 / MidiUtil.OUTPUT_TEMPO;
+        events: List[Tuple[int, int, bytes]] = []; #(absolute tick, order, event bytes), note offs sort before note ons
+
+        for (channel, program) in sorted(midiFile.programs.items()):
+            events.append((0, 0, bytes([0xC0 | channel, program])));
+
+        for note in midiFile.notes:
+            startTick: int = round(note.start * ticksPerSecond);
+            endTick: int = max(startTick + 1, round(note.end * ticksPerSecond));
+            events.append((startTick, 2, bytes([0x90 | note.channel, note.pitch, note.velocity])));
+            events.append((endTick, 1, bytes([0x80 | note.channel, note.pitch, 0])));
+
+        events.sort(key=lambda event: (event[0], event[1]));
+
+        trackData: bytearray = bytearray();
+        trackData += b"\x00\xFF\x51\x03" + MidiUtil.OUTPUT_TEMPO.to_bytes(3, "big");
+        lastTick: int = 0;
+        for (tick, _, eventBytes) in events:
+            trackData += MidiUtil._WriteVariableLength(tick - lastTick) + eventBytes;
+            lastTick = tick;
+        trackData += b"\x00\xFF\x2F\x00";
+
+        with open(path, "wb") as hFile:
+            MidiUtil._WriteChunk(hFile, b"MThd", struct.pack(">HHH", 0, 1, MidiUtil.OUTPUT_TICKS_PER_BEAT));
+            MidiUtil._WriteChunk(hFile, b"MTrk", bytes(trackData));
+
+    @staticmethod
+    def _WriteChunk(hFile: BinaryIO, chunkType: bytes, data: bytes) -> None:
+        hFile.write(chunkType + struct.pack(">I", len(data)) + data);
+
+    #Shifts each segment's notes to its offset in the recording & keeps the notes starting in the part it owns.
+    #A note held across a seam is transcribed by both segments, notes of the same pitch from neighbouring segments
+    #that overlap & start within "seamSeconds" of the seam between them are merged. Notes of one segment are kept as they are
+    @staticmethod
+    def Stitch(segments: List[TMidiSegment], destPath: str, seamSeconds: float) -> None:
+        stitched = TMidiFile();
+        notes: List[Tuple[TMidiNote, int]] = []; #(note, segment no)
+        for (segmentNo, segment) in enumerate(segments):
+            segmentFile: TMidiFile = MidiUtil.Read(segment.path);
+            for (channel, program) in segmentFile.programs.items():
+                stitched.programs.setdefault(channel, program);
+
+            for note in segmentFile.notes:
+                start: float = note.start + segment.start;
+                if segment.ownedStart <= start < segment.ownedEnd:
+                    notes.append((TMidiNote(start, note.end + segment.start, note.pitch, note.velocity, note.channel), segmentNo));
+
+        notes.sort(key=lambda entry: (entry[0].channel, entry[0].pitch, entry[0].start));
+        mergedNotes: List[Tuple[TMidiNote, int]] = [];
+        for (note, segmentNo) in notes:
+            (previous, previousSegmentNo) = mergedNotes[-1] if len(mergedNotes) > 0 else (None, -1);
+            if (
+                not previous is None and
+                previous.channel == note.channel and
+                previous.pitch == note.pitch and
+                previousSegmentNo != segmentNo and
+                note.start <= previous.end and
+                note.start - segments[segmentNo].ownedStart <= seamSeconds
+            ):
+                previous.end = max(previous.end, note.end);
+                #Compared with the next notes as a note of the segment it now ends in
+                mergedNotes[-1] = (previous, segmentNo);
+            else:
+                mergedNotes.append((note, segmentNo));
+
+        stitched.notes = sorted((note for (note, _) in mergedNotes), key=lambda note: (note.start, note.pitch));
+        MidiUtil.Write(stitched, destPath);
@@ -0,0 +1,152 @@
+from datetime import datetime
+from logging import Logger
+from typing import Type, Set, List, Tuple, Callable, Awaitable, Dict, Any
+from piccolo.table import Table
+from piccolo.columns import Column
+import piccolo.columns
+from piccolo.engine.finder import engine_finder
+from piccolo.engine.sqlite import TransactionType
+from piccolo.utils.sync import run_sync
+
+from .schemas import SchemaMigration, JobStatus, StatusName
+
+#Arbitrary key of the postgres advisory lock held while migrating, so nodes starting together take turns
+MIGRATION_LOCK_KEY: int = 0x6F6D6E69;
+
+async def _GetColumnNames(table: Type[Table]) -> Set[str]:
+    rows: List[Dict[str, Any]] = (
+        await table.raw(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = {}",
+            table._meta.tablename
+        )
+        if engine_finder().engine_type == "postgres" else
+        await table.raw(f"PRAGMA table_info({table._meta.tablename})")
+    );
+    return set(row.get("column_name", row.get("name")) for row in rows);
+
+#Adds the columns that don't exist yet, along with their indexes
+async def _AddColumns(table: Type[Table], columns: List[Column]) -> None:
+    existingColumns: Set[str] = await _GetColumnNames(table);
+
+    for column in columns:
+        if not column._meta.db_column_name in existingColumns:
+            await table.alter().add_column(column._meta.name, column);
+
+        if column._meta.index:
+            await table.create_index([column], if_not_exists=True);
+
+##The tables as each migration sees them. Migrations don't use the classes in schemas.py,
+##which gain the columns of later migrations, so they do the same whenever they are applied
+
+class _CompletedJob0001(Table, tablename="completed_job"):
+    filename = piccolo.columns.Text()
+    blob = piccolo.columns.Bytea()
+    result_path = piccolo.columns.Text(null=True, default=None)
+    result_hash = piccolo.columns.Text(null=True, default=None)
+    source_hash = piccolo.columns.Text(null=True, default=None, index=True)
+    mode = piccolo.columns.Text(null=True, default=None)
+    omnizart_version = piccolo.columns.Text(null=True, default=None)
+    size = piccolo.columns.Integer(default=0)
+    created_at = piccolo.columns.Timestamp(null=True, default=None)
+    last_used = piccolo.columns.Timestamp(null=True, default=None)
+
+class _BatchJob0001(Table, tablename="batch_job"):
+    start_time = piccolo.columns.Timestamp()
+    modes = piccolo.columns.Text()
+    input_count = piccolo.columns.Integer()
+
+class _TranscriptionJob0001(Table, tablename="transcription_job"):
+    filename = piccolo.columns.Text(index=True)
+    mode = piccolo.columns.Text()
+    start_time = piccolo.columns.Timestamp(index=True)
+    end_time = piccolo.columns.Timestamp(null=True)
+    request_terminate = piccolo.columns.Boolean()
+    status = piccolo.columns.Text(index=True)
+    msg = piccolo.columns.Text()
+    completed_job = piccolo.columns.ForeignKey(references=_CompletedJob0001, null=True)
+    priority = piccolo.columns.Integer(default=0)
+    source_path = piccolo.columns.Text(null=True, default=None)
+    source_hash = piccolo.columns.Text(null=True, default=None)
+    batch_job = piccolo.columns.ForeignKey(references=_BatchJob0001, null=True)
+    node = piccolo.columns.Text(null=True, default=None, index=True)
+
+class _TranscriptionJob0002(Table, tablename="transcription_job"):
+    start_time = piccolo.columns.Timestamp(index=True)
+    status = piccolo.columns.Text(index=True)
+    audio_duration = piccolo.columns.Real(null=True, default=None)
+    source_size = piccolo.columns.BigInt(null=True, default=None)
+    schedule_key = piccolo.columns.DoublePrecision(null=True, default=None)
+    run_start_time = piccolo.columns.Timestamp(null=True, default=None)
+
+class _TranscriptionJob0003(Table, tablename="transcription_job"):
+    client_id = piccolo.columns.Text(null=True, default=None, index=True)
+
+#DBs created before migrations were introduced only have some of these tables & columns
+async def _Baseline() -> None:
+    for table in [_CompletedJob0001, _BatchJob0001, _TranscriptionJob0001]:
+        #"create_table" would also index the columns an existing table doesn't have yet
+        if await table.table_exists():
+            await _AddColumns(table, table._meta.non_default_columns);
+        else:
+            await table.create_table();
+
+#Columns for duration-aware scheduling, jobs queued before it keep their FIFO order
+async def _AddJobEstimates() -> None:
+    await _AddColumns(_TranscriptionJob0002, [
+        _TranscriptionJob0002.audio_duration,
+        _TranscriptionJob0002.source_size,
+        _TranscriptionJob0002.schedule_key,
+        _TranscriptionJob0002.run_start_time
+    ]);
+
+    queuedJobs: List[Dict[str, Any]] = await _TranscriptionJob0002.select(
+        _TranscriptionJob0002.id,
+        _TranscriptionJob0002.start_time
+    ).where(
+        (_TranscriptionJob0002.status == StatusName(JobStatus.QUEUED)) &
+        _TranscriptionJob0002.schedule_key.is_null()
+    );
+    for job in queuedJobs:
+        await _TranscriptionJob0002.update({
+            _TranscriptionJob0002.schedule_key: job["start_time"].timestamp()
+        }).where(
+            _TranscriptionJob0002.id == job["id"]
+        );
+
+async def _AddClientId() -> None:
+    await _AddColumns(_TranscriptionJob0003, [_TranscriptionJob0003.client_id]);
+
+#Applied in order, each one once. Append new migrations, never edit or reorder applied ones
+migrations: List[Tuple[str, Callable[[], Awaitable[None]]]] = [
+    ("0001_baseline", _Baseline),
+    ("0002_job_estimates", _AddJobEstimates),
+    ("0003_client_id", _AddClientId),
+];
+
+async def ApplyMigrationsAsync(logger: Logger) -> None:
+    engine = engine_finder();
+
+    #All migrations run in one transaction, the lock (or sqlite's write lock) keeps other nodes out meanwhile
+    async with (
+        engine.transaction()
+        if engine.engine_type == "postgres" else
+        engine.transaction(transaction_type=TransactionType.immediate)
+    ):
+        if engine.engine_type == "postgres":
+            await SchemaMigration.raw("SELECT pg_advisory_xact_lock({})", MIGRATION_LOCK_KEY);
+
+        await SchemaMigration.create_table(if_not_exists=True);
+        appliedNames: Set[str] = set(
+            row["name"] for row in await SchemaMigration.select(SchemaMigration.name)
+        );
+
+        for (name, migration) in migrations:
+            if name in appliedNames:
+                continue;
+
+            logger.info(f"Applying migration <{name}>");
+            await migration();
+            await SchemaMigration.insert(SchemaMigration(name=name, applied_at=datetime.now()));
+
+def ApplyMigrations(logger: Logger) -> None:
+    run_sync(ApplyMigrationsAsync(logger));
@@ -1,6 +1,9 @@
 
-def main() -> None:
+def Transcribe(mode: str, sourceFilePath: str, outputFilePath: str) -> None:
     raise AssertionError("Mock failure");
 
+def main() -> None:
+    Transcribe("", "", "");
+
 if __name__ == "__main__":
     main();
\ No newline at end of file
@@ -1,6 +1,46 @@
 import argparse
+import os
+import struct
+import time
+import wave
 from pathlib import Path
 
+#Stand-in for inference time, used by the benchmarks. Each run takes
+#MOCK_FIXED_SECONDS + MOCK_SECONDS_PER_AUDIO_SECOND * (duration of the source),
+#spent sleeping ("sleep") or in a busy loop ("cpu") depending on MOCK_INFERENCE
+MOCK_INFERENCE: str = os.environ.get("TRANSCRIBER_MOCK_INFERENCE", "none");
+MOCK_FIXED_SECONDS: float = float(os.environ.get("TRANSCRIBER_MOCK_FIXED_SECONDS", 0));
+MOCK_SECONDS_PER_AUDIO_SECOND: float = float(os.environ.get("TRANSCRIBER_MOCK_SECONDS_PER_AUDIO_SECOND", 0));
+
+def SimulateInference(durationSeconds: float) -> None:
+    seconds: float = MOCK_FIXED_SECONDS + MOCK_SECONDS_PER_AUDIO_SECOND * durationSeconds;
+    if MOCK_INFERENCE == "sleep":
+        time.sleep(seconds);
+    elif MOCK_INFERENCE == "cpu":
+        deadline: float = time.process_time() + seconds;
+        value: int = 0;
+        while time.process_time() < deadline:
+            for i in range(10000):
+                value = (value * 31 + i) % 1000003;
+
+#Also called by the warm worker processes in place of omnizart's python API
+#Writes one short note every half second of the source (120 bpm, 480 ticks per beat)
+def Transcribe(mode: str, sourceFilePath: str, outputFilePath: str) -> None:
+    with wave.open(sourceFilePath, "rb") as hSource:
+        durationSeconds: float = hSource.getnframes() / hSource.getframerate();
+
+    SimulateInference(durationSeconds);
+
+    trackData: bytearray = bytearray(b"\x00\xFF\x51\x03\x07\xA1\x20");
+    for _ in range(int(durationSeconds * 2)):
+        #note on, 0.25s later note off, 0.25s later the next note
+        trackData += b"\x00\x90\x3C\x64" + b"\x81\x70\x80\x3C\x00" + b"\x81\x70\xFF\x01\x00";
+    trackData += b"\x00\xFF\x2F\x00";
+
+    with open(outputFilePath, "wb") as hOutput:
+        hOutput.write(b"MThd" + struct.pack(">IHHH", 6, 0, 1, 480));
+        hOutput.write(b"MTrk" + struct.pack(">I", len(trackData)) + trackData);
+
 def main() -> None:
     parser = argparse.ArgumentParser();
 
@@ -35,8 +75,7 @@ def main() -> None:
     if args.mode != "vocal":
         outputFilePath = args.output
 
-    with open(outputFilePath, "w"):
-        pass;
+    Transcribe(args.mode, args.source_file_path, outputFilePath);
 
     return;
 
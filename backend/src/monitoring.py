@@ -0,0 +1,51 @@
+from sanic import Request, Blueprint, text, json
+from sanic.exceptions import SanicException
+from sanic_ext import openapi
+from dataclasses import asdict
+from typing import Dict
+
+from .JobController import JobController
+from .job_scheduler import GetScheduler
+from .maintenance import GetMaintenanceTask
+from .schemas import ResponseMaintenanceStats
+from .util import ConvertDatetimeToIsoString, CreateLogger
+from .metrics import GetMetricsRegistry, TMetricSamples, queueDepth, activeWorkers, workerCount
+from .executor import IsExecutorClient, GetExecutorClient
+
+logger = CreateLogger(__name__);
+
+monitoringBP = Blueprint("monitoring");
+
+@monitoringBP.get("/metrics")
+@openapi.description("Stage timings, queue depth, worker usage & omnizart resource usage in the Prometheus text format")
+@openapi.response(200, {"text/plain": str}, "metrics")
+async def getMetrics(_: Request):
+    #Gauges are sampled when scraped
+    queueDepth.Set(await JobController.CountQueuedJobsAsync());
+    #Jobs run in the executor, this worker only has the metrics of the requests it served
+    executorMetrics: Dict[str, TMetricSamples] = {};
+    if IsExecutorClient():
+        try:
+            executorMetrics = await GetExecutorClient().RequestAsync("metrics");
+        except Exception as e:
+            logger.warning(f"Could not get the executor's metrics: {e}");
+    else:
+        activeWorkers.Set(GetScheduler().GetActiveJobCount());
+        workerCount.Set(GetScheduler().GetWorkerCount());
+
+    return text(
+        GetMetricsRegistry().Render(executorMetrics),
+        content_type="text/plain; version=0.0.4; charset=utf-8"
+    );
+
+@monitoringBP.get("/maintenance/stats")
+@openapi.description("Rows & files deleted, space reclaimed and duration of the background maintenance on this node")
+@openapi.response(200, ResponseMaintenanceStats, "maintenance statistics")
+async def getMaintenanceStats(_: Request):
+    if IsExecutorClient():
+        try:
+            return json(await GetExecutorClient().RequestAsync("maintenance-stats"));
+        except Exception as e:
+            raise SanicException(f"could not get the executor's maintenance statistics: {e}", 503);
+
+    return json(ConvertDatetimeToIsoString(asdict(GetMaintenanceTask().GetStats())));
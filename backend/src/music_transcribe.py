@@ -1,16 +1,31 @@
-import tempfile
 import os
-from sanic import Request, Blueprint, file, raw, json
+import hashlib
+from sanic import Request, Blueprint, HTTPResponse, empty, json, raw
+from sanic.response import file_stream, ResponseStream
+from sanic.handlers import ContentRangeHandler
 from sanic.exceptions import SanicException
 from sanic_ext import openapi
-from typing import Optional, get_args, List
+from typing import Optional, get_args, List, Dict, Tuple, Any, BinaryIO
+from datetime import datetime
 import asyncio
 
-from .util import CreateLogger, GetFilenameWithExtension, GetThreadpool, ConvertDatetimeToIsoString, SanitiseFilename
-from .transcriber import Transcriber, TOmnizartMode, TTranscriptionResult
+from .util import CreateLogger, ConvertDatetimeToIsoString, SanitiseFilename, GetUploadPath, GetBatchUploadPath, GetPartialResultPath
+from .transcriber import Transcriber, TOmnizartMode
 
-from .schemas import TranscriptionJob, IsJobDone, ResponseScheduledJob, TOmnizartMode, ResponseTranscriptionJob
+from .schemas import TranscriptionJob, JobStatus, StatusName, IsJobDone, ResponseScheduledJob, TOmnizartMode, ResponseTranscriptionJob, ResponseCacheStats, ResponseScheduledBatch, ResponseBatchStatus
 from .JobController import JobController
+from .job_scheduler import GetScheduler
+from .result_cache import GetResultCache
+from .job_events import GetJobEventBus, FormatServerSentEvent
+from .upload import ReceiveMultipartUpload, TMultipartUpload, TUploadedFile, ExpandZipUpload
+from .constants import CONST
+from .database import IsPostgres
+from .metrics import Span
+from .throughput import QueueForecast
+from .admission import AdmitSubmissionAsync, CheckClientCapacityAsync, CheckQueueCapacityAsync
+from .sound_util import SoundUtil, TAudioInfo
+from .status_cache import GetStatusCache, TCachedResponse
+from .derived_cache import GetDerivedCache, TDerivedKind, NOTES_JSON, NOTES_BINARY, PREVIEW
 
 from dataclasses import asdict
 
@@ -26,16 +41,290 @@ def GetTranscriptionMode(mode: Optional[str], defaultMode: TOmnizartMode) -> TOm
     else:
         return mode;
 
+def MatchesIfNoneMatch(request: Request, etag: str) -> bool:
+    ifNoneMatch: Optional[str] = request.headers.get("If-None-Match");
+    return not ifNoneMatch is None and (ifNoneMatch.strip() == "*" or etag in [tag.strip() for tag in ifNoneMatch.split(",")]);
+
+def CachedJsonResponse(request: Request, cached: TCachedResponse) -> HTTPResponse:
+    headers: Dict[str, str] = {**cached.headers, "ETag": cached.etag};
+    if MatchesIfNoneMatch(request, cached.etag):
+        return empty(304, headers=headers);
+    return raw(cached.body, content_type="application/json", headers=headers);
+
+def ParseOptionalInt(value: Optional[str], name: str) -> Optional[int]:
+    if value is None or value == "":
+        return None;
+    try:
+        return int(value);
+    except ValueError:
+        raise SanicException(f"{name} <{value}> is not an integer", 400);
+
+def ParseOptionalList(value: Optional[str]) -> Optional[List[str]]:
+    if value is None or value == "":
+        return None;
+    return [item.strip() for item in value.split(",") if item.strip() != ""];
+
+def ParseOptionalDatetime(value: Optional[str], name: str) -> Optional[datetime]:
+    if value is None or value == "":
+        return None;
+    try:
+        return datetime.fromisoformat(value);
+    except ValueError:
+        raise SanicException(f"{name} <{value}> is not an ISO 8601 datetime", 400);
+
+#Streams the request body to disk, the caller is responsible for discarding the upload
+async def ReceiveMusicFile(request: Request) -> Tuple[TMultipartUpload, TUploadedFile]:
+    with Span("upload"):
+        upload: TMultipartUpload = await ReceiveMultipartUpload(request);
+
+    musicFile: Optional[TUploadedFile] = upload.GetFile("music-file");
+    if musicFile is None:
+        upload.Discard();
+        logger.info("no file uploaded")
+        raise SanicException("no file uploaded", 400);
+
+    logger.info(f"upload complete, {musicFile.size} bytes");
+    return (upload, musicFile);
+
+#Probed in the background, ffprobe has to be started for compressed formats
+async def ProbeAudioDurationAsync(filePath: str) -> Optional[float]:
+    try:
+        info: Optional[TAudioInfo] = await asyncio.get_running_loop().run_in_executor(None, SoundUtil.ProbeAudio, filePath);
+    except Exception as e:
+        logger.warning(f"Failed to probe <{filePath}>: {e}");
+        return None;
+
+    return info.durationSeconds if not info is None and info.durationSeconds > 0 else None;
+
+#Moves the upload into the job's directory and places the job in the scheduler's queue,
+#identical uploads that were transcribed before are completed straight from the result cache
+async def EnqueueTranscriptionJob(upload: TMultipartUpload, musicFile: TUploadedFile, mode: TOmnizartMode, clientId: str) -> int:
+    try:
+        cachedResultId: Optional[int] = await GetResultCache().LookupAsync(musicFile.sha256, mode);
+        if not cachedResultId is None:
+            jobId: int = await JobController.InitJob(mode, musicFile.name, clientId=clientId);
+            await JobController.LinkCompletedJobAsync(jobId, cachedResultId);
+            logger.info(f"Job {jobId} completed from cache");
+            return jobId;
+
+        await CheckQueueCapacityAsync(1);
+        #Other submissions of the client may have been enqueued while this one was uploading
+        await CheckClientCapacityAsync(clientId, 1);
+
+        jobId: int = await JobController.InitJob(mode, musicFile.name, clientId=clientId);
+
+        srcFilePath: str = GetUploadPath(jobId, musicFile.name);
+        os.makedirs(os.path.dirname(srcFilePath), exist_ok=True);
+        os.rename(musicFile.path, srcFilePath);
+
+        audioDuration: Optional[float] = await ProbeAudioDurationAsync(srcFilePath);
+        await JobController.EnqueueJob(jobId, srcFilePath, musicFile.sha256, audioDuration, musicFile.size);
+        GetScheduler().Notify();
+        logger.info(f"Job {jobId} queued");
+
+        return jobId;
+    finally:
+        upload.Discard();
+
+def ParseTranscriptionModes(value: Optional[str]) -> List[TOmnizartMode]:
+    modes: List[str] = ParseOptionalList(value) or [];
+    if len(modes) == 0:
+        raise SanicException("at least one mode is required", 400);
+
+    unknownModes: List[str] = [mode for mode in modes if not mode in get_args(TOmnizartMode)];
+    if len(unknownModes) > 0:
+        raise SanicException(f"unknown modes <{','.join(unknownModes)}>", 400);
+
+    #Duplicates would only transcribe the same thing twice
+    return list(dict.fromkeys(modes));
+
+#Every "music-file" part is an input, zip archives are expanded into their members
+async def ReceiveBatchInputs(request: Request) -> Tuple[TMultipartUpload, List[TUploadedFile]]:
+    with Span("upload"):
+        upload: TMultipartUpload = await ReceiveMultipartUpload(request);
+    try:
+        inputs: List[TUploadedFile] = [];
+        for musicFile in upload.files.get("music-file", []):
+            if musicFile.name.lower().endswith(".zip"):
+                inputs += await asyncio.get_running_loop().run_in_executor(None, ExpandZipUpload, upload, musicFile);
+            else:
+                inputs.append(musicFile);
+
+        if len(inputs) == 0:
+            raise SanicException("no file uploaded", 400);
+        if len(inputs) > CONST.MAX_BATCH_INPUTS:
+            raise SanicException(f"at most {CONST.MAX_BATCH_INPUTS} files can be transcribed in one batch", 413);
+
+        logger.info(f"batch upload complete, {len(inputs)} files");
+        return (upload, inputs);
+    except BaseException:
+        upload.Discard();
+        raise;
+
+#Creates one job per (input, mode), inputs are moved into the batch's directory once
+#and shared by all of their jobs, so each one is only decoded once
+async def EnqueueTranscriptionBatch(
+    upload: TMultipartUpload, 
+    inputs: List[TUploadedFile], 
+    modes: List[TOmnizartMode], 
+    clientId: str) -> ResponseScheduledBatch:
+
+    try:
+        cachedResultIds: List[List[Optional[int]]] = [
+            [await GetResultCache().LookupAsync(musicFile.sha256, mode) for mode in modes]
+            for musicFile in inputs
+        ];
+
+        uncachedJobs: int = sum(resultIds.count(None) for resultIds in cachedResultIds);
+        if uncachedJobs > 0:
+            await CheckQueueCapacityAsync(uncachedJobs);
+            await CheckClientCapacityAsync(clientId, uncachedJobs);
+
+        batchId: int = await JobController.InitBatchJob(modes, len(inputs));
+        jobIds: List[int] = [];
+
+        for (inputNo, musicFile) in enumerate(inputs):
+            pendingJobIds: List[int] = [];
+            for (mode, cachedResultId) in zip(modes, cachedResultIds[inputNo]):
+                jobId: int = await JobController.InitJob(mode, musicFile.name, datetime.now(), batchId, clientId);
+                jobIds.append(jobId);
+
+                if cachedResultId is None:
+                    pendingJobIds.append(jobId);
+                else:
+                    await JobController.LinkCompletedJobAsync(jobId, cachedResultId);
+                    logger.info(f"Job {jobId} completed from cache");
+
+            if len(pendingJobIds) == 0:
+                continue;
+
+            srcFilePath: str = GetBatchUploadPath(batchId, inputNo, musicFile.name);
+            os.makedirs(os.path.dirname(srcFilePath), exist_ok=True);
+            os.rename(musicFile.path, srcFilePath);
+
+            audioDuration: Optional[float] = await ProbeAudioDurationAsync(srcFilePath);
+            await JobController.EnqueueJobs(pendingJobIds, srcFilePath, musicFile.sha256, audioDuration, musicFile.size);
+
+        GetScheduler().Notify();
+        logger.info(f"Batch {batchId} queued, {len(jobIds)} jobs");
+
+        return ResponseScheduledBatch(batchId, jobIds);
+    finally:
+        upload.Discard();
+
 @transcribeBP.get("/status/all")
-@openapi.description("Gets the status of all jobs")
+@openapi.description(
+    "Gets the status of jobs, newest first, one page at a time. "
+    "Pass the 'X-Next-Cursor' response header as 'cursor' to fetch the next page, "
+    "the header is absent on the last page"
+)
+@openapi.parameter("limit", int, "query", description=f"page size, at most {CONST.STATUS_PAGE_MAX_LIMIT}")
+@openapi.parameter("cursor", int, "query", description="id of the last job on the previous page")
+@openapi.parameter("order", str, "query", description="'desc' (default) or 'asc' by id")
+@openapi.parameter("status", str, "query", description="comma separated statuses")
+@openapi.parameter("mode", str, "query", description="comma separated modes")
+@openapi.parameter("filename", str, "query", description="filename substring, case insensitive")
+@openapi.parameter("started_after", str, "query", description="ISO 8601 start time, inclusive")
+@openapi.parameter("started_before", str, "query", description="ISO 8601 start time, exclusive")
+@openapi.parameter("fields", str, "query", description="comma separated fields to return, defaults to all")
 @openapi.response(200, List[ResponseTranscriptionJob], "list of jobs statuses")
-async def listStatus(_: Request):
-    jobList = await TranscriptionJob.select();
+@openapi.response(304, None, "statuses unchanged since the ETag in If-None-Match")
+async def listStatus(request: Request):
+    query: str = "&".join(f"{name}={value}" for (name, value) in sorted(request.query_args));
+    cached: Optional[TCachedResponse] = GetStatusCache().GetList(query);
+    if not cached is None:
+        return CachedJsonResponse(request, cached);
+    version: int = GetStatusCache().GetVersion();
+
+    limit: Optional[int] = ParseOptionalInt(request.args.get("limit"), "limit");
+    if limit is None:
+        limit = CONST.STATUS_PAGE_DEFAULT_LIMIT;
+    elif limit < 1 or limit > CONST.STATUS_PAGE_MAX_LIMIT:
+        raise SanicException(f"limit must be between 1 and {CONST.STATUS_PAGE_MAX_LIMIT}", 400);
+
+    order: str = request.args.get("order", "desc");
+    if not order in ["asc", "desc"]:
+        raise SanicException(f"order <{order}> must be 'asc' or 'desc'", 400);
+
+    fieldNames: Optional[List[str]] = ParseOptionalList(request.args.get("fields"));
+    columnNames: Optional[List[str]] = None;
+    if not fieldNames is None:
+        unknownFields: List[str] = [name for name in fieldNames if not name in ResponseTranscriptionJob.FieldNames()];
+        if len(unknownFields) > 0:
+            raise SanicException(f"unknown fields <{','.join(unknownFields)}>", 400);
+
+        derivedFieldColumnNames: Dict[str, List[str]] = ResponseTranscriptionJob.DerivedFieldColumnNames();
+        columnNames = list(set(
+            columnName
+            for name in fieldNames
+            for columnName in derivedFieldColumnNames.get(name, [name])
+            if columnName != "id"
+        ));
+
+    (jobList, hasNextPage) = await JobController.ListJobsAsync(
+        limit,
+        cursor=ParseOptionalInt(request.args.get("cursor"), "cursor"),
+        descending=order == "desc",
+        statuses=ParseOptionalList(request.args.get("status")),
+        modes=ParseOptionalList(request.args.get("mode")),
+        filenameSubstring=request.args.get("filename"),
+        startedAfter=ParseOptionalDatetime(request.args.get("started_after"), "started_after"),
+        startedBefore=ParseOptionalDatetime(request.args.get("started_before"), "started_before"),
+        columnNames=columnNames
+    );
 
-    return json([
-        ConvertDatetimeToIsoString(asdict(ResponseTranscriptionJob.FromTranscriptionJobDBO(job)))
+    headers: Dict[str, str] = {};
+    if hasNextPage:
+        headers["X-Next-Cursor"] = str(jobList[-1]["id"]);
+
+    estimatesRequested: bool = fieldNames is None or "progress" in fieldNames or "eta_seconds" in fieldNames;
+    forecast: Optional[QueueForecast] = await QueueForecast.CreateAsync(jobList) if estimatesRequested else None;
+
+    body: bytes = json([
+        ConvertDatetimeToIsoString(
+            asdict(ResponseTranscriptionJob.FromTranscriptionJobDBO(job, *forecast.Estimate(job)))
+            if fieldNames is None else
+            ResponseTranscriptionJob.ProjectionFromTranscriptionJobDBO(
+                job, 
+                fieldNames, 
+                *(forecast.Estimate(job) if not forecast is None else (None, None))
+            )
+        )
         for job in jobList
-    ]);
+    ]).body;
+    hasEstimates: bool = estimatesRequested and any(not IsJobDone(job["status"]) for job in jobList);
+    return CachedJsonResponse(request, GetStatusCache().PutList(query, version, body, headers, hasEstimates));
+
+@transcribeBP.get("/cache/stats")
+@openapi.description("Gets result cache usage & hit rate")
+@openapi.response(200, ResponseCacheStats, "cache statistics")
+async def getCacheStats(_: Request):
+    stats = await GetResultCache().GetStatsAsync();
+    return json(asdict(stats));
+
+@transcribeBP.get("/events")
+@openapi.description(
+    "Server-sent event stream of job status transitions. " 
+    "Optionally filtered by the 'job_id' query param, "
+    "resumes after the 'Last-Event-ID' header (or 'last_event_id' query param) when given"
+)
+async def streamJobEvents(request: Request):
+    jobId: Optional[int] = ParseOptionalInt(request.args.get("job_id"), "job_id");
+    lastEventId: Optional[int] = ParseOptionalInt(
+        request.headers.get("Last-Event-ID", request.args.get("last_event_id")),
+        "last_event_id"
+    );
+
+    response = await request.respond(
+        content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    );
+
+    async for event in GetJobEventBus().Subscribe(jobId, lastEventId):
+        if event is None:
+            await response.send(": keepalive\n\n");
+        else:
+            await response.send(FormatServerSentEvent(event));
 
 @transcribeBP.get("/terminate/<job_id:int>")
 @openapi.description("Terminates an existing job")
@@ -51,73 +340,213 @@ async def cancelJob(request: Request, job_id: int):
 @transcribeBP.get("/status/<job_id:int>")
 @openapi.description("Gets the current status of a job")
 @openapi.response(200, ResponseTranscriptionJob, "Job Status")
-async def getStatus(_: Request, job_id: int):
-    job = await TranscriptionJob.select().where(TranscriptionJob.id == job_id).first()
-    if job is None:
-        raise SanicException(f"job_id <{job_id}> not found", 404);
-    else:
-        jobStatus = ResponseTranscriptionJob.FromTranscriptionJobDBO(job);
-
-        return json(ConvertDatetimeToIsoString(asdict(jobStatus)))
+@openapi.response(304, None, "status unchanged since the ETag in If-None-Match")
+async def getStatus(request: Request, job_id: int):
+    cached: Optional[TCachedResponse] = GetStatusCache().GetJob(job_id);
+    if cached is None:
+        version: int = GetStatusCache().GetVersion();
+        job = await TranscriptionJob.select().where(TranscriptionJob.id == job_id).first()
+        if job is None:
+            raise SanicException(f"job_id <{job_id}> not found", 404);
+
+        forecast: QueueForecast = await QueueForecast.CreateAsync([job]);
+        jobStatus = ResponseTranscriptionJob.FromTranscriptionJobDBO(job, *forecast.Estimate(job));
+        body: bytes = json(ConvertDatetimeToIsoString(asdict(jobStatus))).body;
+        cached = GetStatusCache().PutJob(job_id, version, body, not jobStatus.done);
+
+    return CachedJsonResponse(request, cached);
     
 @transcribeBP.get("/download-result/<job_id:int>")
-@openapi.description("Download the midi file generated from transcription")
+@openapi.description("Download the midi file generated from transcription, supports If-None-Match & Range requests")
 @openapi.response(200, {"audio/midi": bytes}, "midi file blob")
-async def getTranscriptionResult(_: Request, job_id: int):
+@openapi.response(206, {"audio/midi": bytes}, "requested byte range of the midi file")
+@openapi.response(304, None, "midi file unchanged")
+async def getTranscriptionResult(request: Request, job_id: int):
     completedJob = await JobController.GetCompletedJobAsync(logger, job_id);
     if completedJob is None:
         raise SanicException(f"no completed job for job_id <{job_id}>", 404);
-    else:
-        (blob, rawFilename) = completedJob
-        sanitisedFilename: str = SanitiseFilename(rawFilename);
-
-        logger.info(f"Downloading, sanitised filename = <{sanitisedFilename}>");
-        return raw(
-            blob,
-            headers={"Content-Disposition": f"attachment; filename={sanitisedFilename}"},
-            content_type="audio/midi"
+
+    #Results are content addressed, so the hash never changes for a given file
+    etag: str = f'"{completedJob.sha256}"';
+    headers: Dict[str, str] = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes"
+    };
+
+    if MatchesIfNoneMatch(request, etag):
+        return empty(304, headers=headers);
+
+    byteRange: Optional[ContentRangeHandler] = None;
+    if "range" in request.headers:
+        stats = await asyncio.get_running_loop().run_in_executor(None, os.stat, completedJob.filePath);
+        byteRange = ContentRangeHandler(request, stats);
+
+    sanitisedFilename: str = SanitiseFilename(completedJob.filename);
+    logger.info(f"Downloading, sanitised filename = <{sanitisedFilename}>");
+    return await file_stream(
+        completedJob.filePath,
+        chunk_size=CONST.FILE_CHUNK_SIZE,
+        mime_type="audio/midi",
+        headers=headers,
+        filename=sanitisedFilename,
+        _range=byteRange
+    );
+
+def ReadPartialResult(jobId: int) -> Optional[bytes]:
+    try:
+        with open(GetPartialResultPath(jobId), "rb") as hFile:
+            return hFile.read();
+    except FileNotFoundError:
+        return None;
+
+@transcribeBP.get("/partial-result/<job_id:int>")
+@openapi.description(
+    "Download what has been transcribed so far, from the start of the recording. Only segmented transcriptions "
+    "have a partial result, it grows as segments finish (see the partial-result events). "
+    "Once the job is done this is the complete midi file, as told by the X-Partial-Result header"
+)
+@openapi.response(200, {"audio/midi": bytes}, "midi file blob")
+@openapi.response(304, None, "midi file unchanged")
+@openapi.response(404, None, "nothing transcribed yet")
+async def getPartialResult(request: Request, job_id: int):
+    #Small, read at once since it's replaced as the job goes on & removed when it's done
+    partialResult: Optional[bytes] = await asyncio.get_running_loop().run_in_executor(None, ReadPartialResult, job_id);
+    if partialResult is None:
+        completedJob = await JobController.GetCompletedJobAsync(logger, job_id);
+        if completedJob is None:
+            raise SanicException(f"no partial result for job_id <{job_id}> yet", 404);
+
+        headers: Dict[str, str] = {"ETag": f'"{completedJob.sha256}"', "X-Partial-Result": "0"};
+        if MatchesIfNoneMatch(request, headers["ETag"]):
+            return empty(304, headers=headers);
+        return await file_stream(
+            completedJob.filePath,
+            chunk_size=CONST.FILE_CHUNK_SIZE,
+            mime_type="audio/midi",
+            headers=headers,
+            filename=SanitiseFilename(completedJob.filename)
         );
 
-@transcribeBP.post("/post-transcription-job")
+    headers: Dict[str, str] = {"ETag": f'"{hashlib.sha256(partialResult).hexdigest()}"', "X-Partial-Result": "1"};
+    if MatchesIfNoneMatch(request, headers["ETag"]):
+        return empty(304, headers=headers);
+    return raw(partialResult, content_type="audio/midi", headers=headers);
+
+#Artifacts are built on the first request for them (see derived_cache), they are revalidated without being built
+#"file_stream" of a file opened beforehand, closed once sent. It's still sent when its path is deleted meanwhile
+def StreamOpenedFile(hFile: BinaryIO, mimeType: str, headers: Dict[str, str], byteRange: Optional[ContentRangeHandler]) -> ResponseStream:
+    status: int = 200;
+    if not byteRange is None:
+        headers["Content-Range"] = f"bytes {byteRange.start}-{byteRange.end}/{byteRange.total}";
+        status = 206;
+
+    async def StreamAsync(response) -> None:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop();
+        try:
+            toSend: Optional[int] = None;
+            if not byteRange is None:
+                await loop.run_in_executor(None, hFile.seek, byteRange.start);
+                toSend = byteRange.size;
+            while toSend is None or toSend > 0:
+                chunk: bytes = await loop.run_in_executor(
+                    None,
+                    hFile.read,
+                    CONST.FILE_CHUNK_SIZE if toSend is None else min(toSend, CONST.FILE_CHUNK_SIZE)
+                );
+                if len(chunk) == 0:
+                    break;
+                if not toSend is None:
+                    toSend -= len(chunk);
+                await response.write(chunk);
+        finally:
+            hFile.close();
+
+    return ResponseStream(StreamAsync, status=status, headers=headers, content_type=mimeType);
+
+async def DerivedResultResponseAsync(request: Request, jobId: int, kind: TDerivedKind) -> HTTPResponse:
+    completedJob = await JobController.GetCompletedJobAsync(logger, jobId);
+    if completedJob is None:
+        raise SanicException(f"no completed job for job_id <{jobId}>", 404);
+
+    headers: Dict[str, str] = {
+        "ETag": GetDerivedCache().GetEtag(completedJob.sha256, kind),
+        "Accept-Ranges": "bytes"
+    };
+    if MatchesIfNoneMatch(request, headers["ETag"]):
+        return empty(304, headers=headers);
+
+    if not kind.isAvailable():
+        raise SanicException(f"{kind.name} needs {kind.requirements}, which this server doesn't have", 501);
+
+    try:
+        #Opened rather than streamed by path, another server process may evict it while it's sent
+        hFile: BinaryIO = await GetDerivedCache().OpenAsync(completedJob.sha256, completedJob.filePath, kind);
+    except Exception as e:
+        logger.error(f"Job id<{jobId}> - building the {kind.name} failed: {e}");
+        raise SanicException(f"building the {kind.name} of job_id <{jobId}> failed", 500);
+
+    try:
+        byteRange: Optional[ContentRangeHandler] = None;
+        if "range" in request.headers:
+            byteRange = ContentRangeHandler(request, os.fstat(hFile.fileno()));
+    except BaseException:
+        hFile.close();
+        raise;
+
+    return StreamOpenedFile(hFile, kind.mimeType, headers, byteRange);
+
+@transcribeBP.get("/result-notes/<job_id:int>")
+@openapi.description(
+    "Notes of the midi file for piano roll rendering, built on the first request & cached. "
+    "format=json: {duration, programs: {channel: program}, notes: [[start, end, pitch, velocity, channel]]}, "
+    "times in seconds & notes by start time. "
+    "format=binary (little endian): 'TNA1', uint32 note count, 16 uint8 programs by channel (255 when not set), "
+    "then 12 bytes per note: uint32 start & uint32 duration in ms, uint8 pitch, velocity, channel & padding"
+)
+@openapi.parameter("format", str, "query", description="'json' (default) or 'binary'")
+@openapi.response(200, {"application/json": dict, "application/octet-stream": bytes}, "note array")
+@openapi.response(304, None, "notes unchanged")
+async def getResultNotes(request: Request, job_id: int):
+    formatName: str = request.args.get("format", "json");
+    kind: Optional[TDerivedKind] = {"json": NOTES_JSON, "binary": NOTES_BINARY}.get(formatName);
+    if kind is None:
+        raise SanicException(f"format <{formatName}> is not 'json' or 'binary'", 400);
+    return await DerivedResultResponseAsync(request, job_id, kind);
+
+@transcribeBP.get("/result-preview/<job_id:int>")
+@openapi.description(
+    "mp3 rendering of the midi file with a General MIDI soundfont, built on the first request & cached. "
+    "Supports If-None-Match & Range requests"
+)
+@openapi.response(200, {"audio/mpeg": bytes}, "audio preview")
+@openapi.response(206, {"audio/mpeg": bytes}, "requested byte range of the audio preview")
+@openapi.response(304, None, "audio preview unchanged")
+@openapi.response(501, None, "fluidsynth, ffmpeg or the soundfont isn't installed")
+async def getResultPreview(request: Request, job_id: int):
+    return await DerivedResultResponseAsync(request, job_id, PREVIEW);
+
+@transcribeBP.post("/post-transcription-job", stream=True)
 @openapi.description("transcribes a .wav file into a midi file")
 async def postTranscriptionJob(request: Request): 
-    musicFile = request.files.get("music-file");
-
-    if musicFile is None:
-        logger.info("no file uploaded")
-        raise SanicException("no file uploaded", 400);
+    clientId: str = await AdmitSubmissionAsync(request);
+    (upload, musicFile) = await ReceiveMusicFile(request);
 
     mode = request.args.get("mode")
     requestedMode: TOmnizartMode = GetTranscriptionMode(mode, "music");
     logger.info(f"Mode: query param <{mode}>, parsed <{requestedMode}>")
 
-    jobId: int = await JobController.InitJob(mode, musicFile.name);
-
-    eventLoop = asyncio.get_running_loop()
-
-    #Fire off job in another thread
-    eventLoop.run_in_executor(
-        None,
-        Transcriber.TranscribeFile,
-        jobId, 
-        logger, 
-        musicFile, 
-        mode
-    );
+    jobId: int = await EnqueueTranscriptionJob(upload, musicFile, requestedMode, clientId);
 
     postedJob = ResponseScheduledJob(jobId);
     #return job id
     return json(asdict(postedJob))
 
-@transcribeBP.post("/transcribe-cancellable")
+@transcribeBP.post("/transcribe-cancellable", stream=True)
 @openapi.description("transcribes a .wav file into a midi file")
 @openapi.response(200, ResponseScheduledJob, "Scheduled job")
 async def transcribeMusicCancellable(request: Request):
-    musicFile = request.files.get("music-file");
-
-    if musicFile is None:
-        logger.info("no file uploaded")
-        raise SanicException("no file uploaded", 400);
+    clientId: str = await AdmitSubmissionAsync(request);
+    (upload, musicFile) = await ReceiveMusicFile(request);
 
     mode = request.args.get("mode")
     requestedMode: TOmnizartMode = GetTranscriptionMode(mode, "music");
@@ -126,36 +555,75 @@ async def transcribeMusicCancellable(request: Request):
     if not Transcriber.IsSupportedMode(requestedMode):
         logger.warn(f"Warning, mode<{mode}> is not supported");
 
-    logger.info("upload complete");
-
-    jobId: int = await JobController.InitJob(requestedMode, musicFile.name);
-
-    threadpool = GetThreadpool();
-
-    threadpool.submit(
-        Transcriber.TranscribeCancellable_Proc,
-        musicFile.name,
-        musicFile.body,
-        requestedMode,
-        logger,
-        jobId
-    );
-    logger.info(f"Job {jobId} submitted");
+    jobId: int = await EnqueueTranscriptionJob(upload, musicFile, requestedMode, clientId);
 
     #return job id
     postedJob = ResponseScheduledJob(jobId);
     return json(asdict(postedJob))
 
+@transcribeBP.post("/transcribe-batch", stream=True)
+@openapi.description(
+    "transcribes several files, or the files in a .zip archive, with every one of the given modes. "
+    "Each file is decoded once and shared by the jobs of all modes"
+)
+@openapi.parameter("modes", str, "query", description="comma separated modes, e.g. 'music,vocal'")
+@openapi.response(200, ResponseScheduledBatch, "Scheduled batch")
+async def transcribeMusicBatch(request: Request):
+    requestedModes: List[TOmnizartMode] = ParseTranscriptionModes(request.args.get("modes"));
+    clientId: str = await AdmitSubmissionAsync(request);
+    (upload, inputs) = await ReceiveBatchInputs(request);
+
+    scheduledBatch: ResponseScheduledBatch = await EnqueueTranscriptionBatch(upload, inputs, requestedModes, clientId);
+    return json(asdict(scheduledBatch));
+
+@transcribeBP.get("/batch/status/<batch_id:int>")
+@openapi.description("Gets the aggregate progress of a batch along with the status of each of its jobs")
+@openapi.response(200, ResponseBatchStatus, "Batch Status")
+async def getBatchStatus(_: Request, batch_id: int):
+    batchJob = await JobController.GetBatchJobAsync(batch_id);
+    if batchJob is None:
+        raise SanicException(f"batch_id <{batch_id}> not found", 404);
+
+    (batch, jobs) = batchJob;
+    forecast: QueueForecast = await QueueForecast.CreateAsync(jobs);
+    batchStatus: Dict[str, Any] = asdict(ResponseBatchStatus.FromBatchJobDBO(
+        batch, 
+        jobs, 
+        [forecast.Estimate(job) for job in jobs]
+    ));
+    batchStatus["jobs"] = [ConvertDatetimeToIsoString(job) for job in batchStatus["jobs"]];
+    return json(batchStatus);
+
+#Returns the final status of the job, raises asyncio.TimeoutError if it isn't done within "timeoutSeconds".
+#Jobs claimed by other nodes publish no events here, their status is polled instead
+async def WaitForJobAsync(jobId: int, timeoutSeconds: float) -> str:
+    pollSeconds: float = CONST.SHARED_QUEUE_POLL_SECONDS if IsPostgres() else CONST.JOB_EVENT_KEEPALIVE_SECONDS;
+    deadline: float = asyncio.get_running_loop().time() + timeoutSeconds;
+
+    with GetJobEventBus().Watch(jobId) as events:
+        while True:
+            status: Optional[str] = await JobController.GetJobStatusAsync(jobId);
+            if status is None or IsJobDone(status):
+                return status or StatusName(JobStatus.ERROR);
+
+            remainingSeconds: float = deadline - asyncio.get_running_loop().time();
+            if remainingSeconds <= 0:
+                raise asyncio.TimeoutError();
+            try:
+                await asyncio.wait_for(events.get(), min(pollSeconds, remainingSeconds));
+            except asyncio.TimeoutError:
+                pass;
+
 #TODO -> Omnizart can't seem to transcribe short files
-@transcribeBP.post("/transcribe")
-@openapi.description("transcribes a .wav file into a midi file")
+@transcribeBP.post("/transcribe", stream=True)
+@openapi.description(
+    "transcribes a .wav file into a midi file. The job is queued like any other & the response is sent once it is done, "
+    "it is terminated if the client disconnects first"
+)
 @openapi.response(200, {"audio/midi": bytes}, "midi file blob")
 async def transcribeMusic(request: Request):
-    musicFile = request.files.get("music-file");
-
-    if musicFile is None:
-        logger.info("no file uploaded")
-        raise SanicException("no file uploaded", 400);
+    clientId: str = await AdmitSubmissionAsync(request);
+    (upload, musicFile) = await ReceiveMusicFile(request);
 
     mode = request.args.get("mode")
     requestedMode: TOmnizartMode = GetTranscriptionMode(mode, "music");
@@ -164,30 +632,34 @@ async def transcribeMusic(request: Request):
     if not Transcriber.IsSupportedMode(requestedMode):
         logger.warn(f"Warning, mode<{mode}> is not supported");
 
-    logger.info("upload complete");
-    transcriptionResult: Optional[TTranscriptionResult] = None;
+    jobId: int = await EnqueueTranscriptionJob(upload, musicFile, requestedMode, clientId);
+    #Sanic stops reading once its buffer fills up, which may be where the upload ended.
+    #The body has been read, reading again only lets a disconnect be noticed
+    request.transport.resume_reading();
     try:
-        with tempfile.TemporaryDirectory() as tmp:
-            srcFilePath: str = os.path.join(tmp, musicFile.name)
-
-            with open(srcFilePath, 'wb') as hFile:
-                hFile.write(musicFile.body)
-            logger.info("disk write complete");
-
-            transcriptionResult = Transcriber.Transcribe(
-                tmp,
-                musicFile.name,
-                requestedMode,
-                logger
-            );
-            
-            return await file(
-                transcriptionResult.filePath, 
-                filename=GetFilenameWithExtension(transcriptionResult.filePath), 
-                mime_type="audio/midi"
-            );
-    finally:
-        if transcriptionResult and transcriptionResult.cleanupRequired:
-            logger.info(f"Deleting temp file: {transcriptionResult.filePath}")
-            assert(os.path.isfile(transcriptionResult.filePath))
-            os.remove(transcriptionResult.filePath)
\ No newline at end of file
+        status: str = await WaitForJobAsync(jobId, CONST.SYNC_TRANSCRIPTION_TIMEOUT_SECONDS);
+    except asyncio.TimeoutError:
+        await JobController.MarkJobForTermination(jobId);
+        raise SanicException(f"transcription did not finish within {CONST.SYNC_TRANSCRIPTION_TIMEOUT_SECONDS:g}s", 504);
+    except asyncio.CancelledError:
+        #Sanic cancels the handler when the client disconnects, nobody is left to receive the result
+        logger.info(f"Client disconnected, terminating job <{jobId}>");
+        await JobController.MarkJobForTermination(jobId);
+        raise;
+
+    if status == StatusName(JobStatus.TERMINATED):
+        raise SanicException("transcription was cancelled", 503);
+    if status == StatusName(JobStatus.OOM_KILLED):
+        raise SanicException("transcription ran out of memory", 500);
+
+    completedJob = await JobController.GetCompletedJobAsync(logger, jobId);
+    if status != StatusName(JobStatus.DONE) or completedJob is None:
+        raise SanicException("transcription failed", 500);
+
+    return await file_stream(
+        completedJob.filePath,
+        chunk_size=CONST.FILE_CHUNK_SIZE,
+        mime_type="audio/midi",
+        headers={"ETag": f'"{completedJob.sha256}"', "X-Job-Id": str(jobId)},
+        filename=SanitiseFilename(completedJob.filename)
+    );
@@ -0,0 +1,261 @@
+import importlib
+import multiprocessing
+import threading
+import resource
+import signal
+from multiprocessing.connection import Connection
+from logging import Logger
+from typing import Dict, List, Optional, Any, Callable
+
+from .constants import CONST
+from .util import CreateLogger
+from .metrics import RecordChildUsage
+from .pipeline import OutOfMemoryError
+from .resource_monitor import GetResourceMonitor, LimitProcess
+
+#Python modules of omnizart's transcription apps, by mode
+omnizartAppModules: Dict[str, str] = {
+    "music": "omnizart.music",
+    "drum": "omnizart.drum",
+    "chord": "omnizart.chord",
+    "vocal": "omnizart.vocal",
+    "vocal-contour": "omnizart.vocal_contour"
+};
+
+#omnizart's apps reload their checkpoint on every call to transcribe(), loaded models are kept instead
+def _KeepModelsLoaded(app: Any) -> None:
+    loadModel: Callable = app._load_model;
+    loadedModels: Dict[Optional[str], Any] = {};
+
+    def LoadModelOnce(modelPath: Optional[str] = None, *args, **kwargs) -> Any:
+        if not modelPath in loadedModels:
+            loadedModels[modelPath] = loadModel(modelPath, *args, **kwargs);
+        return loadedModels[modelPath];
+
+    app._load_model = LoadModelOnce;
+
+def _LoadTranscribeFunction(mode: str, backend: str) -> Callable[[str, str], None]:
+    if backend == "mock":
+        from .mock import omnizart_mock;
+        return lambda srcFilePath, outputPath: omnizart_mock.Transcribe(mode, srcFilePath, outputPath);
+    elif backend == "mock-error":
+        from .mock import omnizart_error_mock;
+        return lambda srcFilePath, outputPath: omnizart_error_mock.Transcribe(mode, srcFilePath, outputPath);
+
+    app = importlib.import_module(omnizartAppModules[mode]).app;
+    _KeepModelsLoaded(app);
+    return lambda srcFilePath, outputPath: app.transcribe(srcFilePath, output=outputPath);
+
+def _GetCpuSeconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF);
+    childUsage = resource.getrusage(resource.RUSAGE_CHILDREN);
+    return usage.ru_utime + usage.ru_stime + childUsage.ru_utime + childUsage.ru_stime;
+
+#ru_maxrss of a worker is its peak over every job it ran, the kernel's peak (VmHWM) can be reset between jobs instead.
+#False where it can't (without /proc or before linux 4.0)
+def _ResetPeakRss() -> bool:
+    try:
+        with open("/proc/self/clear_refs", "w") as hFile:
+            hFile.write("5");
+        return True;
+    except OSError:
+        return False;
+
+#Bytes since the last "_ResetPeakRss"
+def _ReadPeakRssBytes() -> Optional[int]:
+    try:
+        with open("/proc/self/status") as hFile:
+            for line in hFile:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024; #kB
+    except OSError:
+        pass;
+    return None;
+
+#Entry point of the worker processes,
+#imports omnizart once, then transcribes (srcFilePath, outputPath) requests until the pipe is closed.
+#Replies with (succeeded, whether it ran out of memory, error message, CPU seconds used by the job,
+#peak RSS of the worker during the job in bytes or None if it can't be measured)
+def _WorkerMain(conn: Connection, mode: str, backend: str) -> None:
+    transcribe: Callable[[str, str], None] = _LoadTranscribeFunction(mode, backend);
+
+    while True:
+        try:
+            (srcFilePath, outputPath) = conn.recv();
+        except EOFError:
+            return;
+
+        cpuSecondsBefore: float = _GetCpuSeconds();
+        peakRssWasReset: bool = _ResetPeakRss();
+        try:
+            transcribe(srcFilePath, outputPath);
+            (succeeded, outOfMemory, msg) = (True, False, "");
+        except Exception as e:
+            (succeeded, outOfMemory, msg) = (False, isinstance(e, MemoryError), f"{type(e).__name__}: {e}");
+
+        peakRssBytes: Optional[int] = _ReadPeakRssBytes() if peakRssWasReset else None;
+        conn.send((succeeded, outOfMemory, msg, _GetCpuSeconds() - cpuSecondsBefore, peakRssBytes));
+
+#Parent side handle of one worker process, used by one scheduler thread at a time
+class OmnizartWorker:
+    def __init__(self, mode: str, backend: str):
+        (self._conn, childConn) = multiprocessing.Pipe();
+
+        self.mode: str = mode;
+        self.jobCount: int = 0;
+        self._process = multiprocessing.get_context("spawn").Process(
+            target=_WorkerMain,
+            args=(childConn, mode, backend),
+            name=f"omnizart-{mode}-worker",
+            daemon=True
+        );
+        self._process.start();
+        childConn.close();
+        self.pid: int = self._process.pid;
+        LimitProcess(self.pid);
+
+    def IsAlive(self) -> bool:
+        return self._process.is_alive();
+
+    #Cancelled workers get SIGTERM, SIGKILL comes from the memory limit (see resource_monitor) or the kernel's OOM killer
+    def _RaiseExited(self) -> None:
+        if self._process.exitcode == -signal.SIGKILL:
+            raise OutOfMemoryError(f"omnizart worker <{self.pid}> was killed, most likely for its memory use");
+        raise Exception(f"omnizart worker <{self.pid}> exited, exitcode = {self._process.exitcode}");
+
+    #Returns False when cancelled, a worker cancelled mid-job is killed
+    def Transcribe(self, srcFilePath: str, outputPath: str, cancelEvent: threading.Event, pollingIntervalSeconds: float) -> bool:
+        if cancelEvent.is_set():
+            return False;
+
+        self.jobCount += 1;
+        self._conn.send((srcFilePath, outputPath));
+
+        while not self._conn.poll(pollingIntervalSeconds):
+            if cancelEvent.is_set():
+                self.Stop();
+                return False;
+
+            if not self._process.is_alive() and not self._conn.poll():
+                self._RaiseExited();
+
+        try:
+            (succeeded, outOfMemory, msg, cpuSeconds, peakRssBytes) = self._conn.recv();
+        except (EOFError, ConnectionError):
+            self._process.join();
+            self._RaiseExited();
+
+        RecordChildUsage(self.mode, cpuSeconds, peakRssBytes);
+        if outOfMemory:
+            #Whatever it still holds isn't worth keeping, the pool replaces it
+            self.Stop();
+            raise OutOfMemoryError(f"omnizart worker <{self.pid}> ran out of memory transcribing <{srcFilePath}>: {msg}");
+        if not succeeded:
+            raise Exception(f"Error transcribing <{srcFilePath}>: {msg}");
+
+        return True;
+
+    def Stop(self) -> None:
+        self._conn.close();
+        if self._process.is_alive():
+            self._process.terminate();
+        self._process.join();
+
+#Keeps omnizart loaded between jobs. Workers are started per mode on demand,
+#replaced once they crash, are killed or have run "maxJobsPerWorker" jobs
+class WorkerPool:
+    def __init__(self, maxIdleWorkers: int, maxJobsPerWorker: int, logger: Logger):
+        self._maxIdleWorkers: int = maxIdleWorkers;
+        self._maxJobsPerWorker: int = maxJobsPerWorker;
+        self._logger: Logger = logger;
+
+        self._lock = threading.Lock();
+        self._idleWorkers: List[OmnizartWorker] = []; #Least recently used first
+
+    @staticmethod
+    def _GetBackend() -> str:
+        if CONST.MOCK_OMNIZART == False:
+            return "omnizart";
+        elif CONST.MOCK_OMNIZART_ERROR:
+            return "mock-error";
+        else:
+            return "mock";
+
+    #Blocking, returns False when cancelled through "cancelEvent".
+    #The worker's memory & CPU are accounted to "jobId" while it runs
+    def Transcribe(
+        self,
+        mode: str,
+        srcFilePath: str,
+        outputPath: str,
+        cancelEvent: threading.Event,
+        jobId: Optional[int] = None) -> bool:
+
+        worker: OmnizartWorker = self._Acquire(mode);
+        try:
+            with GetResourceMonitor().Tracking(jobId, worker.pid):
+                return worker.Transcribe(srcFilePath, outputPath, cancelEvent, 0.05);
+        finally:
+            self._Release(worker);
+
+    #Idle workers the next jobs of "mode" will run in, most recently used first
+    def GetIdleWorkerPids(self, mode: str) -> List[int]:
+        with self._lock:
+            return [worker.pid for worker in reversed(self._idleWorkers) if worker.mode == mode];
+
+    #Frees the memory of idle workers that the next jobs won't reuse, returns how many were stopped
+    def StopIdleWorkers(self, exceptMode: str) -> int:
+        with self._lock:
+            stoppedWorkers: List[OmnizartWorker] = [worker for worker in self._idleWorkers if worker.mode != exceptMode];
+            self._idleWorkers = [worker for worker in self._idleWorkers if worker.mode == exceptMode];
+
+        for worker in stoppedWorkers:
+            worker.Stop();
+        return len(stoppedWorkers);
+
+    def _Acquire(self, mode: str) -> OmnizartWorker:
+        with self._lock:
+            #Idle workers may have crashed in the meantime
+            self._idleWorkers = [worker for worker in self._idleWorkers if worker.IsAlive()];
+            for worker in reversed(self._idleWorkers):
+                if worker.mode == mode:
+                    self._idleWorkers.remove(worker);
+                    return worker;
+
+        self._logger.info(f"Starting omnizart {mode} worker");
+        return OmnizartWorker(mode, WorkerPool._GetBackend());
+
+    def _Release(self, worker: OmnizartWorker) -> None:
+        reusable: bool = worker.IsAlive() and worker.jobCount < self._maxJobsPerWorker;
+        if not reusable:
+            self._logger.info(f"Replacing omnizart {worker.mode} worker after {worker.jobCount} job(s)");
+            worker.Stop();
+            #Started right away, so the next job doesn't wait for omnizart to load
+            worker = OmnizartWorker(worker.mode, WorkerPool._GetBackend());
+
+        evictedWorkers: List[OmnizartWorker] = [];
+        with self._lock:
+            self._idleWorkers.append(worker);
+            while len(self._idleWorkers) > self._maxIdleWorkers:
+                evictedWorkers.append(self._idleWorkers.pop(0));
+
+        for evictedWorker in evictedWorkers:
+            evictedWorker.Stop();
+
+    def Shutdown(self) -> None:
+        with self._lock:
+            idleWorkers: List[OmnizartWorker] = self._idleWorkers;
+            self._idleWorkers = [];
+
+        for worker in idleWorkers:
+            worker.Stop();
+
+#Every job (or each of its segments) holds one worker while it runs
+workerPool = WorkerPool(
+    max(CONST.MAX_CONCURRENT_JOBS, CONST.MAX_PARALLEL_SEGMENTS if CONST.SEGMENTED_TRANSCRIPTION else 0),
+    CONST.WORKER_MAX_JOBS, 
+    CreateLogger(__name__)
+);
+
+def GetWorkerPool() -> WorkerPool:
+    return workerPool;
@@ -1,8 +1,28 @@
 #from piccolo.conf.apps import AppRegistry
-from piccolo.engine.sqlite import SQLiteEngine
+from .database import PooledSQLiteEngine
+from .constants import CONST
 
 
-DB = SQLiteEngine(path='/data/db.sqlite')
+if CONST.DB_ENGINE == "postgres":
+    #asyncpg is only needed for postgres
+    from piccolo.engine.postgres import PostgresEngine
+
+    DB = PostgresEngine(config={
+        "host": CONST.POSTGRES_HOST,
+        "port": CONST.POSTGRES_PORT,
+        "database": CONST.POSTGRES_DATABASE,
+        "user": CONST.POSTGRES_USER,
+        "password": CONST.POSTGRES_PASSWORD
+    }, extensions=()) #No UUID columns, so "uuid-ossp" (which needs a superuser to create) isn't required
+elif CONST.DB_ENGINE == "sqlite":
+    DB = PooledSQLiteEngine(
+        path=CONST.SQLITE_PATH,
+        readConnectionCount=CONST.DB_READ_CONNECTIONS,
+        maxWriteBatchSize=CONST.DB_MAX_WRITE_BATCH_SIZE,
+        timeout=30 #seconds to wait for locks held by other processes
+    )
+else:
+    raise Exception(f"Unknown TRANSCRIBER_DB_ENGINE <{CONST.DB_ENGINE}>, expected 'sqlite' or 'postgres'")
 
 # A list of paths to piccolo apps
 # e.g. ['blog.piccolo_app']
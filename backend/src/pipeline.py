@@ -0,0 +1,112 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from enum import Enum, auto
+from logging import Logger
+from typing import List, Optional
+
+from .schemas import TOmnizartMode
+from .metrics import Span
+
+class ProcessExitStatus(Enum):
+    completed = auto(),
+    terminated = auto()
+
+#State handed from one stage to the next
+@dataclass
+class TPipelineContext:
+    srcFilePath: str
+    mode: TOmnizartMode
+    logger: Logger
+    #Set to cancel the pipeline, the running stage stops as soon as it can
+    cancelEvent: threading.Event
+    jobId: Optional[int] = None
+    sourceHash: Optional[str] = None
+
+    workDir: str = "" #ingest, removed once the pipeline is done
+    decodedFilePath: str = "" #decode
+    outputFilePath: str = "" #inference, checked by collect
+
+    #time.monotonic() by which the running stage has to finish, None when it has no timeout
+    deadline: Optional[float] = None
+
+    def GetSecondsUntilDeadline(self) -> Optional[float]:
+        return max(0, self.deadline - time.monotonic()) if not self.deadline is None else None;
+
+class StageTimeout(Exception):
+    pass;
+
+#An omnizart process was killed for its memory use (by resource_monitor or the kernel) or ran out of it
+class OutOfMemoryError(Exception):
+    pass;
+
+class PipelineStage(ABC):
+    #Also the stage label of transcriber_stage_duration_seconds
+    name: str = "";
+
+    #None or "0" for no timeout
+    def GetTimeoutSeconds(self) -> Optional[float]:
+        return None;
+
+    #Blocking, returns terminated once context.cancelEvent is set
+    @abstractmethod
+    def Run(self, context: TPipelineContext) -> ProcessExitStatus:
+        ...
+
+    #Called once the pipeline is done, whether or not it succeeded, for every stage that was started
+    def Cleanup(self, context: TPipelineContext) -> None:
+        pass;
+
+#Runs its stages in order on the calling thread until one is terminated or fails.
+#A stage that exceeds its timeout is cancelled through context.cancelEvent & fails with StageTimeout
+class TranscriptionPipeline:
+    def __init__(self, stages: List[PipelineStage]):
+        self._stages: List[PipelineStage] = stages;
+
+    def Run(self, context: TPipelineContext) -> ProcessExitStatus:
+        startedStages: List[PipelineStage] = [];
+        try:
+            for stage in self._stages:
+                if context.cancelEvent.is_set():
+                    return ProcessExitStatus.terminated;
+
+                startedStages.append(stage);
+                with Span(stage.name, context.mode, context.jobId):
+                    exitStatus: ProcessExitStatus = self._RunStage(stage, context);
+                if exitStatus == ProcessExitStatus.terminated:
+                    context.logger.info(f"pipeline terminated during <{stage.name}>");
+                    return ProcessExitStatus.terminated;
+
+            return ProcessExitStatus.completed;
+        finally:
+            for stage in reversed(startedStages):
+                try:
+                    stage.Cleanup(context);
+                except Exception as e:
+                    context.logger.error(f"Cleanup of <{stage.name}> failed: {e}");
+
+    @staticmethod
+    def _RunStage(stage: PipelineStage, context: TPipelineContext) -> ProcessExitStatus:
+        timeoutSeconds: Optional[float] = stage.GetTimeoutSeconds();
+        if timeoutSeconds is None or timeoutSeconds <= 0:
+            return stage.Run(context);
+
+        timedOut = threading.Event();
+        def Expire() -> None:
+            timedOut.set();
+            context.cancelEvent.set();
+
+        timer = threading.Timer(timeoutSeconds, Expire);
+        timer.daemon = True;
+        context.deadline = time.monotonic() + timeoutSeconds;
+        timer.start();
+        try:
+            exitStatus: ProcessExitStatus = stage.Run(context);
+        finally:
+            timer.cancel();
+            context.deadline = None;
+
+        if timedOut.is_set():
+            raise StageTimeout(f"<{stage.name}> did not finish within {timeoutSeconds:g}s");
+        return exitStatus;
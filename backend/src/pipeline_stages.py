@@ -0,0 +1,407 @@
+import os
+import shlex
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import math
+from abc import abstractmethod
+from logging import Logger
+from typing import Optional, List, Set, Dict
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_EXCEPTION
+
+from .pipeline import PipelineStage, TPipelineContext, ProcessExitStatus, OutOfMemoryError
+from .sound_util import SoundUtil, TWavSegment, TAudioFormat, TAudioInfo
+from .midi_util import MidiUtil, TMidiSegment
+from .util import GetFilenameWithoutExtension, ChangeExtension, GetPartialResultPath, RemovePartialResult
+from .schemas import TOmnizartMode, JobStatus, StatusName
+from .JobController import JobController
+from .job_events import GetJobEventBus
+from .omnizart_worker import GetWorkerPool
+from .constants import CONST
+from .metrics import Span, RecordChildUsage, MaxRssToBytes
+from .resource_monitor import GetResourceMonitor, LimitProcess
+
+mockDir: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock");
+
+#One lock per converted .wav path, held while that file is being decoded
+decodeLocksGuard = threading.Lock();
+decodeLocks: Dict[str, threading.Lock] = {};
+
+#Modes producing notes that can be stitched together when transcribed in segments
+segmentableModes: Set[TOmnizartMode] = set([
+    "music",
+    "drum",
+    "vocal"
+]);
+
+#Omnizart cannot handle files that are too short, shorter ones are padded with silence
+minDurationMilliseconds: int = 10000;
+
+#Decoded straight to the rate the models read, omnizart would otherwise resample again when loading.
+#Vocal mode separates the vocals (spleeter) from stereo input first
+defaultAudioFormat = TAudioFormat(44100, 1);
+modeAudioFormats: Dict[TOmnizartMode, TAudioFormat] = {
+    "music": TAudioFormat(44100, 1),
+    "drum": TAudioFormat(44100, 1),
+    "chord": TAudioFormat(44100, 1),
+    "vocal": TAudioFormat(44100, 2),
+    "vocal-contour": TAudioFormat(44100, 1)
+};
+
+#Anything shorter ends up as a single segment
+def ShouldSegment(mode: TOmnizartMode, durationSeconds: float) -> bool:
+    return CONST.SEGMENTED_TRANSCRIPTION and mode in segmentableModes and durationSeconds >= 1.5 * CONST.SEGMENT_SECONDS;
+
+#omnizart processes a job runs at once, for its memory estimate
+def EstimateProcessCount(mode: TOmnizartMode, audioDuration: Optional[float]) -> int:
+    if audioDuration is None or not ShouldSegment(mode, audioDuration):
+        return 1;
+    return min(CONST.MAX_PARALLEL_SEGMENTS, math.ceil(audioDuration / CONST.SEGMENT_SECONDS));
+
+#Creates the directory for omnizart's intermediate & output files
+class IngestStage(PipelineStage):
+    name = "ingest";
+
+    def Run(self, context: TPipelineContext) -> ProcessExitStatus:
+        if not os.path.isfile(context.srcFilePath):
+            raise Exception(f"Source file <{context.srcFilePath}> not found");
+
+        context.workDir = tempfile.mkdtemp(prefix="transcription-");
+        return ProcessExitStatus.completed;
+
+    def Cleanup(self, context: TPipelineContext) -> None:
+        if context.workDir != "":
+            shutil.rmtree(context.workDir, ignore_errors=True);
+
+#Decodes the upload to a .wav in the mode's format next to it, unless another job already did.
+#Uploads already in that format are used as they are. The .wav is removed along with the upload
+class DecodeStage(PipelineStage):
+    name = "decode";
+
+    def GetTimeoutSeconds(self) -> Optional[float]:
+        return CONST.DECODE_TIMEOUT_SECONDS;
+
+    def Run(self, context: TPipelineContext) -> ProcessExitStatus:
+        logger: Logger = context.logger;
+        targetFormat: TAudioFormat = modeAudioFormats.get(context.mode, defaultAudioFormat);
+        info: Optional[TAudioInfo] = SoundUtil.ProbeAudio(context.srcFilePath);
+        if not info is None:
+            logger.info(f"source: {info.container}/{info.codec}, {info.sampleRate}Hz, {info.channels} channel(s), {info.durationSeconds:.1f}s");
+            if SoundUtil.CanPassThrough(info, targetFormat, minDurationMilliseconds):
+                logger.info("source is already in the model's format, not converting");
+                context.decodedFilePath = context.srcFilePath;
+                return ProcessExitStatus.completed;
+
+        convertedWavFilePath: str = os.path.join(
+            os.path.dirname(context.srcFilePath),
+            f"{GetFilenameWithoutExtension(context.srcFilePath)}.decoded-{targetFormat.sampleRate}-{targetFormat.maxChannels}.wav"
+        );
+
+        #Shared by every job transcribing the same upload (e.g. one per mode in a batch)
+        with decodeLocksGuard:
+            decodeLock: threading.Lock = decodeLocks.setdefault(convertedWavFilePath, threading.Lock());
+
+        try:
+            with decodeLock:
+                if os.path.isfile(convertedWavFilePath):
+                    logger.info("reusing converted .wav");
+                else:
+                    logger.info("converting to .wav");
+                    #Written under a temporary name, so a partial file is never reused
+                    partialWavFilePath: str = f"{convertedWavFilePath}.{threading.get_ident()}.partial";
+                    try:
+                        SoundUtil.ConvertFileToWav(
+                            context.srcFilePath,
+                            partialWavFilePath,
+                            minDurationMilliseconds,
+                            targetFormat,
+                            info,
+                            context.GetSecondsUntilDeadline()
+                        );
+                        os.replace(partialWavFilePath, convertedWavFilePath);
+                    finally:
+                        if os.path.exists(partialWavFilePath):
+                            os.remove(partialWavFilePath);
+                    logger.info("conversion complete");
+        finally:
+            with decodeLocksGuard:
+                decodeLocks.pop(convertedWavFilePath, None);
+
+        context.decodedFilePath = convertedWavFilePath;
+        return ProcessExitStatus.completed;
+
+#Runs omnizart on the decoded .wav. Long recordings of segmentable modes are split into overlapping
+#windows that are transcribed in parallel & stitched back together (CONST.SEGMENTED_TRANSCRIPTION).
+#Subclasses decide where omnizart runs
+class InferenceStage(PipelineStage):
+    name = "inference";
+
+    def GetTimeoutSeconds(self) -> Optional[float]:
+        return CONST.INFERENCE_TIMEOUT_SECONDS;
+
+    def Run(self, context: TPipelineContext) -> ProcessExitStatus:
+        context.outputFilePath = os.path.join(
+            context.workDir,
+            f"{GetFilenameWithoutExtension(context.srcFilePath)}-{context.mode}.mid"
+        );
+
+        context.logger.info("starting transcription");
+        if ShouldSegment(context.mode, SoundUtil.GetWavDurationSeconds(context.decodedFilePath)):
+            return self._TranscribeSegmented(context);
+
+        if context.cancelEvent.is_set():
+            return ProcessExitStatus.terminated;
+        return self._TranscribeWhole(context.workDir, context.decodedFilePath, context.outputFilePath, context, context.cancelEvent);
+
+    def Cleanup(self, context: TPipelineContext) -> None:
+        if not context.jobId is None:
+            RemovePartialResult(context.jobId);
+
+    #Blocking, writes the MIDI file of "wavFilePath" to "outputPath"
+    @abstractmethod
+    def _TranscribeWhole(
+        self,
+        dir: str,
+        wavFilePath: str,
+        outputPath: str,
+        context: TPipelineContext,
+        cancelEvent: threading.Event) -> ProcessExitStatus:
+        ...
+
+    def _TranscribeSegmented(self, context: TPipelineContext) -> ProcessExitStatus:
+        segmentDir: str = os.path.join(context.workDir, "segments");
+        os.makedirs(segmentDir);
+        wavSegments: List[TWavSegment] = SoundUtil.SplitWav(
+            context.decodedFilePath,
+            segmentDir,
+            CONST.SEGMENT_SECONDS,
+            CONST.SEGMENT_OVERLAP_SECONDS
+        );
+        context.logger.info(f"transcribing {len(wavSegments)} segments");
+
+        #Set once the job is cancelled or any segment fails, so the remaining segments stop too
+        abortEvent = threading.Event();
+        segmentOutputPaths: List[str] = [os.path.join(segmentDir, ChangeExtension(segment.path, ".mid")) for segment in wavSegments];
+
+        #Each overlap is split down the middle, notes starting in either half belong to that half's segment
+        midiSegments: List[TMidiSegment] = [
+            TMidiSegment(
+                segmentOutputPaths[segmentNo],
+                segment.start,
+                0 if segmentNo == 0 else (segment.start + wavSegments[segmentNo - 1].end) / 2,
+                math.inf if segmentNo == len(wavSegments) - 1 else (wavSegments[segmentNo + 1].start + segment.end) / 2
+            )
+            for (segmentNo, segment) in enumerate(wavSegments)
+        ];
+        partialSegmentCount: int = 0;
+
+        with ThreadPoolExecutor(
+            max_workers=min(len(wavSegments), CONST.MAX_PARALLEL_SEGMENTS),
+            thread_name_prefix="transcription-segment"
+            ) as executor:
+
+            futures: List[Future] = [
+                executor.submit(self._TranscribeWhole, segmentDir, segment.path, segmentOutputPath, context, abortEvent)
+                for (segment, segmentOutputPath) in zip(wavSegments, segmentOutputPaths)
+            ];
+
+            pending: Set[Future] = set(futures);
+            while len(pending) > 0:
+                (done, pending) = wait(pending, timeout=0.05, return_when=FIRST_EXCEPTION);
+                if context.cancelEvent.is_set() or any(not future.exception() is None for future in done):
+                    abortEvent.set();
+                elif len(done) > 0:
+                    partialSegmentCount = self._UpdatePartialResult(context, futures, midiSegments, partialSegmentCount);
+
+        for future in futures:
+            if not future.exception() is None:
+                raise future.exception();
+
+        if context.cancelEvent.is_set() or any(future.result() == ProcessExitStatus.terminated for future in futures):
+            return ProcessExitStatus.terminated;
+
+        with Span("stitch", context.mode, context.jobId):
+            MidiUtil.Stitch(midiSegments, context.outputFilePath, CONST.SEGMENT_OVERLAP_SECONDS);
+        context.logger.info("segments stitched");
+
+        return ProcessExitStatus.completed;
+
+    #Stitches the segments transcribed so far, up to the first one still running, into the job's partial result.
+    #Returns the number of segments it holds, which only grows
+    @staticmethod
+    def _UpdatePartialResult(
+        context: TPipelineContext,
+        futures: List[Future],
+        midiSegments: List[TMidiSegment],
+        partialSegmentCount: int) -> int:
+
+        prefixCount: int = 0;
+        while (
+            prefixCount < len(futures) and
+            futures[prefixCount].done() and
+            futures[prefixCount].exception() is None and
+            futures[prefixCount].result() == ProcessExitStatus.completed
+        ):
+            prefixCount += 1;
+
+        #Once every segment is done, the final result is only moments away
+        if context.jobId is None or prefixCount <= partialSegmentCount or prefixCount == len(futures):
+            return partialSegmentCount;
+
+        partialResultPath: str = GetPartialResultPath(context.jobId);
+        try:
+            with Span("stitch-partial", context.mode, context.jobId):
+                os.makedirs(os.path.dirname(partialResultPath), exist_ok=True);
+                #Replaced at once, so readers never see a partly written file
+                MidiUtil.Stitch(midiSegments[:prefixCount], f"{partialResultPath}.tmp", CONST.SEGMENT_OVERLAP_SECONDS);
+                os.replace(f"{partialResultPath}.tmp", partialResultPath);
+        except Exception as e:
+            context.logger.error(f"Failed to write the partial result: {e}");
+            return partialSegmentCount;
+
+        context.logger.info(f"partial result up to {midiSegments[prefixCount - 1].ownedEnd:.1f}s ({prefixCount}/{len(futures)} segments)");
+        GetJobEventBus().Publish(context.jobId, "partial-result", StatusName(JobStatus.RUNNING));
+        return prefixCount;
+
+#Sends the job to a long-lived omnizart process that keeps its models loaded (see omnizart_worker)
+class WarmWorkerInferenceStage(InferenceStage):
+    def _TranscribeWhole(
+        self,
+        dir: str,
+        wavFilePath: str,
+        outputPath: str,
+        context: TPipelineContext,
+        cancelEvent: threading.Event) -> ProcessExitStatus:
+
+        context.logger.info(f"Sending <{wavFilePath}> to an omnizart {context.mode} worker");
+        completed: bool = GetWorkerPool().Transcribe(context.mode, wavFilePath, outputPath, cancelEvent, context.jobId);
+        if not completed:
+            context.logger.info("omnizart worker killed");
+            return ProcessExitStatus.terminated;
+
+        return ProcessExitStatus.completed;
+
+#Starts the omnizart CLI for every job (or segment)
+class CliInferenceStage(InferenceStage):
+    def _TranscribeWhole(
+        self,
+        dir: str,
+        wavFilePath: str,
+        outputPath: str,
+        context: TPipelineContext,
+        cancelEvent: threading.Event) -> ProcessExitStatus:
+
+        cmd: str = "";
+        processName: str = CliInferenceStage.GetProcessName(context.logger);
+
+        if context.mode == "vocal":
+            #Under vocal mode, the output file path argument ("-o") isn't accepted
+            #Output file will simply be the input filename with the extension changed to .mid,
+            #written to the working directory (set to "dir" below)
+            cmd = f'{processName} {context.mode} transcribe "{wavFilePath}"';
+        else:
+            cmd = f'{processName} {context.mode} transcribe -o "{outputPath}" "{wavFilePath}"';
+
+        cmdList: List[str] = shlex.split(cmd);
+        context.logger.info(f"Start command = {cmdList}")
+        transcriptionProcess = subprocess.Popen(
+            cmdList,
+            shell=False,
+            cwd=dir
+        );
+        LimitProcess(transcriptionProcess.pid);
+        with GetResourceMonitor().Tracking(context.jobId, transcriptionProcess.pid):
+            exitStatus = RunCancellableProcess(
+                transcriptionProcess,
+                cancelEvent,
+                0.05,
+                context.logger,
+                context.mode
+            )
+
+        if exitStatus == ProcessExitStatus.completed and context.mode == "vocal":
+            vocalOutputPath: str = os.path.join(dir, f"{GetFilenameWithoutExtension(wavFilePath)}.mid");
+            os.replace(vocalOutputPath, outputPath);
+
+        return exitStatus;
+
+    @staticmethod
+    def GetProcessName(logger: Logger) -> str:
+        if CONST.MOCK_OMNIZART == False:
+            return "omnizart"
+        elif CONST.MOCK_OMNIZART_ERROR:
+            logger.info("[MOCK] Using error mocking process");
+            return f'python "{os.path.join(mockDir, "omnizart_error_mock.py")}"';
+        else:
+            logger.info("[MOCK] Using mock process");
+            return f'python "{os.path.join(mockDir, "omnizart_mock.py")}"';
+
+#Fails early on missing or empty output, which omnizart produces for some inputs without reporting an error
+class CollectStage(PipelineStage):
+    name = "collect";
+
+    def Run(self, context: TPipelineContext) -> ProcessExitStatus:
+        if not os.path.isfile(context.outputFilePath) or os.path.getsize(context.outputFilePath) == 0:
+            raise Exception(f"omnizart produced no output for <{context.srcFilePath}>");
+
+        context.logger.info("Done");
+        return ProcessExitStatus.completed;
+
+#Saves the result in the result store & links it to the job
+class StoreResultStage(PipelineStage):
+    name = "persist";
+
+    def Run(self, context: TPipelineContext) -> ProcessExitStatus:
+        assert(not context.jobId is None);
+        context.logger.info(f"Job <{context.jobId}> completed, writing results");
+        JobController.CreateCompletedJob(
+            context.jobId,
+            os.path.basename(context.outputFilePath),
+            context.outputFilePath,
+            context.sourceHash,
+            context.mode
+        );
+        return ProcessExitStatus.completed;
+
+def RunCancellableProcess(
+    hProcess: subprocess.Popen,
+    cancelEvent: threading.Event, #Process is killed as soon as this is set
+    pollingIntervalSeconds: float, #How often the process is checked for completion
+    logger: Logger,
+    mode: Optional[TOmnizartMode] = None #When given, the CPU time & peak memory of the process are recorded for this mode
+    ) -> ProcessExitStatus:
+
+    #Reaped with wait4 instead of Popen.poll, which discards the child's resource usage
+    def ProcessDone() -> bool:
+        if not hProcess.returncode is None:
+            return True;
+
+        (pid, waitStatus, usage) = os.wait4(hProcess.pid, os.WNOHANG);
+        finished: bool = pid != 0;
+        if finished:
+            #Like os.waitstatus_to_exitcode, which needs python 3.9
+            hProcess.returncode = -os.WTERMSIG(waitStatus) if os.WIFSIGNALED(waitStatus) else os.WEXITSTATUS(waitStatus);
+            if not mode is None:
+                RecordChildUsage(mode, usage.ru_utime + usage.ru_stime, MaxRssToBytes(usage.ru_maxrss));
+        return finished;
+
+    while (not ProcessDone()):
+        shouldTerminate: bool = cancelEvent.wait(pollingIntervalSeconds);
+        if shouldTerminate:
+            logger.info(f"terminating subprocess: <{hProcess}>")
+            hProcess.terminate();
+            hProcess.wait();
+            logger.info(f"subprocess terminated: <{hProcess}>")
+            return ProcessExitStatus.terminated;
+
+    #Cancelled processes get SIGTERM, SIGKILL comes from the memory limit (see resource_monitor) or the kernel's OOM killer
+    if hProcess.returncode == -signal.SIGKILL:
+        raise OutOfMemoryError(f"Subprocess <{hProcess}> was killed, most likely for its memory use");
+
+    subProcessError: bool = hProcess.returncode != 0;
+    if subProcessError:
+        raise Exception(f"Error executing subprocess <{hProcess}>, returncode = {hProcess.returncode}");
+
+    return ProcessExitStatus.completed;
@@ -0,0 +1,272 @@
+import os
+import resource
+import signal
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from logging import Logger
+from typing import Dict, List, Optional, Iterator
+
+from .constants import CONST
+from .util import CreateLogger
+from .metrics import childRss, childCpuCores, memoryProjected, memoryBudget, memoryDeferrals, memoryLimitKills
+
+BYTES_PER_MB: int = 1024 * 1024;
+
+@dataclass
+class TProcessSample:
+    parentPid: int
+    rssBytes: int
+    cpuSeconds: float #user + system
+
+#Memory & CPU of the omnizart processes a running job holds
+@dataclass
+class TJobUsage:
+    mode: str
+    reservedBytes: int
+    #CPU seconds of each process of the job at the previous sample, None until it was sampled once.
+    #Warm workers carry over the CPU time of their past jobs
+    lastCpuSeconds: Dict[int, Optional[float]] = field(default_factory=dict)
+    rssBytes: int = 0
+    #Largest single process, what the memory estimate of the mode is learned from
+    peakProcessRssBytes: int = 0
+    cpuSeconds: float = 0
+
+#Reads /proc/<pid>/stat of every process, empty where there is no /proc
+def _SampleProcesses() -> Dict[int, TProcessSample]:
+    pageSize: int = os.sysconf("SC_PAGE_SIZE");
+    clockTicks: int = os.sysconf("SC_CLK_TCK");
+    samples: Dict[int, TProcessSample] = {};
+    try:
+        pids: List[int] = [int(name) for name in os.listdir("/proc") if name.isdigit()];
+    except OSError:
+        return samples;
+
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as statFile:
+                stat: bytes = statFile.read();
+        except OSError:
+            #Exited in the meantime
+            continue;
+
+        #The command name may contain spaces & parentheses, the fields after it start with the state (3rd field)
+        fields: List[bytes] = stat[stat.rindex(b")") + 2:].split();
+        samples[pid] = TProcessSample(
+            parentPid=int(fields[1]),
+            rssBytes=int(fields[21]) * pageSize,
+            cpuSeconds=(int(fields[11]) + int(fields[12])) / clockTicks
+        );
+    return samples;
+
+#Processes started by "rootPid" & by its children, not including "rootPid"
+def _GetDescendants(rootPid: int, samples: Dict[int, TProcessSample]) -> List[int]:
+    children: Dict[int, List[int]] = {};
+    for (pid, sample) in samples.items():
+        children.setdefault(sample.parentPid, []).append(pid);
+
+    descendants: List[int] = [];
+    pending: List[int] = [rootPid];
+    while len(pending) > 0:
+        for childPid in children.get(pending.pop(), []):
+            descendants.append(childPid);
+            pending.append(childPid);
+    return descendants;
+
+def _GetDefaultBudgetBytes() -> int:
+    availableBytes: int = os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE");
+    #cgroup v2 limit of the container, "max" when there is none
+    try:
+        with open("/sys/fs/cgroup/memory.max") as limitFile:
+            limit: str = limitFile.read().strip();
+        if limit.isdigit():
+            availableBytes = min(availableBytes, int(limit));
+    except OSError:
+        pass;
+    return int(availableBytes * CONST.MEMORY_BUDGET_FRACTION);
+
+#Applies CONST.PROCESS_ADDRESS_SPACE_LIMIT_MB to a started omnizart process,
+#from the parent as preexec_fn isn't safe with the scheduler's threads around
+def LimitProcess(pid: int) -> None:
+    if CONST.PROCESS_ADDRESS_SPACE_LIMIT_MB > 0:
+        limitBytes: int = CONST.PROCESS_ADDRESS_SPACE_LIMIT_MB * BYTES_PER_MB;
+        resource.prlimit(pid, resource.RLIMIT_AS, (limitBytes, limitBytes));
+
+#Keeps the jobs that run at once within CONST.MEMORY_BUDGET_MB.
+#Every running job reserves the peak memory its mode is expected to need, which counts until the job
+#actually uses more. Idle warm workers count with what they use. The omnizart processes are sampled
+#from /proc, the ones exceeding CONST.PROCESS_MEMORY_LIMIT_MB are killed, like a cgroup's memory.max would.
+#Lives where the jobs run (the executor, or each server process without one)
+class ResourceMonitor:
+    def __init__(self, budgetBytes: int, processLimitBytes: int, logger: Logger):
+        self._budgetBytes: int = budgetBytes;
+        self._processLimitBytes: int = processLimitBytes;
+        self._logger: Logger = logger;
+
+        self._lock = threading.Lock();
+        #Notified when a job releases its memory & after every sample
+        self._changed = threading.Condition(self._lock);
+        self._jobs: Dict[int, TJobUsage] = {};
+        self._idleRssBytes: int = 0;
+        #Latest RSS of each omnizart process, including its own children
+        self._processRssBytes: Dict[int, int] = {};
+        self._learnedProcessBytes: Dict[str, float] = {};
+
+        self._stopping = threading.Event();
+        self._sampler: Optional[threading.Thread] = None;
+
+    def Start(self) -> None:
+        memoryBudget.Set(self._budgetBytes);
+        self._logger.info(f"Memory budget {self._budgetBytes // BYTES_PER_MB}MB");
+        if not os.path.isdir("/proc"):
+            self._logger.warning("No /proc, memory is only accounted by estimate & the memory limit is not enforced");
+            return;
+
+        self._stopping.clear();
+        self._sampler = threading.Thread(target=self._SampleLoop, name="resource-sampler", daemon=True);
+        self._sampler.start();
+
+    def Stop(self) -> None:
+        self._stopping.set();
+        self._sampler = None;
+
+    #Peak memory of one omnizart process of "mode"
+    def EstimateProcessBytes(self, mode: str) -> int:
+        with self._lock:
+            learnedBytes: Optional[float] = self._learnedProcessBytes.get(mode);
+        if not learnedBytes is None:
+            return int(learnedBytes);
+        return CONST.DEFAULT_PROCESS_MEMORY_MB.get(mode, max(CONST.DEFAULT_PROCESS_MEMORY_MB.values())) * BYTES_PER_MB;
+
+    #Whether a job needing "requiredBytes" can start now. A job is always let in while nothing runs,
+    #it would never start otherwise. "reusablePids" are idle workers the job will run in, their memory is already counted
+    def Fits(self, mode: str, requiredBytes: int, reusablePids: List[int] = []) -> bool:
+        with self._lock:
+            if len(self._jobs) == 0:
+                return True;
+
+            reusableBytes: int = sum(self._processRssBytes.get(pid, 0) for pid in reusablePids);
+            fits: bool = self._GetProjectedBytes() - reusableBytes + requiredBytes <= self._budgetBytes;
+
+        if not fits:
+            memoryDeferrals.Inc(mode);
+        return fits;
+
+    #Blocks until a job releases its memory or the next sample was taken, at most "timeoutSeconds"
+    def WaitForChange(self, timeoutSeconds: float) -> None:
+        with self._changed:
+            self._changed.wait(timeoutSeconds);
+
+    def Reserve(self, jobId: int, mode: str, requiredBytes: int) -> None:
+        with self._lock:
+            self._jobs[jobId] = TJobUsage(mode, requiredBytes);
+            memoryProjected.Set(self._GetProjectedBytes());
+
+    def Release(self, jobId: int) -> None:
+        with self._changed:
+            usage: Optional[TJobUsage] = self._jobs.pop(jobId, None);
+            if not usage is None and usage.peakProcessRssBytes > 0:
+                self._Learn(usage.mode, usage.peakProcessRssBytes);
+            memoryProjected.Set(self._GetProjectedBytes());
+            self._changed.notify_all();
+
+        if not usage is None and usage.peakProcessRssBytes > 0:
+            self._logger.info(
+                f"Job <{jobId}> used up to {usage.peakProcessRssBytes // BYTES_PER_MB}MB per process "
+                f"& {usage.cpuSeconds:.1f} CPU seconds"
+            );
+
+    #Accounts the memory & CPU of "pid" (and of its children) to the job while it runs the job's work
+    @contextmanager
+    def Tracking(self, jobId: Optional[int], pid: int) -> Iterator[None]:
+        with self._lock:
+            usage: Optional[TJobUsage] = self._jobs.get(jobId) if not jobId is None else None;
+            if not usage is None:
+                usage.lastCpuSeconds[pid] = None;
+        try:
+            yield;
+        finally:
+            with self._lock:
+                if not usage is None:
+                    usage.lastCpuSeconds.pop(pid, None);
+
+    def _Learn(self, mode: str, peakBytes: int) -> None:
+        learnedBytes: Optional[float] = self._learnedProcessBytes.get(mode);
+        if learnedBytes is None or peakBytes > learnedBytes:
+            self._learnedProcessBytes[mode] = peakBytes;
+        else:
+            self._learnedProcessBytes[mode] = learnedBytes + CONST.MEMORY_ESTIMATE_SMOOTHING * (peakBytes - learnedBytes);
+
+    def _GetProjectedBytes(self) -> int:
+        return sum(max(usage.reservedBytes, usage.rssBytes) for usage in self._jobs.values()) + self._idleRssBytes;
+
+    def _SampleLoop(self) -> None:
+        while not self._stopping.wait(CONST.RESOURCE_SAMPLE_SECONDS):
+            try:
+                self._Sample();
+            except Exception as e:
+                self._logger.error(f"Failed to sample the omnizart processes: {e}");
+
+    def _Sample(self) -> None:
+        samples: Dict[int, TProcessSample] = _SampleProcesses();
+        #Direct children are omnizart processes (warm workers or CLI runs) or multiprocessing's helpers
+        processRssBytes: Dict[int, int] = {};
+        processCpuSeconds: Dict[int, float] = {};
+        for pid in _GetDescendants(os.getpid(), samples):
+            if samples[pid].parentPid != os.getpid():
+                continue;
+            tree: List[int] = [pid] + _GetDescendants(pid, samples);
+            processRssBytes[pid] = sum(samples[treePid].rssBytes for treePid in tree);
+            processCpuSeconds[pid] = sum(samples[treePid].cpuSeconds for treePid in tree);
+
+        overLimit: List[TJobUsage] = [];
+        overLimitPids: List[int] = [];
+        with self._changed:
+            trackedRssBytes: int = 0;
+            cpuSecondsUsed: float = 0;
+            for usage in self._jobs.values():
+                usage.rssBytes = 0;
+                for (pid, lastCpuSeconds) in list(usage.lastCpuSeconds.items()):
+                    if not pid in processRssBytes:
+                        continue;
+                    usage.rssBytes += processRssBytes[pid];
+                    usage.peakProcessRssBytes = max(usage.peakProcessRssBytes, processRssBytes[pid]);
+                    if not lastCpuSeconds is None:
+                        usage.cpuSeconds += processCpuSeconds[pid] - lastCpuSeconds;
+                        cpuSecondsUsed += processCpuSeconds[pid] - lastCpuSeconds;
+                    usage.lastCpuSeconds[pid] = processCpuSeconds[pid];
+
+                    if self._processLimitBytes > 0 and processRssBytes[pid] > self._processLimitBytes:
+                        overLimit.append(usage);
+                        overLimitPids.append(pid);
+                trackedRssBytes += usage.rssBytes;
+
+            self._processRssBytes = processRssBytes;
+            self._idleRssBytes = max(0, sum(processRssBytes.values()) - trackedRssBytes);
+            memoryProjected.Set(self._GetProjectedBytes());
+            self._changed.notify_all();
+
+        childRss.Set(trackedRssBytes, "running");
+        childRss.Set(self._idleRssBytes, "idle");
+        childCpuCores.Set(cpuSecondsUsed / CONST.RESOURCE_SAMPLE_SECONDS);
+
+        #Their job sees the process die from SIGKILL & ends as OOM_KILLED
+        for (usage, pid) in zip(overLimit, overLimitPids):
+            self._logger.warning(
+                f"omnizart {usage.mode} process <{pid}> uses {processRssBytes[pid] // BYTES_PER_MB}MB, "
+                f"over the {self._processLimitBytes // BYTES_PER_MB}MB limit, killing it"
+            );
+            memoryLimitKills.Inc(usage.mode);
+            try:
+                os.kill(pid, signal.SIGKILL);
+            except ProcessLookupError:
+                pass;
+
+resourceMonitor = ResourceMonitor(
+    CONST.MEMORY_BUDGET_MB * BYTES_PER_MB if CONST.MEMORY_BUDGET_MB > 0 else _GetDefaultBudgetBytes(),
+    CONST.PROCESS_MEMORY_LIMIT_MB * BYTES_PER_MB,
+    CreateLogger(__name__)
+);
+
+def GetResourceMonitor() -> ResourceMonitor:
+    return resourceMonitor;
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+from logging import Logger
+from typing import Optional, Dict, Any, List
+
+from .schemas import CompletedJob, ResponseCacheStats, TOmnizartMode
+from .util import CreateLogger, GetOmnizartVersion
+from .constants import CONST
+from .database import RunSync
+
+#Maps (upload sha256, mode, omnizart version) to an existing CompletedJob.
+#Evicting an entry only clears its cache key, jobs already linked to the result can still download it.
+class ResultCache:
+    def __init__(self, maxBytes: int, maxAge: timedelta, logger: Logger):
+        self._maxBytes: int = maxBytes;
+        self._maxAge: timedelta = maxAge;
+        self._logger: Logger = logger;
+
+        self._hits: int = 0;
+        self._misses: int = 0;
+
+    #returns the id of the CompletedJob holding the cached result
+    async def LookupAsync(self, sourceHash: str, mode: TOmnizartMode) -> Optional[int]:
+        entry: Optional[Dict[str, Any]] = await CompletedJob.select(
+            CompletedJob.id
+        ).where(
+            (CompletedJob.source_hash == sourceHash) &
+            (CompletedJob.mode == mode) &
+            (CompletedJob.omnizart_version == GetOmnizartVersion())
+        ).order_by(
+            CompletedJob.id, ascending=False
+        ).first();
+
+        if entry is None:
+            self._misses += 1;
+            return None;
+
+        self._hits += 1;
+        await CompletedJob.update({
+            CompletedJob.last_used: datetime.now()
+        }).where(
+            CompletedJob.id == entry["id"]
+        );
+
+        self._logger.info(f"Cache hit, hash <{sourceHash}> mode <{mode}> -> CompletedJob <{entry['id']}>");
+        return entry["id"];
+
+    #Blocking, called by the scheduler's worker threads after new results are stored
+    def Evict(self) -> None:
+        expiry: datetime = datetime.now() - self._maxAge;
+        RunSync(CompletedJob.update({
+            CompletedJob.source_hash: None
+        }).where(
+            CompletedJob.source_hash.is_not_null() &
+            (CompletedJob.last_used < expiry)
+        ));
+
+        entries: List[Dict[str, Any]] = RunSync(CompletedJob.select(
+            CompletedJob.id, 
+            CompletedJob.size
+        ).where(
+            CompletedJob.source_hash.is_not_null()
+        ).order_by(
+            CompletedJob.last_used, ascending=False
+        ));
+
+        cachedBytes: int = 0;
+        evictedIds: List[int] = [];
+        for entry in entries:
+            cachedBytes += entry["size"];
+            if cachedBytes > self._maxBytes:
+                evictedIds.append(entry["id"]);
+
+        if len(evictedIds) > 0:
+            self._logger.info(f"Evicting {len(evictedIds)} cache entries");
+            RunSync(CompletedJob.update({
+                CompletedJob.source_hash: None
+            }).where(
+                CompletedJob.id.is_in(evictedIds)
+            ));
+
+    async def GetStatsAsync(self) -> ResponseCacheStats:
+        totals: List[Dict[str, Any]] = await CompletedJob.raw(
+            "SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS size FROM completed_job WHERE source_hash IS NOT NULL"
+        );
+
+        return ResponseCacheStats(
+            hits=self._hits,
+            misses=self._misses,
+            entries=totals[0]["entries"],
+            size=totals[0]["size"]
+        );
+
+resultCache = ResultCache(
+    CONST.RESULT_CACHE_MAX_BYTES, 
+    timedelta(days=CONST.RESULT_CACHE_MAX_AGE_DAYS),
+    CreateLogger(__name__)
+);
+
+def GetResultCache() -> ResultCache:
+    return resultCache;
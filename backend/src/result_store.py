@@ -0,0 +1,124 @@
+import os
+import hashlib
+import tempfile
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Optional, Iterator
+
+from .constants import CONST
+
+@dataclass
+class TStoredResult:
+    location: str #Store specific, saved in CompletedJob.result_path
+    sha256: str
+    size: int
+
+@dataclass
+class TStoredFile:
+    location: str
+    size: int
+    modifiedTime: float #seconds since the epoch
+
+#Storage for transcription results, the DB only keeps each result's location, hash & size
+class ResultStore(ABC):
+    #Streams the file into the store, the source file is left untouched
+    @abstractmethod
+    def PutFile(self, srcFilePath: str) -> TStoredResult:
+        ...
+
+    def Put(self, contents: bytes) -> TStoredResult:
+        with tempfile.NamedTemporaryFile() as hTempFile:
+            hTempFile.write(contents);
+            hTempFile.flush();
+            return self.PutFile(hTempFile.name);
+
+    #Path that can be streamed to clients
+    @abstractmethod
+    def GetLocalPath(self, location: str) -> str:
+        ...
+
+    @abstractmethod
+    def Delete(self, location: str) -> None:
+        ...
+
+    #None if nothing is stored at "location"
+    @abstractmethod
+    def Stat(self, location: str) -> Optional[TStoredFile]:
+        ...
+
+    #Everything in the store, including leftovers of interrupted writes
+    @abstractmethod
+    def ListFiles(self) -> Iterator[TStoredFile]:
+        ...
+
+#Results are stored under their sha256, identical results share one file
+class LocalResultStore(ResultStore):
+    def __init__(self, rootDir: str):
+        self._rootDir: str = rootDir;
+
+    def _GetRelativePath(self, sha256: str) -> str:
+        return os.path.join(sha256[0:2], sha256[2:4], sha256);
+
+    def PutFile(self, srcFilePath: str) -> TStoredResult:
+        os.makedirs(self._rootDir, exist_ok=True);
+
+        hasher = hashlib.sha256();
+        size: int = 0;
+        #Written next to the final location so the rename below stays on one filesystem
+        hTempFile = tempfile.NamedTemporaryFile(dir=self._rootDir, delete=False);
+        try:
+            with hTempFile, open(srcFilePath, "rb") as hSrcFile:
+                while True:
+                    chunk: bytes = hSrcFile.read(CONST.FILE_CHUNK_SIZE);
+                    if len(chunk) == 0:
+                        break;
+                    hasher.update(chunk);
+                    hTempFile.write(chunk);
+                    size += len(chunk);
+
+            sha256: str = hasher.hexdigest();
+            location: str = self._GetRelativePath(sha256);
+            destPath: str = self.GetLocalPath(location);
+            os.makedirs(os.path.dirname(destPath), exist_ok=True);
+            os.replace(hTempFile.name, destPath);
+
+            return TStoredResult(location, sha256, size);
+        finally:
+            if os.path.exists(hTempFile.name):
+                os.remove(hTempFile.name);
+
+    def GetLocalPath(self, location: str) -> str:
+        return os.path.join(self._rootDir, location);
+
+    def Delete(self, location: str) -> None:
+        try:
+            os.remove(self.GetLocalPath(location));
+        except FileNotFoundError:
+            pass;
+
+    def Stat(self, location: str) -> Optional[TStoredFile]:
+        try:
+            stat: os.stat_result = os.stat(self.GetLocalPath(location));
+        except FileNotFoundError:
+            return None;
+        return TStoredFile(location, stat.st_size, stat.st_mtime);
+
+    def ListFiles(self) -> Iterator[TStoredFile]:
+        for (dirPath, _, filenames) in os.walk(self._rootDir):
+            for filename in filenames:
+                storedFile: Optional[TStoredFile] = self.Stat(
+                    os.path.relpath(os.path.join(dirPath, filename), self._rootDir)
+                );
+                if not storedFile is None:
+                    yield storedFile;
+
+def _CreateResultStore() -> ResultStore:
+    if CONST.RESULT_STORE == "local":
+        return LocalResultStore(CONST.RESULT_STORE_DIR);
+    else:
+        raise ValueError(f"Unknown result store <{CONST.RESULT_STORE}>");
+
+resultStore: ResultStore = _CreateResultStore();
+
+def GetResultStore() -> ResultStore:
+    return resultStore;
@@ -1,8 +1,8 @@
 from piccolo.table import Table
 import piccolo.columns 
 from enum import auto, Enum
-from dataclasses import dataclass
-from typing import Literal, Optional, Dict, Any
+from dataclasses import dataclass, fields
+from typing import Literal, Optional, Dict, Any, List, Callable, Tuple
 from datetime import datetime
 
 TOmnizartMode = Literal["music", "drum", "chord", "vocal", "vocal-contour"]
@@ -10,6 +10,7 @@ TOmnizartMode = Literal["music", "drum", "chord", "vocal", "vocal-contour"]
 ##DB schemas
 class JobStatus(Enum):
     NONE = auto()
+    QUEUED = auto()
     RUNNING = auto()
     DONE = auto()
 
@@ -17,41 +18,185 @@ class JobStatus(Enum):
     TERMINATED = auto()
 
     ERROR = auto()
+    #An omnizart process of the job was killed for using too much memory (see resource_monitor)
+    OOM_KILLED = auto()
 
 def StatusName(status: JobStatus) -> str:
     return status.name;
 
-def IsJobDone(status: str) -> bool:
-    return status in [
+def FinishedStatusNames() -> List[str]:
+    return [
         StatusName(JobStatus.DONE), 
         StatusName(JobStatus.TERMINATED), 
-        StatusName(JobStatus.ERROR)
+        StatusName(JobStatus.ERROR),
+        StatusName(JobStatus.OOM_KILLED)
+    ]
+
+#Jobs that count towards a client's CONST.MAX_ACTIVE_JOBS_PER_CLIENT
+def ActiveStatusNames() -> List[str]:
+    return [
+        StatusName(JobStatus.NONE),
+        StatusName(JobStatus.QUEUED),
+        StatusName(JobStatus.RUNNING),
+        StatusName(JobStatus.STOPPING)
     ]
 
+def IsJobDone(status: str) -> bool:
+    return status in FinishedStatusNames()
+
 class CompletedJob(Table):
     filename = piccolo.columns.Text()
+    #Only populated by older versions, results now live in the result store (see MigrateResultBlobs)
     blob = piccolo.columns.Bytea()
+    result_path = piccolo.columns.Text(null=True, default=None)
+    result_hash = piccolo.columns.Text(null=True, default=None)
+
+    #Result cache key, cleared when the entry is evicted from the cache
+    source_hash = piccolo.columns.Text(null=True, default=None, index=True)
+    mode = piccolo.columns.Text(null=True, default=None)
+    omnizart_version = piccolo.columns.Text(null=True, default=None)
+
+    size = piccolo.columns.Integer(default=0)
+    created_at = piccolo.columns.Timestamp(null=True, default=None)
+    last_used = piccolo.columns.Timestamp(null=True, default=None)
+
+#Groups the jobs created by one batch upload, one per (input file, mode)
+class BatchJob(Table):
+    start_time = piccolo.columns.Timestamp()
+    modes = piccolo.columns.Text() #comma separated
+    input_count = piccolo.columns.Integer()
 
 class TranscriptionJob(Table):
-    filename = piccolo.columns.Text()
+    filename = piccolo.columns.Text(index=True)
     mode = piccolo.columns.Text()
-    start_time = piccolo.columns.Timestamp()
+    start_time = piccolo.columns.Timestamp(index=True)
     end_time = piccolo.columns.Timestamp(null=True)
 
     request_terminate = piccolo.columns.Boolean()
-    status = piccolo.columns.Text()
+    status = piccolo.columns.Text(index=True)
 
     msg = piccolo.columns.Text()
 
     completed_job = piccolo.columns.ForeignKey(references=CompletedJob, null=True)
 
+    #Higher priority jobs are dequeued first, ties are resolved in FIFO order
+    priority = piccolo.columns.Integer(default=0)
+    #Uploaded file awaiting transcription, removed once the job finishes
+    source_path = piccolo.columns.Text(null=True, default=None)
+    #sha256 of the uploaded file, used as the result cache key
+    source_hash = piccolo.columns.Text(null=True, default=None)
+
+    batch_job = piccolo.columns.ForeignKey(references=BatchJob, null=True)
 
-def CreateAllTables() -> None:
-    CompletedJob.create_table(if_not_exists=True).run_sync();
-    TranscriptionJob.create_table(if_not_exists=True).run_sync();
+    #CONST.NODE_ID of the node that received or claimed the job
+    node = piccolo.columns.Text(null=True, default=None, index=True)
+
+    #Probed at upload, None if the file couldn't be probed
+    audio_duration = piccolo.columns.Real(null=True, default=None) #seconds
+    source_size = piccolo.columns.BigInt(null=True, default=None) #bytes
+    #Queued jobs are claimed in ascending order of this key within a priority, see throughput.ComputeScheduleKey
+    schedule_key = piccolo.columns.DoublePrecision(null=True, default=None)
+    #When a worker claimed the job, "start_time" is the submission time
+    run_start_time = piccolo.columns.Timestamp(null=True, default=None)
+
+    #API key or IP address the job was submitted from, see admission.GetClientId
+    client_id = piccolo.columns.Text(null=True, default=None, index=True)
+
+#Columns needed to estimate a job's progress, see throughput.QueueForecast
+ESTIMATE_COLUMN_NAMES: List[str] = ["id", "status", "mode", "audio_duration", "source_size", "run_start_time"];
+
+#Migrations already applied to the DB, see migrations.py
+class SchemaMigration(Table):
+    name = piccolo.columns.Text(unique=True)
+    applied_at = piccolo.columns.Timestamp()
 
 ##Response bodies
 
+@dataclass
+class JobEvent:
+    event_id: int
+    type: str #"status", "result", "partial-result", "terminate-requested" or "resync"
+    job_id: Optional[int]
+    status: Optional[str]
+    done: bool
+    time: datetime
+
+@dataclass
+class ResponseScheduledBatch:
+    id: int
+    job_ids: List[int]
+
+@dataclass
+class ResponseBatchStatus:
+    id: int
+    modes: List[str]
+    input_count: int
+
+    total: int
+    finished: int
+    succeeded: int
+    failed: int
+    progress: float #fraction of jobs finished, 0 to 1
+    done: bool
+    eta_seconds: Optional[float] #until the last job is expected to finish, None if any of them can't be estimated
+
+    jobs: List["ResponseTranscriptionJob"]
+
+    #"estimates" holds the (progress, eta_seconds) of each job
+    @staticmethod
+    def FromBatchJobDBO(
+        batch: Dict[str, Any], 
+        jobs: List[Dict[str, Any]], 
+        estimates: List[Tuple[Optional[float], Optional[float]]]) -> "ResponseBatchStatus":
+
+        finished: int = sum(1 for job in jobs if IsJobDone(job["status"]));
+        succeeded: int = sum(1 for job in jobs if job["status"] == StatusName(JobStatus.DONE));
+        etaSeconds: List[Optional[float]] = [
+            eta for (job, (_, eta)) in zip(jobs, estimates) if not IsJobDone(job["status"])
+        ];
+
+        return ResponseBatchStatus(
+            id=batch["id"],
+            modes=batch["modes"].split(","),
+            input_count=batch["input_count"],
+            total=len(jobs),
+            finished=finished,
+            succeeded=succeeded,
+            failed=finished - succeeded,
+            progress=finished / len(jobs) if len(jobs) > 0 else 1.0,
+            done=finished == len(jobs),
+            eta_seconds=max(etaSeconds, default=0) if not None in etaSeconds else None,
+            jobs=[
+                ResponseTranscriptionJob.FromTranscriptionJobDBO(job, *estimate) 
+                for (job, estimate) in zip(jobs, estimates)
+            ]
+        );
+
+@dataclass
+class ResponseCacheStats:
+    hits: int
+    misses: int
+    entries: int
+    size: int
+
+@dataclass
+class ResponseMaintenanceStats:
+    runs: int
+    last_run_time: Optional[datetime]
+    last_run_seconds: Optional[float]
+    deleted_jobs: int
+    deleted_batches: int
+    deleted_results: int
+    deleted_files: int
+    #Note arrays & previews of deleted results
+    deleted_derived: int
+    reclaimed_db_bytes: int
+    reclaimed_result_bytes: int
+    reclaimed_derived_bytes: int
+    #sqlite only
+    db_size: Optional[int]
+    db_free: Optional[int]
+
 @dataclass 
 class ResponseScheduledJob:
     id: int
@@ -72,8 +217,16 @@ class ResponseTranscriptionJob:
 
     done: bool
 
+    audio_duration: Optional[float] #seconds, None if the upload couldn't be probed
+    progress: Optional[float] #0 to 1, estimated while the job runs
+    eta_seconds: Optional[float] #estimated time until the job finishes, includes the wait in the queue
+
     @staticmethod
-    def FromTranscriptionJobDBO(job:Dict[str, Any]) -> "ResponseTranscriptionJob": 
+    def FromTranscriptionJobDBO(
+        job: Dict[str, Any], 
+        progress: Optional[float] = None, 
+        etaSeconds: Optional[float] = None) -> "ResponseTranscriptionJob": 
+
         return ResponseTranscriptionJob(
             id=job["id"],
             filename=job["filename"],
@@ -83,7 +236,41 @@ class ResponseTranscriptionJob:
             request_terminate=job["request_terminate"],
             status=job["status"],
             msg=job["msg"],
-            done=IsJobDone(job["status"])
+            done=IsJobDone(job["status"]),
+            audio_duration=job["audio_duration"],
+            progress=progress,
+            eta_seconds=etaSeconds
         );
 
-    
\ No newline at end of file
+    @staticmethod
+    def FieldNames() -> List[str]:
+        return [field.name for field in fields(ResponseTranscriptionJob)];
+
+    #DB columns needed by each field that isn't a column itself
+    @staticmethod
+    def DerivedFieldColumnNames() -> Dict[str, List[str]]:
+        return {
+            "done": ["status"],
+            "progress": ESTIMATE_COLUMN_NAMES,
+            "eta_seconds": ESTIMATE_COLUMN_NAMES
+        };
+
+    #Only "fieldNames" are included, the job only needs to contain the matching DB columns
+    #(see DerivedFieldColumnNames)
+    @staticmethod
+    def ProjectionFromTranscriptionJobDBO(
+        job: Dict[str, Any], 
+        fieldNames: List[str],
+        progress: Optional[float] = None,
+        etaSeconds: Optional[float] = None) -> Dict[str, Any]:
+
+        derivedFields: Dict[str, Callable[[], Any]] = {
+            "done": lambda: IsJobDone(job["status"]),
+            "progress": lambda: progress,
+            "eta_seconds": lambda: etaSeconds
+        };
+        return {
+            fieldName: 
+            derivedFields[fieldName]() if fieldName in derivedFields else job[fieldName]
+            for fieldName in fieldNames
+        };
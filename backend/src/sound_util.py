@@ -1,20 +1,205 @@
-from typing import Final
+from typing import Final, List, Optional, Dict, Any
+from dataclasses import dataclass
+from functools import lru_cache
+import os
+import json
+import shutil
+import subprocess
+import wave
 from pydub import AudioSegment
 
+@dataclass
+class TWavSegment:
+    path: str
+    start: float #seconds
+    end: float #seconds
+
+#What a transcription mode's model reads, inputs with more channels are downmixed
+@dataclass
+class TAudioFormat:
+    sampleRate: int
+    maxChannels: int
+
+@dataclass
+class TAudioInfo:
+    container: str #i.e. "wav", "flac", "mp3" (ffprobe's format name)
+    codec: str #i.e. "pcm_s16le"
+    sampleRate: int
+    channels: int
+    durationSeconds: float
+
 class SoundUtil:
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def IsFfmpegAvailable() -> bool:
+        return not shutil.which("ffmpeg") is None and not shutil.which("ffprobe") is None;
+
+    #Reads the format & duration without decoding, None if the file isn't recognised as audio
+    @staticmethod
+    def ProbeAudio(filename: str) -> Optional[TAudioInfo]:
+        try:
+            #16 bit PCM .wav files (the common case) are read from their header, no process needed
+            with wave.open(filename, "rb") as hFile:
+                if hFile.getsampwidth() == 2:
+                    return TAudioInfo(
+                        "wav",
+                        "pcm_s16le",
+                        hFile.getframerate(),
+                        hFile.getnchannels(),
+                        hFile.getnframes() / hFile.getframerate()
+                    );
+        except (wave.Error, EOFError):
+            pass;
+
+        if not SoundUtil.IsFfmpegAvailable():
+            return None;
+
+        completedProcess = subprocess.run(
+            [
+                "ffprobe", "-v", "error",
+                "-select_streams", "a:0",
+                "-show_entries", "stream=codec_name,sample_rate,channels,duration:format=format_name,duration",
+                "-of", "json",
+                filename
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        );
+        if completedProcess.returncode != 0:
+            return None;
+
+        probed: Dict[str, Any] = json.loads(completedProcess.stdout);
+        streams: List[Dict[str, Any]] = probed.get("streams", []);
+        if len(streams) == 0:
+            return None;
+
+        stream: Dict[str, Any] = streams[0];
+        containerInfo: Dict[str, Any] = probed.get("format", {});
+        duration: Optional[str] = stream.get("duration") or containerInfo.get("duration");
+        return TAudioInfo(
+            containerInfo.get("format_name", ""),
+            stream.get("codec_name", ""),
+            int(stream.get("sample_rate", 0)),
+            int(stream.get("channels", 0)),
+            float(duration) if not duration is None else 0
+        );
+
+    #16 bit PCM .wav at the target rate, no more channels than the model reads & long enough to not need padding
+    @staticmethod
+    def CanPassThrough(info: TAudioInfo, targetFormat: TAudioFormat, minDurationMilliseconds: int) -> bool:
+        return (
+            info.container == "wav" and
+            info.codec == "pcm_s16le" and
+            info.sampleRate == targetFormat.sampleRate and
+            info.channels <= targetFormat.maxChannels and
+            info.durationSeconds * 1000 >= minDurationMilliseconds
+        );
+
+    #Decodes, resamples & pads to "minDurationMilliseconds" in one streaming ffmpeg pass,
+    #pydub (which keeps the whole recording in memory) is only used when ffmpeg isn't installed
     @staticmethod
     def ConvertFileToWav(
         originalFilename: str, 
         destFilename: str, 
-        minDurationMilliseconds: str) -> None:
-        
+        minDurationMilliseconds: int,
+        targetFormat: Optional[TAudioFormat] = None, #keeps the source's rate & channels when not given
+        info: Optional[TAudioInfo] = None,
+        timeoutSeconds: Optional[float] = None) -> None: #ffmpeg is killed after this long, pydub can't be stopped
+
+        if SoundUtil.IsFfmpegAvailable():
+            SoundUtil._ConvertWithFfmpeg(originalFilename, destFilename, minDurationMilliseconds, targetFormat, info, timeoutSeconds);
+        else:
+            SoundUtil._ConvertWithPydub(originalFilename, destFilename, minDurationMilliseconds, targetFormat);
+
+    @staticmethod
+    def _ConvertWithFfmpeg(
+        originalFilename: str,
+        destFilename: str,
+        minDurationMilliseconds: int,
+        targetFormat: Optional[TAudioFormat],
+        info: Optional[TAudioInfo],
+        timeoutSeconds: Optional[float]) -> None:
+
+        cmd: List[str] = [
+            "ffmpeg", "-nostdin", "-y", "-v", "error",
+            "-i", originalFilename,
+            "-map", "0:a:0",
+            "-c:a", "pcm_s16le",
+            #Pads with silence up to the minimum duration, longer recordings are left as they are
+            "-af", f"apad=whole_dur={minDurationMilliseconds}ms"
+        ];
+        if not targetFormat is None:
+            channels: int = targetFormat.maxChannels if info is None else max(1, min(info.channels, targetFormat.maxChannels));
+            cmd += ["-ar", str(targetFormat.sampleRate), "-ac", str(channels)];
+        cmd += ["-f", "wav", destFilename];
+
+        completedProcess = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeoutSeconds);
+        if completedProcess.returncode != 0:
+            raise Exception(
+                f"Error decoding <{originalFilename}>, ffmpeg returncode = {completedProcess.returncode}: " +
+                completedProcess.stderr.decode(errors="replace").strip()
+            );
+
+    @staticmethod
+    def _ConvertWithPydub(
+        originalFilename: str,
+        destFilename: str,
+        minDurationMilliseconds: int,
+        targetFormat: Optional[TAudioFormat]) -> None:
+
         decoded: AudioSegment = AudioSegment.from_file(originalFilename);
-        
+        if not targetFormat is None:
+            decoded = decoded.set_frame_rate(targetFormat.sampleRate);
+            if decoded.channels > targetFormat.maxChannels:
+                decoded = decoded.set_channels(targetFormat.maxChannels);
+        decoded = decoded.set_sample_width(2);
+
         #Pad with silent audio if necessary
         fileLengthMillis: Final[int] = len(decoded)
-        if (len(decoded) <= minDurationMilliseconds):
-            paddingMillis: Final[int] = fileLengthMillis - minDurationMilliseconds;
-            decoded = decoded + AudioSegment.silent(paddingMillis);    
+        if (fileLengthMillis < minDurationMilliseconds):
+            paddingMillis: Final[int] = minDurationMilliseconds - fileLengthMillis;
+            decoded = decoded + AudioSegment.silent(paddingMillis, frame_rate=decoded.frame_rate);
 
         decoded.export(destFilename, format="wav");
 
+    #Splits a .wav into windows of "segmentSeconds" that overlap by "overlapSeconds",
+    #a trailing window shorter than half a segment is merged into the one before it
+    @staticmethod
+    def SplitWav(
+        srcFilename: str,
+        destDir: str,
+        segmentSeconds: float,
+        overlapSeconds: float) -> List[TWavSegment]:
+
+        if segmentSeconds <= 0 or not 0 <= overlapSeconds < segmentSeconds / 2:
+            raise ValueError(f"segments of {segmentSeconds:g}s can't overlap by {overlapSeconds:g}s");
+
+        segments: List[TWavSegment] = [];
+        with wave.open(srcFilename, "rb") as hSrc:
+            frameRate: int = hSrc.getframerate();
+            totalFrames: int = hSrc.getnframes();
+            segmentFrames: int = int(segmentSeconds * frameRate);
+            overlapFrames: int = int(overlapSeconds * frameRate);
+
+            startFrame: int = 0;
+            while True:
+                endFrame: int = startFrame + segmentFrames;
+                if totalFrames - endFrame < segmentFrames // 2:
+                    endFrame = totalFrames;
+
+                segmentPath: str = os.path.join(destDir, f"segment-{len(segments)}.wav");
+                hSrc.setpos(startFrame);
+                with wave.open(segmentPath, "wb") as hDest:
+                    hDest.setparams(hSrc.getparams());
+                    hDest.writeframes(hSrc.readframes(endFrame - startFrame));
+
+                segments.append(TWavSegment(segmentPath, startFrame / frameRate, endFrame / frameRate));
+                if endFrame >= totalFrames:
+                    return segments;
+
+                startFrame = endFrame - overlapFrames;
+
+    @staticmethod
+    def GetWavDurationSeconds(filename: str) -> float:
+        with wave.open(filename, "rb") as hFile:
+            return hFile.getnframes() / hFile.getframerate();
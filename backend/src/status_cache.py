@@ -0,0 +1,102 @@
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Dict
+
+from .job_events import GetJobEventBus
+from .schemas import JobEvent
+from .database import IsPostgres
+from .metrics import statusCacheLookups
+from .constants import CONST
+
+@dataclass
+class TCachedResponse:
+    body: bytes
+    etag: str
+    headers: Dict[str, str]
+    version: int
+    expiresAt: float #time.monotonic()
+
+#Serialized /music/status responses, per job & per list query, least recently used go first.
+#Every write to a job is followed by a job event (see JobController), in this process or relayed by the executor,
+#which drops the job's entry & outdates every list before anyone is told about the change.
+#Responses with the progress or ETA of unfinished jobs expire quickly as those change with time.
+class StatusCache:
+    def __init__(self, maxJobs: int, maxLists: int):
+        self._maxJobs: int = maxJobs;
+        self._maxLists: int = maxLists;
+        self._jobs: OrderedDict[int, TCachedResponse] = OrderedDict();
+        self._lists: OrderedDict[str, TCachedResponse] = OrderedDict();
+        #Incremented by every job event
+        self._version: int = 0;
+
+    def _OnEvent(self, event: JobEvent) -> None:
+        self._version += 1;
+        if not event.job_id is None:
+            self._jobs.pop(event.job_id, None);
+
+    #Take before reading the DB & pass to Put*, responses built from rows that changed meanwhile aren't kept
+    def GetVersion(self) -> int:
+        return self._version;
+
+    def GetJob(self, jobId: int) -> Optional[TCachedResponse]:
+        return self._Get(self._jobs, jobId, "job", False);
+
+    def PutJob(self, jobId: int, version: int, body: bytes, hasEstimates: bool) -> TCachedResponse:
+        return self._Put(self._jobs, self._maxJobs, jobId, version, body, {}, hasEstimates);
+
+    def GetList(self, query: str) -> Optional[TCachedResponse]:
+        return self._Get(self._lists, query, "list", True);
+
+    def PutList(self, query: str, version: int, body: bytes, headers: Dict[str, str], hasEstimates: bool) -> TCachedResponse:
+        return self._Put(self._lists, self._maxLists, query, version, body, headers, hasEstimates);
+
+    #Job entries are dropped by the events of their job, lists are outdated by any event
+    def _Get(self, entries: OrderedDict, key, kind: str, checkVersion: bool) -> Optional[TCachedResponse]:
+        entry: Optional[TCachedResponse] = entries.get(key);
+        if not entry is None and (entry.expiresAt <= time.monotonic() or (checkVersion and entry.version != self._version)):
+            del entries[key];
+            entry = None;
+
+        statusCacheLookups.Inc(kind, "miss" if entry is None else "hit");
+        if not entry is None:
+            entries.move_to_end(key);
+        return entry;
+
+    def _Put(
+        self,
+        entries: OrderedDict,
+        maxEntries: int,
+        key,
+        version: int,
+        body: bytes,
+        headers: Dict[str, str],
+        hasEstimates: bool) -> TCachedResponse:
+
+        #Without events from the other nodes sharing a postgres DB, entries are only as fresh as the queue polling
+        maxAgeSeconds: float = CONST.SHARED_QUEUE_POLL_SECONDS if IsPostgres() else CONST.STATUS_CACHE_MAX_AGE_SECONDS;
+        if hasEstimates:
+            maxAgeSeconds = min(maxAgeSeconds, CONST.STATUS_ESTIMATE_MAX_AGE_SECONDS);
+
+        entry = TCachedResponse(
+            body=body,
+            etag=f'"{hashlib.sha1(body).hexdigest()}"',
+            headers=headers,
+            version=version,
+            expiresAt=time.monotonic() + maxAgeSeconds
+        );
+        if version != self._version:
+            return entry;
+
+        entries[key] = entry;
+        entries.move_to_end(key);
+        while len(entries) > maxEntries:
+            entries.popitem(last=False);
+        return entry;
+
+statusCache = StatusCache(CONST.STATUS_CACHE_MAX_JOBS, CONST.STATUS_CACHE_MAX_LISTS);
+GetJobEventBus().AddListener(statusCache._OnEvent);
+
+def GetStatusCache() -> StatusCache:
+    return statusCache;
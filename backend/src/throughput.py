@@ -0,0 +1,230 @@
+import heapq
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, List, Any, Tuple, Callable, Awaitable
+
+from .schemas import TranscriptionJob, JobStatus, StatusName, IsJobDone, ESTIMATE_COLUMN_NAMES
+from .constants import CONST
+from .metrics import computePerAudioSecond
+from .util import CreateLogger
+
+logger = CreateLogger(__name__);
+
+#Inputs shorter than this are padded with silence before they are transcribed (see transcriber.minDurationMilliseconds)
+MIN_TRANSCRIBED_SECONDS: float = 10;
+#Running jobs aren't reported as complete until they are
+MAX_RUNNING_PROGRESS: float = 0.99;
+
+#(progress from 0 to 1, seconds until the job is expected to finish), either is None when unknown
+TJobEstimate = Tuple[Optional[float], Optional[float]];
+
+#Learns the compute seconds needed per second of audio for each mode from completed jobs,
+#as an exponentially weighted average so it follows changes in load & hardware
+class ThroughputModel:
+    def __init__(self, defaultSecondsPerAudioSecond: float, smoothing: float):
+        self._defaultSecondsPerAudioSecond: float = defaultSecondsPerAudioSecond;
+        self._smoothing: float = smoothing;
+
+        self._lock = threading.Lock();
+        self._secondsPerAudioSecond: Dict[str, float] = {};
+
+    #Seeds the model from the most recent jobs, oldest first so newer ones weigh more
+    async def LoadAsync(self) -> None:
+        jobs: List[Dict[str, Any]] = await TranscriptionJob.select(
+            TranscriptionJob.mode,
+            TranscriptionJob.audio_duration,
+            TranscriptionJob.run_start_time,
+            TranscriptionJob.end_time
+        ).where(
+            (TranscriptionJob.status == StatusName(JobStatus.DONE)) &
+            TranscriptionJob.audio_duration.is_not_null() &
+            TranscriptionJob.run_start_time.is_not_null() &
+            TranscriptionJob.end_time.is_not_null()
+        ).order_by(
+            TranscriptionJob.id, ascending=False
+        ).limit(CONST.THROUGHPUT_HISTORY_SIZE);
+
+        for job in reversed(jobs):
+            self.Observe(job["mode"], job["audio_duration"], (job["end_time"] - job["run_start_time"]).total_seconds());
+
+    #Call when a job completes, "computeSeconds" is the time from claim to completion
+    def Observe(self, mode: str, audioSeconds: Optional[float], computeSeconds: float) -> None:
+        if audioSeconds is None or audioSeconds <= 0 or computeSeconds <= 0:
+            return;
+
+        sample: float = computeSeconds / max(audioSeconds, MIN_TRANSCRIBED_SECONDS);
+        with self._lock:
+            previous: Optional[float] = self._secondsPerAudioSecond.get(mode);
+            current: float = sample if previous is None else previous + self._smoothing * (sample - previous);
+            self._secondsPerAudioSecond[mode] = current;
+        computePerAudioSecond.Set(current, mode);
+
+    #Learned cost per mode, for processes that don't run jobs themselves (see executor.py)
+    def GetState(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._secondsPerAudioSecond);
+
+    def SetState(self, secondsPerAudioSecond: Dict[str, float]) -> None:
+        with self._lock:
+            self._secondsPerAudioSecond = dict(secondsPerAudioSecond);
+        for (mode, seconds) in secondsPerAudioSecond.items():
+            computePerAudioSecond.Set(seconds, mode);
+
+    def GetSecondsPerAudioSecond(self, mode: str) -> float:
+        with self._lock:
+            return self._secondsPerAudioSecond.get(mode, self._defaultSecondsPerAudioSecond);
+
+    #The duration is guessed from the upload's size when it couldn't be probed
+    def EstimateSeconds(self, mode: str, audioSeconds: Optional[float], sizeBytes: Optional[int]) -> float:
+        if audioSeconds is None or audioSeconds <= 0:
+            audioSeconds = (sizeBytes or 0) / CONST.ESTIMATED_BYTES_PER_AUDIO_SECOND;
+
+        return max(audioSeconds, MIN_TRANSCRIBED_SECONDS) * self.GetSecondsPerAudioSecond(mode);
+
+    def EstimateJobSeconds(self, job: Dict[str, Any]) -> float:
+        return self.EstimateSeconds(job["mode"], job["audio_duration"], job["source_size"]);
+
+#Estimated work each client has submitted but that hasn't been run yet, as the seconds it would take to run on its own.
+#Kept in memory & updated at once, so submissions racing each other still see each other's work.
+#Each node keeps its own in the process running its jobs (the executor's is shared by all HTTP workers),
+#a client's backlog starts from 0 after a restart.
+class ClientBacklogs:
+    def __init__(self, maxClients: int):
+        self._maxClients: int = maxClients;
+        self._lock = threading.Lock();
+        self._backlogEnds: Dict[str, float] = {}; #client id -> time.time() its backlog would be done
+        self._relay: Optional[Callable[[str, float], Awaitable[float]]] = None;
+
+    #HTTP workers add to the executor's backlogs instead of their own
+    def AttachRelay(self, relay: Callable[[str, float], Awaitable[float]]) -> None:
+        self._relay = relay;
+
+    async def AddAsync(self, clientId: str, seconds: float) -> float:
+        if not self._relay is None:
+            try:
+                return await self._relay(clientId, seconds);
+            except Exception as e:
+                logger.warning(f"Could not reach the executor's client backlogs, using this worker's: {e}");
+        return self.Add(clientId, seconds);
+
+    #Adds a job's estimated seconds to the client's backlog & returns the backlog before it
+    def Add(self, clientId: str, seconds: float) -> float:
+        now: float = time.time();
+        with self._lock:
+            if len(self._backlogEnds) >= self._maxClients and not clientId in self._backlogEnds:
+                self._backlogEnds = {
+                    otherClientId: backlogEnd for (otherClientId, backlogEnd) in self._backlogEnds.items() if backlogEnd > now
+                };
+                #Every client still has work waiting, the ones closest to done are forgotten first
+                if len(self._backlogEnds) >= self._maxClients:
+                    for otherClientId in heapq.nsmallest(
+                        len(self._backlogEnds) - self._maxClients + 1,
+                        self._backlogEnds,
+                        key=self._backlogEnds.__getitem__
+                    ):
+                        del self._backlogEnds[otherClientId];
+
+            backlogEnd: float = max(now, self._backlogEnds.get(clientId, now));
+            self._backlogEnds[clientId] = backlogEnd + seconds;
+            return backlogEnd - now;
+
+#Shortest job first with aging & fair share between clients. A job is only overtaken by
+#- shorter jobs submitted less than CONST.SJF_WEIGHT * (the difference in estimated seconds) after it
+#- other clients' jobs submitted less than CONST.FAIR_SHARE_WEIGHT * "clientBacklogSeconds" after it,
+#  where "clientBacklogSeconds" is the estimated work its client submitted before it (see ClientBacklogs)
+#so no job can starve
+def ComputeScheduleKey(enqueueTime: datetime, estimatedSeconds: float, clientBacklogSeconds: float = 0) -> float:
+    return enqueueTime.timestamp() + CONST.SJF_WEIGHT * estimatedSeconds + CONST.FAIR_SHARE_WEIGHT * clientBacklogSeconds;
+
+#Progress & ETAs of jobs at one point in time. Queued jobs are given to the workers in claim order,
+#each one starting once the worker that frees up first is done, which assumes the queue isn't reordered meanwhile
+class QueueForecast:
+    def __init__(self, model: ThroughputModel, time: datetime, queuedJobEtas: Dict[int, float], secondsUntilWorkerFree: float):
+        self._model: ThroughputModel = model;
+        self._time: datetime = time;
+        self._queuedJobEtas: Dict[int, float] = queuedJobEtas;
+        self._secondsUntilWorkerFree: float = secondsUntilWorkerFree;
+
+    #The queue is only read when one of "jobs" is queued
+    @staticmethod
+    async def CreateAsync(jobs: List[Dict[str, Any]]) -> "QueueForecast":
+        if not any(job["status"] == StatusName(JobStatus.QUEUED) for job in jobs):
+            return QueueForecast(GetThroughputModel(), datetime.now(), {}, 0);
+
+        return await QueueForecast.CreateForQueueAsync();
+
+    @staticmethod
+    async def CreateForQueueAsync() -> "QueueForecast":
+        model: ThroughputModel = GetThroughputModel();
+        estimateColumns = [TranscriptionJob._meta.get_column_by_name(name) for name in ESTIMATE_COLUMN_NAMES];
+        runningJobs: List[Dict[str, Any]] = await TranscriptionJob.select(*estimateColumns).where(
+            TranscriptionJob.status.is_in([StatusName(JobStatus.RUNNING), StatusName(JobStatus.STOPPING)])
+        );
+        queuedJobs: List[Dict[str, Any]] = await TranscriptionJob.select(*estimateColumns).where(
+            TranscriptionJob.status == StatusName(JobStatus.QUEUED)
+        ).order_by(
+            TranscriptionJob.priority, ascending=False
+        ).order_by(
+            TranscriptionJob.schedule_key
+        ).order_by(
+            TranscriptionJob.id
+        );
+
+        forecast = QueueForecast(model, datetime.now(), {}, 0);
+        #Seconds until each worker is free
+        workerFreeTimes: List[float] = [forecast._GetRunningEstimate(job)[1] or 0 for job in runningJobs];
+        workerFreeTimes += [0] * max(0, CONST.MAX_CONCURRENT_JOBS - len(workerFreeTimes));
+        heapq.heapify(workerFreeTimes);
+        forecast._secondsUntilWorkerFree = workerFreeTimes[0];
+
+        for job in queuedJobs:
+            finishTime: float = heapq.heappop(workerFreeTimes) + model.EstimateJobSeconds(job);
+            forecast._queuedJobEtas[job["id"]] = finishTime;
+            heapq.heappush(workerFreeTimes, finishTime);
+
+        return forecast;
+
+    #Until the next queued job is expected to be claimed, only known for forecasts of the queue
+    def GetSecondsUntilWorkerFree(self) -> float:
+        return self._secondsUntilWorkerFree;
+
+    #"job" needs the columns in schemas.ESTIMATE_COLUMN_NAMES
+    def Estimate(self, job: Dict[str, Any]) -> TJobEstimate:
+        status: str = job["status"];
+        if status == StatusName(JobStatus.DONE):
+            return (1.0, 0.0);
+        if IsJobDone(status):
+            return (None, None);
+        if status == StatusName(JobStatus.QUEUED):
+            return (0.0, self._RoundSeconds(self._queuedJobEtas.get(job["id"])));
+        if status in [StatusName(JobStatus.RUNNING), StatusName(JobStatus.STOPPING)]:
+            (progress, etaSeconds) = self._GetRunningEstimate(job);
+            return (progress, self._RoundSeconds(etaSeconds));
+
+        #Still uploading
+        return (0.0, None);
+
+    def _GetRunningEstimate(self, job: Dict[str, Any]) -> TJobEstimate:
+        if job["run_start_time"] is None:
+            return (None, None);
+
+        estimatedSeconds: float = self._model.EstimateJobSeconds(job);
+        elapsedSeconds: float = max(0, (self._time - job["run_start_time"]).total_seconds());
+        return (
+            round(min(MAX_RUNNING_PROGRESS, elapsedSeconds / estimatedSeconds), 3) if estimatedSeconds > 0 else None,
+            max(0, estimatedSeconds - elapsedSeconds)
+        );
+
+    @staticmethod
+    def _RoundSeconds(seconds: Optional[float]) -> Optional[float]:
+        return round(seconds, 1) if not seconds is None else None;
+
+throughputModel = ThroughputModel(CONST.DEFAULT_COMPUTE_SECONDS_PER_AUDIO_SECOND, CONST.THROUGHPUT_SMOOTHING);
+clientBacklogs = ClientBacklogs(CONST.MAX_TRACKED_CLIENTS);
+
+def GetThroughputModel() -> ThroughputModel:
+    return throughputModel;
+
+def GetClientBacklogs() -> ClientBacklogs:
+    return clientBacklogs;
@@ -0,0 +1,236 @@
+import os
+import re
+import hashlib
+import shutil
+import uuid
+import zipfile
+from dataclasses import dataclass, field
+from typing import Optional, Dict, List, BinaryIO
+from sanic import Request
+from sanic.exceptions import SanicException
+
+from .util import SanitiseFilename
+from .constants import CONST
+
+@dataclass
+class TUploadedFile:
+    name: str #Filename as sent by the client
+    path: str
+    sha256: str
+    size: int
+
+@dataclass
+class TMultipartUpload:
+    dir: str #Holds every uploaded file, owned by the caller
+    files: Dict[str, List[TUploadedFile]] = field(default_factory=dict) #keyed by form field name
+    fields: Dict[str, str] = field(default_factory=dict) #non-file form fields
+
+    def GetFile(self, fieldName: str) -> Optional[TUploadedFile]:
+        files: List[TUploadedFile] = self.files.get(fieldName, []);
+        return files[0] if len(files) > 0 else None;
+
+    def Discard(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True);
+
+class _PartSink:
+    def __init__(self, upload: TMultipartUpload, headers: Dict[str, str]):
+        disposition: str = headers.get("content-disposition", "");
+        nameMatch = re.search(r'(?:^|;)\s*name="([^"]*)"', disposition);
+        filenameMatch = re.search(r'(?:^|;)\s*filename="([^"]*)"', disposition);
+
+        self._upload: TMultipartUpload = upload;
+        self._fieldName: str = nameMatch.group(1) if nameMatch else "";
+        self._filename: Optional[str] = filenameMatch.group(1) if filenameMatch else None;
+
+        self._hFile: Optional[BinaryIO] = None;
+        self._path: str = "";
+        self._hasher = hashlib.sha256();
+        self._size: int = 0;
+        self._value: bytearray = bytearray();
+
+        if not self._filename is None:
+            fileNo: int = sum(len(files) for files in upload.files.values());
+            #Prefixed so identically named files in one request can't overwrite each other
+            self._path = os.path.join(upload.dir, f"{fileNo}-{SanitiseFilename(os.path.basename(self._filename))}");
+            self._hFile = open(self._path, "wb");
+
+    def Write(self, data: bytes) -> None:
+        self._size += len(data);
+        if self._hFile is None:
+            if self._size > CONST.MAX_FORM_FIELD_BYTES:
+                raise SanicException(f"form field <{self._fieldName}> is too large", 413);
+            self._value += data;
+            return;
+
+        if self._size > CONST.MAX_UPLOAD_BYTES:
+            raise SanicException(f"file exceeds the upload limit of {CONST.MAX_UPLOAD_BYTES} bytes", 413);
+        self._hasher.update(data);
+        self._hFile.write(data);
+
+    def Close(self) -> None:
+        if self._hFile is None:
+            self._upload.fields[self._fieldName] = self._value.decode("utf-8", errors="replace");
+            return;
+
+        self._hFile.close();
+        self._hFile = None;
+        self._upload.files.setdefault(self._fieldName, []).append(
+            TUploadedFile(
+                name=self._filename,
+                path=self._path,
+                sha256=self._hasher.hexdigest(),
+                size=self._size
+            )
+        );
+
+    def Abort(self) -> None:
+        if not self._hFile is None:
+            self._hFile.close();
+
+#Incremental multipart/form-data parser, file parts are written to disk & hashed as they arrive
+#so a request never has to be held in memory
+class MultipartStreamParser:
+    def __init__(self, boundary: bytes, upload: TMultipartUpload):
+        #Every delimiter after the first is preceded by CRLF, the leading CRLF makes the first one match too
+        self._delimiter: bytes = b"\r\n--" + boundary;
+        self._buffer: bytearray = bytearray(b"\r\n");
+        self._upload: TMultipartUpload = upload;
+        self._state: str = "delimiter"; #"delimiter" -> "headers" -> "body" -> "delimiter" ... -> "end"
+        self._part: Optional[_PartSink] = None;
+
+    def Feed(self, chunk: bytes) -> None:
+        self._buffer += chunk;
+
+        while True:
+            if self._state == "delimiter":
+                index: int = self._buffer.find(self._delimiter);
+                if index < 0:
+                    #Preamble, only the tail might belong to the delimiter
+                    del self._buffer[:-len(self._delimiter)];
+                    return;
+
+                afterDelimiter: int = index + len(self._delimiter);
+                if len(self._buffer) < afterDelimiter + 2:
+                    return;
+
+                suffix: bytes = bytes(self._buffer[afterDelimiter:afterDelimiter + 2]);
+                del self._buffer[:afterDelimiter + 2];
+                self._state = "end" if suffix == b"--" else "headers";
+
+            elif self._state == "headers":
+                index = self._buffer.find(b"\r\n\r\n");
+                if index < 0:
+                    if len(self._buffer) > CONST.MAX_FORM_FIELD_BYTES:
+                        raise SanicException("multipart headers are too large", 400);
+                    return;
+
+                headers: Dict[str, str] = {};
+                for line in bytes(self._buffer[:index]).decode("utf-8", errors="replace").split("\r\n"):
+                    (name, _, value) = line.partition(":");
+                    headers[name.strip().lower()] = value.strip();
+                del self._buffer[:index + 4];
+
+                self._part = _PartSink(self._upload, headers);
+                self._state = "body";
+
+            elif self._state == "body":
+                index = self._buffer.find(self._delimiter);
+                if index < 0:
+                    #The tail may hold the start of a delimiter split across chunks
+                    safeLength: int = len(self._buffer) - len(self._delimiter);
+                    if safeLength > 0:
+                        self._part.Write(bytes(self._buffer[:safeLength]));
+                        del self._buffer[:safeLength];
+                    return;
+
+                self._part.Write(bytes(self._buffer[:index]));
+                self._part.Close();
+                self._part = None;
+                del self._buffer[:index];
+                self._state = "delimiter";
+
+            else:
+                self._buffer.clear();
+                return;
+
+    def Finish(self) -> None:
+        if self._state != "end":
+            self.Abort();
+            raise SanicException("incomplete multipart body", 400);
+
+    def Abort(self) -> None:
+        if not self._part is None:
+            self._part.Abort();
+
+def _GetBoundary(request: Request) -> bytes:
+    contentType: str = request.headers.get("content-type", "");
+    boundaryMatch = re.search(r'boundary="?([^";]+)"?', contentType);
+    if not contentType.startswith("multipart/form-data") or boundaryMatch is None:
+        raise SanicException("expected a multipart/form-data body", 400);
+
+    return boundaryMatch.group(1).encode("latin-1");
+
+#For routes declared with stream=True, the body is parsed as it arrives into a new directory below "parentDir"
+async def ReceiveMultipartUpload(request: Request, parentDir: str = CONST.UPLOAD_DIR) -> TMultipartUpload:
+    uploadDir: str = os.path.join(parentDir, "incoming", uuid.uuid4().hex);
+    os.makedirs(uploadDir);
+
+    upload = TMultipartUpload(uploadDir);
+    parser = MultipartStreamParser(_GetBoundary(request), upload);
+    try:
+        while True:
+            chunk: Optional[bytes] = await request.stream.read();
+            if chunk is None:
+                break;
+            parser.Feed(chunk);
+
+        parser.Finish();
+        return upload;
+    except BaseException:
+        parser.Abort();
+        upload.Discard();
+        raise;
+
+#Extracts the members of an uploaded zip archive next to it, hashing them on the way,
+#the archive itself is removed afterwards. Blocking, run it in an executor
+def ExpandZipUpload(upload: TMultipartUpload, archive: TUploadedFile) -> List[TUploadedFile]:
+    expandedFiles: List[TUploadedFile] = [];
+    try:
+        hZip = zipfile.ZipFile(archive.path);
+    except zipfile.BadZipFile:
+        raise SanicException(f"<{archive.name}> is not a valid zip archive", 400);
+
+    with hZip:
+        members: List[zipfile.ZipInfo] = [
+            member for member in hZip.infolist()
+            if not member.is_dir() and not os.path.basename(member.filename).startswith(".")
+        ];
+        if len(members) > CONST.MAX_BATCH_INPUTS:
+            raise SanicException(f"<{archive.name}> holds more than {CONST.MAX_BATCH_INPUTS} files", 413);
+
+        #Checked while extracting, the sizes in the archive's directory can't be trusted
+        totalSize: int = 0;
+        for (memberNo, member) in enumerate(members):
+            name: str = os.path.basename(member.filename);
+            path: str = os.path.join(upload.dir, f"zip-{memberNo}-{SanitiseFilename(name)}");
+            hasher = hashlib.sha256();
+            size: int = 0;
+
+            with hZip.open(member) as hSrc, open(path, "wb") as hDst:
+                while True:
+                    chunk: bytes = hSrc.read(CONST.FILE_CHUNK_SIZE);
+                    if len(chunk) == 0:
+                        break;
+
+                    size += len(chunk);
+                    totalSize += len(chunk);
+                    if totalSize > CONST.MAX_UPLOAD_BYTES:
+                        raise SanicException(f"<{archive.name}> exceeds the upload limit of {CONST.MAX_UPLOAD_BYTES} bytes", 413);
+
+                    hasher.update(chunk);
+                    hDst.write(chunk);
+
+            expandedFiles.append(TUploadedFile(name=name, path=path, sha256=hasher.hexdigest(), size=size));
+
+    os.remove(archive.path);
+    return expandedFiles;
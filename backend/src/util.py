@@ -2,7 +2,9 @@ from sanic import Sanic
 from logging import Logger, StreamHandler, Formatter
 from pathlib import Path
 import os
-import concurrent.futures
+import shutil
+import importlib.metadata
+from functools import lru_cache
 from typing import Dict, Any, cast
 import re
 from datetime import datetime
@@ -37,11 +39,45 @@ def GetFilenameWithoutExtension(path: str) -> str:
 def GetFilenameWithExtension(path: str) -> str:
     return os.path.basename(path);
 
-
-threadpool = concurrent.futures.ThreadPoolExecutor();
-
-def GetThreadpool() -> concurrent.futures.ThreadPoolExecutor:
-    return threadpool;
+#Each job gets its own upload directory, so identically named uploads can't collide
+def GetUploadPath(jobId: int, filename: str) -> str:
+    return os.path.join(CONST.UPLOAD_DIR, str(jobId), SanitiseFilename(filename));
+
+#Inputs of a batch share one parent directory, one subdirectory per input
+def GetBatchUploadPath(batchId: int, inputNo: int, filename: str) -> str:
+    return os.path.join(CONST.UPLOAD_DIR, f"batch-{batchId}", str(inputNo), SanitiseFilename(filename));
+
+def GetPartialResultPath(jobId: int) -> str:
+    return os.path.join(CONST.PARTIAL_RESULT_DIR, f"{jobId}.mid");
+
+def RemovePartialResult(jobId: int) -> None:
+    try:
+        os.remove(GetPartialResultPath(jobId));
+    except FileNotFoundError:
+        pass;
+
+def RemoveUpload(path: str) -> None:
+    uploadDir: str = os.path.dirname(path);
+    shutil.rmtree(uploadDir, ignore_errors=True);
+
+    #Batch directories are removed along with their last input
+    parentDir: str = os.path.dirname(uploadDir);
+    if os.path.basename(parentDir).startswith("batch-"):
+        try:
+            os.rmdir(parentDir);
+        except OSError:
+            pass;
+
+#Part of the result cache key, results from other versions/mocks are never reused
+@lru_cache(maxsize=None)
+def GetOmnizartVersion() -> str:
+    if CONST.MOCK_OMNIZART:
+        return "mock";
+
+    try:
+        return importlib.metadata.version("omnizart");
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown";
 
 def ConvertDatetimeToIsoString(data: Dict[str, Any]) -> Dict[str, Any]:
     def ConvertDatetimeToISOString(value: Any) -> Any:
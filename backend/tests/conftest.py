@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+from typing import Iterator
+
+import pytest
+
+#The DB is picked when src is imported: a sqlite DB of the test run by default, or with
+#TRANSCRIBER_DB_ENGINE=postgres the database TRANSCRIBER_POSTGRES_DATABASE, whose tables are dropped by the tests
+testDir: str = tempfile.mkdtemp(prefix="transcriber-tests-");
+os.environ.setdefault("PICCOLO_CONF", "src.piccolo_conf");
+os.environ.setdefault("TRANSCRIBER_SQLITE_PATH", os.path.join(testDir, "db.sqlite"));
+os.environ.setdefault("TRANSCRIBER_UPLOAD_DIR", os.path.join(testDir, "uploads"));
+os.environ.setdefault("TRANSCRIBER_RESULT_STORE_DIR", os.path.join(testDir, "results"));
+os.environ.setdefault("TRANSCRIBER_NODE_ID", "test-node");
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))));
+
+from src.migrations import ApplyMigrations
+from src.schemas import SchemaMigration
+from src.database import IsPostgres
+from src.util import CreateLogger
+
+TABLE_NAMES = ["schema_migration", "transcription_job", "batch_job", "completed_job"];
+
+def DropTables() -> None:
+    for tablename in TABLE_NAMES:
+        SchemaMigration.raw(f"DROP TABLE IF EXISTS {tablename}{' CASCADE' if IsPostgres() else ''}").run_sync();
+
+#An empty DB with every migration applied
+@pytest.fixture
+def db() -> Iterator[None]:
+    DropTables();
+    ApplyMigrations(CreateLogger("tests"));
+    yield;
+
+#A DB without any table
+@pytest.fixture
+def emptyDb() -> Iterator[None]:
+    DropTables();
+    yield;
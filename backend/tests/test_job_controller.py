@@ -0,0 +1,168 @@
+import asyncio
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from src.JobController import JobController
+from src.schemas import TranscriptionJob, JobStatus, StatusName
+from src.database import IsPostgres
+from src.constants import CONST
+from src.util import CreateLogger
+
+def _InsertJob(
+    status: JobStatus,
+    priority: int = 0,
+    scheduleKey: Optional[float] = None,
+    node: Optional[str] = CONST.NODE_ID,
+    sourcePath: Optional[str] = None,
+    requestTerminate: bool = False,
+    clientId: Optional[str] = None) -> int:
+
+    return TranscriptionJob.insert(TranscriptionJob(
+        filename="a.wav",
+        mode="music",
+        start_time=datetime.now(),
+        end_time=None,
+        request_terminate=requestTerminate,
+        status=StatusName(status),
+        msg="",
+        priority=priority,
+        schedule_key=scheduleKey,
+        source_path=sourcePath,
+        node=node,
+        client_id=clientId
+    )).run_sync()[0]["id"];
+
+def _GetJob(jobId: int) -> Dict[str, Any]:
+    return TranscriptionJob.select().where(TranscriptionJob.id == jobId).first().run_sync();
+
+#Like uploads, each in a directory of its own
+def _CreateSource(tmp_path, name: str) -> str:
+    os.makedirs(tmp_path / name);
+    path: str = str(tmp_path / name / "a.wav");
+    with open(path, "wb") as hFile:
+        hFile.write(b"RIFF");
+    return path;
+
+def testClaimsByPriorityThenScheduleKey(db):
+    late: int = _InsertJob(JobStatus.QUEUED, scheduleKey=20);
+    early: int = _InsertJob(JobStatus.QUEUED, scheduleKey=10);
+    urgent: int = _InsertJob(JobStatus.QUEUED, priority=1, scheduleKey=30);
+    tie: int = _InsertJob(JobStatus.QUEUED, scheduleKey=20);
+    _InsertJob(JobStatus.RUNNING, priority=2);
+
+    claimedIds: List[int] = [];
+    while True:
+        job: Optional[Dict[str, Any]] = JobController.ClaimNextQueuedJob();
+        if job is None:
+            break;
+        assert job["status"] == StatusName(JobStatus.RUNNING);
+        assert job["node"] == CONST.NODE_ID;
+        claimedIds.append(job["id"]);
+
+    assert claimedIds == [urgent, early, late, tie];
+    for jobId in claimedIds:
+        job = _GetJob(jobId);
+        assert job["status"] == StatusName(JobStatus.RUNNING);
+        assert not job["run_start_time"] is None;
+
+#Workers claiming at the same time never get the same job (FOR UPDATE SKIP LOCKED on postgres)
+def testConcurrentClaimsDontShareJobs(db):
+    jobIds: List[int] = [_InsertJob(JobStatus.QUEUED, scheduleKey=i) for i in range(24)];
+    claimedIds: List[int] = [];
+    claimedIdsLock = threading.Lock();
+
+    def Claim() -> None:
+        while True:
+            job: Optional[Dict[str, Any]] = JobController.ClaimNextQueuedJob();
+            if job is None:
+                return;
+            with claimedIdsLock:
+                claimedIds.append(job["id"]);
+
+    workers: List[threading.Thread] = [threading.Thread(target=Claim) for _ in range(4)];
+    for worker in workers:
+        worker.start();
+    for worker in workers:
+        worker.join();
+
+    assert sorted(claimedIds) == jobIds;
+    assert TranscriptionJob.count().where(
+        TranscriptionJob.status == StatusName(JobStatus.RUNNING)
+    ).run_sync() == len(jobIds);
+
+def testRecoversInterruptedJobs(db, tmp_path):
+    running: int = _InsertJob(JobStatus.RUNNING, sourcePath=_CreateSource(tmp_path, "running"));
+    sourceGone: int = _InsertJob(JobStatus.RUNNING, sourcePath=str(tmp_path / "gone" / "a.wav"));
+    uploading: int = _InsertJob(JobStatus.NONE, sourcePath=_CreateSource(tmp_path, "uploading"));
+    stopping: int = _InsertJob(
+        JobStatus.STOPPING, sourcePath=_CreateSource(tmp_path, "stopping"), requestTerminate=True
+    );
+    queued: int = _InsertJob(JobStatus.QUEUED, sourcePath=_CreateSource(tmp_path, "queued"));
+    done: int = _InsertJob(JobStatus.DONE);
+
+    asyncio.run(JobController.RecoverInterruptedJobsAsync(CreateLogger("tests")));
+
+    assert _GetJob(running)["status"] == StatusName(JobStatus.QUEUED);
+    assert os.path.isfile(tmp_path / "running" / "a.wav");
+    assert _GetJob(sourceGone)["status"] == StatusName(JobStatus.ERROR);
+    assert _GetJob(uploading)["status"] == StatusName(JobStatus.ERROR);
+    assert not os.path.exists(tmp_path / "uploading");
+    assert _GetJob(stopping)["status"] == StatusName(JobStatus.TERMINATED);
+    assert not os.path.exists(tmp_path / "stopping");
+    assert _GetJob(queued)["status"] == StatusName(JobStatus.QUEUED);
+    assert _GetJob(done)["status"] == StatusName(JobStatus.DONE);
+
+#With sqlite every job is this node's, whatever node id it was claimed under (e.g. an older hostname),
+#with postgres the jobs of other nodes are still running there
+def testRecoversJobsOfOtherNodesOnlyOnSqlite(db, tmp_path):
+    otherNode: int = _InsertJob(JobStatus.RUNNING, node="other-node", sourcePath=_CreateSource(tmp_path, "a"));
+    noNode: int = _InsertJob(JobStatus.RUNNING, node=None, sourcePath=_CreateSource(tmp_path, "b"));
+
+    asyncio.run(JobController.RecoverInterruptedJobsAsync(CreateLogger("tests")));
+
+    assert _GetJob(otherNode)["status"] == StatusName(JobStatus.RUNNING if IsPostgres() else JobStatus.QUEUED);
+    assert _GetJob(noNode)["status"] == StatusName(JobStatus.QUEUED);
+
+def testCancellingQueuedJobTerminatesItRightAway(db, tmp_path):
+    cancelled: int = _InsertJob(
+        JobStatus.QUEUED, priority=1, sourcePath=_CreateSource(tmp_path, "cancelled"), clientId="client"
+    );
+    queued: int = _InsertJob(JobStatus.QUEUED, sourcePath=_CreateSource(tmp_path, "queued"), clientId="client");
+
+    assert asyncio.run(JobController.MarkJobForTermination(cancelled));
+
+    job: Dict[str, Any] = _GetJob(cancelled);
+    assert job["status"] == StatusName(JobStatus.TERMINATED);
+    assert not job["end_time"] is None;
+    assert not os.path.exists(tmp_path / "cancelled");
+    assert asyncio.run(JobController.CountQueuedJobsAsync()) == 1;
+    assert asyncio.run(JobController.CountActiveJobsAsync("client")) == 1;
+    assert JobController.PeekNextQueuedJob()["id"] == queued;
+    assert JobController.ClaimNextQueuedJob()["id"] == queued;
+    assert JobController.ClaimNextQueuedJob() is None;
+
+#Jobs sharing an upload keep it until the last of them is finished
+def testCancellingQueuedJobKeepsSharedUpload(db, tmp_path):
+    sourcePath: str = _CreateSource(tmp_path, "shared");
+    cancelled: int = _InsertJob(JobStatus.QUEUED, sourcePath=sourcePath);
+    _InsertJob(JobStatus.QUEUED, sourcePath=sourcePath);
+
+    assert asyncio.run(JobController.MarkJobForTermination(cancelled));
+
+    assert _GetJob(cancelled)["status"] == StatusName(JobStatus.TERMINATED);
+    assert os.path.isfile(sourcePath);
+
+#Finished jobs aren't written to, cached status responses of them stay valid
+def testCancellingOtherJobs(db):
+    running: int = _InsertJob(JobStatus.RUNNING);
+    done: int = _InsertJob(JobStatus.DONE);
+
+    assert asyncio.run(JobController.MarkJobForTermination(running));
+    assert asyncio.run(JobController.MarkJobForTermination(done));
+    assert not asyncio.run(JobController.MarkJobForTermination(done + 1));
+
+    assert _GetJob(running)["request_terminate"];
+    assert _GetJob(running)["status"] == StatusName(JobStatus.RUNNING);
+    assert not _GetJob(done)["request_terminate"];
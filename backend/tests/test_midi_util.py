@@ -0,0 +1,50 @@
+from typing import List, Tuple
+
+import pytest
+
+from src.midi_util import MidiUtil, TMidiFile, TMidiNote, TMidiSegment
+
+#Two 10s segments overlapping by 2s, the seam between the parts they own is at 9s
+SEAM_SECONDS: float = 2;
+
+def _Stitch(tmp_path, firstNotes: List[TMidiNote], secondNotes: List[TMidiNote]) -> List[Tuple[float, float, int]]:
+    segments: List[TMidiSegment] = [
+        TMidiSegment(str(tmp_path / "0.mid"), 0, 0, 9),
+        TMidiSegment(str(tmp_path / "1.mid"), 8, 9, 18)
+    ];
+    for (segment, notes) in zip(segments, [firstNotes, secondNotes]):
+        MidiUtil.Write(TMidiFile(notes=notes), segment.path);
+
+    MidiUtil.Stitch(segments, str(tmp_path / "stitched.mid"), SEAM_SECONDS);
+    return [
+        (pytest.approx(note.start, abs=0.01), pytest.approx(note.end, abs=0.01), note.pitch)
+        for note in MidiUtil.Read(str(tmp_path / "stitched.mid")).notes
+    ];
+
+def _Note(start: float, end: float, pitch: int = 60) -> TMidiNote:
+    return TMidiNote(start, end, pitch, 100, 0);
+
+#The 2nd segment picks the note up shortly after the seam, cut off where the 1st segment ends
+def testNoteHeldAcrossSeamIsMerged(tmp_path):
+    stitched = _Stitch(tmp_path, [_Note(5, 10)], [_Note(1.2, 4)]);
+
+    assert stitched == [(5, 12, 60)];
+
+def testRepeatedNotesOfOneSegmentStaySeparate(tmp_path):
+    stitched = _Stitch(
+        tmp_path,
+        [_Note(1, 1.5), _Note(1.5, 2), _Note(8.5, 9)],
+        [_Note(1.2, 1.5), _Note(1.5, 2)]
+    );
+
+    assert stitched == [(1, 1.5, 60), (1.5, 2, 60), (8.5, 9, 60), (9.2, 9.5, 60), (9.5, 10, 60)];
+
+#Notes starting in the overlap are transcribed by both segments, only the segment owning their start keeps them
+def testNotesOutsideOwnedPartAreDropped(tmp_path):
+    stitched = _Stitch(
+        tmp_path,
+        [_Note(8.5, 8.8, 62), _Note(9.5, 9.8, 64)],
+        [_Note(0.5, 0.8, 62), _Note(1.5, 1.8, 64)]
+    );
+
+    assert stitched == [(8.5, 8.8, 62), (9.5, 9.8, 64)];
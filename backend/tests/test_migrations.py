@@ -0,0 +1,88 @@
+from datetime import datetime
+from typing import Any, Dict, List, Set
+
+from src.migrations import ApplyMigrations, migrations
+from src.schemas import CompletedJob, BatchJob, TranscriptionJob, SchemaMigration
+from src.database import IsPostgres
+from src.util import CreateLogger
+
+def _GetColumnNames(tablename: str) -> Set[str]:
+    rows: List[Dict[str, Any]] = (
+        SchemaMigration.raw(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = {}", tablename
+        ) if IsPostgres() else
+        SchemaMigration.raw(f"PRAGMA table_info({tablename})")
+    ).run_sync();
+    return set(row.get("column_name", row.get("name")) for row in rows);
+
+def _GetIndexedColumnNames(tablename: str) -> Set[str]:
+    if IsPostgres():
+        return set(row["attname"] for row in SchemaMigration.raw(
+            """
+            SELECT attname FROM pg_index
+            JOIN pg_attribute ON attrelid = indrelid AND attnum = ANY(indkey)
+            WHERE indrelid = {}::regclass AND NOT indisprimary
+            """,
+            tablename
+        ).run_sync());
+
+    #Indexes of UNIQUE constraints aren't declared with "index"
+    columnNames: Set[str] = set();
+    for index in SchemaMigration.raw(f"PRAGMA index_list({tablename})").run_sync():
+        if index["origin"] == "c":
+            columnNames |= set(
+                row["name"] for row in SchemaMigration.raw(f"PRAGMA index_info({index['name']})").run_sync()
+            );
+    return columnNames;
+
+def _GetIndexedColumns(table) -> Set[str]:
+    return set(column._meta.db_column_name for column in table._meta.columns if column._meta.index);
+
+def _GetAppliedNames() -> List[str]:
+    return [
+        row["name"] for row in SchemaMigration.select(SchemaMigration.name).order_by(SchemaMigration.id).run_sync()
+    ];
+
+def testFreshDbMatchesSchemas(db):
+    assert _GetAppliedNames() == [name for (name, _) in migrations];
+    for table in [CompletedJob, BatchJob, TranscriptionJob]:
+        assert _GetColumnNames(table._meta.tablename) == set(
+            column._meta.db_column_name for column in table._meta.columns
+        );
+        assert _GetIndexedColumnNames(table._meta.tablename) == _GetIndexedColumns(table);
+
+def testMigrationsAreAppliedOnce(db):
+    TranscriptionJob.insert(TranscriptionJob(filename="a.wav", mode="music", status="DONE")).run_sync();
+    ApplyMigrations(CreateLogger("tests"));
+
+    assert _GetAppliedNames() == [name for (name, _) in migrations];
+    assert TranscriptionJob.count().run_sync() == 1;
+
+#DBs from before migrations were introduced have no schema_migration table & only some of the columns
+def testPreMigrationDbIsUpgraded(emptyDb):
+    startTime = datetime(2024, 1, 2, 3, 4, 5);
+    SchemaMigration.raw(
+        """
+        CREATE TABLE transcription_job (
+            id INTEGER PRIMARY KEY, filename TEXT NOT NULL, mode TEXT NOT NULL, start_time TIMESTAMP NOT NULL,
+            end_time TIMESTAMP, request_terminate BOOLEAN NOT NULL, status TEXT NOT NULL, msg TEXT NOT NULL
+        )
+        """
+    ).run_sync();
+    SchemaMigration.raw(
+        "INSERT INTO transcription_job VALUES (1, 'a.wav', 'music', {}, NULL, false, 'QUEUED', '')",
+        startTime
+    ).run_sync();
+
+    ApplyMigrations(CreateLogger("tests"));
+
+    assert _GetAppliedNames() == [name for (name, _) in migrations];
+    assert _GetColumnNames("transcription_job") == set(
+        column._meta.db_column_name for column in TranscriptionJob._meta.columns
+    );
+    assert _GetIndexedColumnNames("transcription_job") == _GetIndexedColumns(TranscriptionJob);
+    job: Dict[str, Any] = TranscriptionJob.select().where(TranscriptionJob.id == 1).first().run_sync();
+    assert job["status"] == "QUEUED";
+    assert job["filename"] == "a.wav";
+    #Keeps its FIFO position among the jobs queued before duration-aware scheduling
+    assert job["schedule_key"] == startTime.timestamp();
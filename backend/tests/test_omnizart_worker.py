@@ -0,0 +1,22 @@
+import pytest
+
+from src.omnizart_worker import _ResetPeakRss, _ReadPeakRssBytes
+
+BYTES_PER_MB: int = 1024 * 1024;
+
+#A job's peak memory doesn't carry over to the next jobs of the same worker
+def testPeakRssIsPerRun():
+    if not _ResetPeakRss():
+        pytest.skip("the peak RSS can't be reset here");
+
+    largeJob: bytearray = bytearray(256 * BYTES_PER_MB);
+    largePeakBytes: int = _ReadPeakRssBytes();
+    del largeJob;
+
+    assert _ResetPeakRss();
+    smallJob: bytearray = bytearray(16 * BYTES_PER_MB);
+    smallPeakBytes: int = _ReadPeakRssBytes();
+    del smallJob;
+
+    assert largePeakBytes >= 256 * BYTES_PER_MB;
+    assert smallPeakBytes < largePeakBytes - 128 * BYTES_PER_MB;